@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, has_request_context, request, jsonify, stream_with_context
 from flask_cors import CORS
 import tempfile
 import os
@@ -6,7 +6,26 @@ import subprocess
 # Force redeploy - fixed get_user function with explicit column selection
 import json
 import sqlite3
+import hashlib
+import hmac
+import io
+import multiprocessing
+import signal
+import tarfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError, as_completed
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
+from typing import List, NamedTuple, Optional
+
+from database import DatabaseUnavailable, PooledSession, PostgresPool, execute_pooled
+from extraction_jobs import DONE, FAILED, JobQueue, QueueFull
+from result_cache import ResultCache
+from main import (ENGINE_VERSION, LexiconArtifact, MappedLexiconFile, MedicationExtractionPipeline,
+                  PipelineInstrumentation, _init_tracked_batch_worker, _process_document_in_worker,
+                  _start_batch_workers)
 
 # Database imports - psycopg2 for PostgreSQL/Supabase
 try:
@@ -21,11 +40,344 @@ except ImportError:
 app = Flask(__name__)
 CORS(app)  # Enable CORS for frontend access
 
+# Built by `python main.py compile-lexicon` (see render.yaml buildCommand)
+LEXICON_ARTIFACT_PATH = os.environ.get('LEXICON_ARTIFACT', 'Medication-label-set.lexicon')
+# Lexicon source watched for changes; each version is compiled into LEXICON_DIR
+LEXICON_SOURCE_PATH = os.environ.get('LEXICON_SOURCE', 'Medication-label-set.csv')
+LEXICON_DIR = os.environ.get('LEXICON_DIR', 'lexicons')
+LEXICON_RELOAD_INTERVAL = int(os.environ.get('LEXICON_RELOAD_INTERVAL', '60'))  # seconds, 0 disables polling
+LEXICON_KEEP_VERSIONS = 3
+# Bearer token for admin endpoints that change server state; unset disables them
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+# 'inprocess' (default): warm pipeline per lexicon version; 'subprocess': a fresh main.py per document
+EXTRACTION_MODE = os.environ.get('EXTRACTION_MODE', 'inprocess')
+# A thread cannot be stopped, so /process-document sends larger uploads to a warm batch worker,
+# whose pool is killed and rebuilt if one runs past DOCUMENT_TIMEOUT seconds
+INPROCESS_MAX_BYTES = int(os.environ.get('INPROCESS_MAX_BYTES', str(2 * 1024 * 1024)))
+DOCUMENT_TIMEOUT = int(os.environ.get('DOCUMENT_TIMEOUT', '60'))
+# Asynchronous jobs (/jobs) run on the warm pipeline in a bounded pool of worker threads
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '2'))
+JOB_USER_CONCURRENCY = int(os.environ.get('JOB_USER_CONCURRENCY', '1'))  # running jobs per user
+JOB_MAX_PENDING = int(os.environ.get('JOB_MAX_PENDING', '1000'))
+JOB_RETENTION = int(os.environ.get('JOB_RETENTION', '3600'))  # seconds a finished job's result is kept
+JOB_MAX_BYTES = int(os.environ.get('JOB_MAX_BYTES', str(256 * 1024 * 1024)))  # queued documents + kept results
+JOB_LEXICON_WAIT = 300  # seconds a job waits for the first lexicon load
+# /process-batch fans documents out to this many worker processes (1 = the warm pipeline, in the request)
+BATCH_WORKERS = int(os.environ.get('BATCH_WORKERS', str(os.cpu_count() or 1)))
+BATCH_MAX_DOCUMENTS = int(os.environ.get('BATCH_MAX_DOCUMENTS', '500'))
+BATCH_MAX_BYTES = int(os.environ.get('BATCH_MAX_BYTES', str(200 * 1024 * 1024)))  # uncompressed, per batch
+BATCH_DOCUMENT_EXTENSIONS = ('.html', '.htm')
+# Server-side state kept between requests (created owner-only on first use)
+APP_DATA_DIR = os.environ.get('APP_DATA_DIR', 'data')
+# Extraction results by document content, lexicon and engine version; the disk tier is shared by all workers
+RESULT_CACHE_MEMORY_BYTES = int(os.environ.get('RESULT_CACHE_MEMORY_BYTES', str(64 * 1024 * 1024)))
+RESULT_CACHE_PATH = os.environ.get('RESULT_CACHE_PATH', os.path.join(APP_DATA_DIR, 'result_cache.db'))
+RESULT_CACHE_DISK_BYTES = int(os.environ.get('RESULT_CACHE_DISK_BYTES', str(1024 * 1024 * 1024)))
+
+
+class LexiconManager:
+    """Versioned lexicons compiled in the background and swapped in atomically.
+
+    Each distinct source file is compiled once into a memory-mapped lexicon
+    named after its content hash, off the request path. It is compiled from a
+    copy of the source stored next to it, so the mapped file's source check
+    keeps passing for requests on this version after the watched source changes. With warm_pipelines,
+    a MedicationExtractionPipeline is also loaded and warmed on it before the
+    swap. `active` is replaced by a single assignment, so a request that took
+    a snapshot with current() keeps using its version (and pipeline) until it
+    finishes, even if a reload lands meanwhile. Older files are kept for
+    LEXICON_KEEP_VERSIONS versions so they are still on disk for requests in
+    flight.
+    """
+
+    def __init__(self, source_path, lexicon_dir, fallback_path, warm_pipelines=True):
+        self.source_path = source_path
+        self.lexicon_dir = lexicon_dir
+        self.fallback_path = fallback_path
+        self.warm_pipelines = warm_pipelines
+        self.active = None  # {'version', 'path', 'source_sha256', 'loaded_at', 'pipeline'}
+        self.ready = threading.Event()  # set once a lexicon has been loaded
+        self.last_error = None
+        self._build_lock = threading.Lock()
+        self._source_stat = None
+
+    def current(self):
+        """Snapshot of the active lexicon; before the first load, the build-time artifact or the CSV"""
+        active = self.active
+        if active is not None:
+            return active
+        # A build-time artifact is only used while it still matches the source
+        path = self.fallback_path if LexiconArtifact.is_current(self.fallback_path) else self.source_path
+        return {'version': None, 'path': path, 'source_sha256': None, 'loaded_at': None, 'pipeline': None}
+
+    def status(self):
+        active = self.active or {}
+        return {
+            'active_version': active.get('version'),
+            'loaded_at': active.get('loaded_at'),
+            'source': self.source_path,
+            'loading': self._build_lock.locked(),
+            'in_process': active.get('pipeline') is not None,
+            'last_error': self.last_error
+        }
+
+    def reload(self, wait=False):
+        """Load the current source in a background thread; False if a load is already running"""
+        if not self._build_lock.acquire(blocking=False):
+            return False
+        worker = threading.Thread(target=self._load, name='lexicon-reload', daemon=True)
+        worker.start()
+        if wait:
+            worker.join()
+        return True
+
+    def start_watching(self, interval):
+        """Load now, then reload whenever the source file changes"""
+        self.reload()
+        if interval > 0:
+            threading.Thread(target=self._watch, args=(interval,), name='lexicon-watch', daemon=True).start()
+
+    def _watch(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                stat = os.stat(self.source_path)
+            except OSError:
+                continue
+            if (stat.st_mtime, stat.st_size) != self._source_stat:
+                self.reload()
+
+    def _load(self):
+        try:
+            stat = os.stat(self.source_path)
+            with open(self.source_path, 'rb') as f:
+                source = f.read()
+            source_sha256 = hashlib.sha256(source).hexdigest()
+            if self.active and self.active['source_sha256'] == source_sha256:
+                self._source_stat = (stat.st_mtime, stat.st_size)
+                return
+
+            os.makedirs(self.lexicon_dir, exist_ok=True)
+            path = os.path.join(self.lexicon_dir, f"{source_sha256[:16]}-{ENGINE_VERSION}.lexmap")
+            if MappedLexiconFile.is_mapped(path):
+                with MappedLexiconFile(path) as lexicon_file:  # compiled earlier, or by another worker
+                    header = lexicon_file.header
+            else:
+                start_time = time.time()
+                snapshot_path = os.path.splitext(path)[0] + '.csv'
+                temp_path = f"{snapshot_path}.{os.getpid()}.tmp"
+                with open(temp_path, 'wb') as f:
+                    f.write(source)
+                os.replace(temp_path, snapshot_path)
+                temp_path = f"{path}.{os.getpid()}.tmp"
+                header = MappedLexiconFile.compile(snapshot_path, temp_path)
+                os.replace(temp_path, path)
+                print(f"📚 Compiled lexicon {header['lexicon_version']} in {time.time() - start_time:.1f}s")
+
+            pipeline = None
+            if self.warm_pipelines:
+                pipeline = MedicationExtractionPipeline(path)
+                # First document compiles the rule banks and pages in the lexicon
+                pipeline.process_document('warmup.html', '<p>Currently taking aspirin 81 mg daily.</p>')
+
+            self.active = {
+                'version': header['lexicon_version'],
+                'path': path,
+                'source_sha256': source_sha256,
+                'loaded_at': datetime.now().isoformat(),
+                'pipeline': pipeline
+            }
+            # Only now, so the watcher retries a source whose load failed
+            self._source_stat = (stat.st_mtime, stat.st_size)
+            self.last_error = None
+            self.ready.set()
+            print(f"✅ Active lexicon version: {header['lexicon_version']} ({header['entries']} entries)")
+            self._prune(keep=path)
+        except Exception as e:
+            self.last_error = str(e)
+            print(f"❌ Lexicon reload failed, keeping the previous version: {e}")
+        finally:
+            self._build_lock.release()
+
+    def _prune(self, keep):
+        """Remove all but the newest LEXICON_KEEP_VERSIONS compiled lexicons and their source copies"""
+        paths = [os.path.join(self.lexicon_dir, name) for name in os.listdir(self.lexicon_dir)
+                 if name.endswith('.lexmap')]
+        paths.sort(key=os.path.getmtime, reverse=True)
+        for path in paths[LEXICON_KEEP_VERSIONS:]:
+            if path != keep:
+                for stale in (path, os.path.splitext(path)[0] + '.csv'):
+                    try:
+                        os.unlink(stale)
+                    except OSError:
+                        pass
+
+
+lexicon_manager = LexiconManager(LEXICON_SOURCE_PATH, LEXICON_DIR, LEXICON_ARTIFACT_PATH,
+                                 warm_pipelines=EXTRACTION_MODE != 'subprocess')
+
+# RESULT_CACHE_PATH='' keeps the cache in memory only
+result_cache = ResultCache(RESULT_CACHE_MEMORY_BYTES, RESULT_CACHE_PATH or None, RESULT_CACHE_DISK_BYTES)
+
+
+def extract_cached(pipeline, filename, html_text, fields):
+    """(result, cache key, cache tier or None on a miss) for a document on a warm pipeline"""
+    key = ResultCache.key(html_text, pipeline.rxnorm_mapper.lexicon_version, pipeline.engine_version, fields)
+    result, tier = result_cache.get(key)
+    if result is None:
+        result = pipeline.process_document(filename, html_text, fields)
+        if 'error' not in result:
+            result_cache.put(key, result)
+    return result, key, tier
+
+
+def extract_in_worker(lexicon, filename, html_text, fields, timings=None):
+    """extract_cached on a warm batch worker of the lexicon snapshot, for documents too large to
+    run in a request thread. Past DOCUMENT_TIMEOUT seconds the pool is killed (batches on it
+    retry on a fresh one) and FutureTimeoutError is raised; with timings the cache is skipped."""
+    key = None
+    if timings is None and lexicon['version'] is not None:
+        key = ResultCache.key(html_text, lexicon['version'], ENGINE_VERSION, fields)
+        result, tier = result_cache.get(key)
+        if result is not None:
+            return result, key, tier
+    executor, future = batch_pool.submit(lexicon['path'], _process_document_in_worker,
+                                         filename, html_text, fields, timings)
+    try:
+        result = future.result(timeout=DOCUMENT_TIMEOUT)
+    except FutureTimeoutError:
+        batch_pool.discard(executor, kill=True)
+        raise
+    except BrokenProcessPool as e:
+        batch_pool.discard(executor)
+        result = {'error': repr(e)}
+    if key is not None and 'error' not in result:
+        result_cache.put(key, result)
+    return result, key, None
+
+
+def run_job_document(job, filename, html_text):
+    """JobQueue handler: one document of a job through the warm pipeline"""
+    if not lexicon_manager.ready.wait(JOB_LEXICON_WAIT):
+        raise RuntimeError('No lexicon loaded')
+    pipeline = lexicon_manager.current()['pipeline']
+    fields = job.options.get('fields')
+    instrumentation = PipelineInstrumentation() if job.options.get('instrument') else None
+    if instrumentation is not None:
+        result = pipeline.process_document(filename, html_text, fields, instrumentation.begin_document(filename))
+    else:
+        result = extract_cached(pipeline, filename, html_text, fields)[0]
+    if 'error' in result:
+        return {'success': False, 'filename': filename, 'error': f"Processing failed: {result['error']}"}
+    return document_response(filename, result, fields, instrumentation)
+
+
+class BatchWorkerPool:
+    """Worker processes for /process-batch, each with a pipeline on the active lexicon.
+
+    The pool is built on first use and rebuilt when the active lexicon
+    changes or a worker died (discard); the old pool is shut down without
+    waiting, so batches already streaming from it finish on their version.
+    Workers map the compiled lexicon, so they share its pages instead of each
+    loading a copy. They are started from a forkserver (spawn where that is
+    unavailable), never forked from this multi-threaded server. Workers report
+    their PIDs through a Manager list, so discard(kill=True) can end a worker
+    stuck on a document.
+    """
+
+    def __init__(self, workers):
+        self.workers = workers
+        self._lock = threading.Lock()
+        self._executor = None
+        self._lexicon_path = None
+        start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        self._context = multiprocessing.get_context(start_method)
+        self._manager = None
+        self._worker_pids = {}  # executor -> manager list of its worker PIDs
+
+    def executor(self, lexicon_path):
+        with self._lock:
+            if self._executor is None or self._lexicon_path != lexicon_path:
+                if self._executor is not None:
+                    self._worker_pids.pop(self._executor, None)
+                    self._executor.shutdown(wait=False)
+                if self._manager is None:
+                    self._manager = self._context.Manager()
+                pids = self._manager.list()
+                self._executor = _start_batch_workers(
+                    ProcessPoolExecutor(max_workers=self.workers, mp_context=self._context,
+                                        initializer=_init_tracked_batch_worker,
+                                        initargs=(pids, lexicon_path, False, None, False, 'default')),
+                    self.workers, self._manager)
+                self._worker_pids[self._executor] = pids
+                self._lexicon_path = lexicon_path
+            return self._executor
+
+    def discard(self, executor, kill=False):
+        """Forget a broken executor so the next executor() call builds a fresh pool;
+        kill=True also ends its workers, e.g. one stuck past a deadline"""
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+            pids = self._worker_pids.pop(executor, None)
+        if kill and pids is not None:
+            for pid in list(pids):
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+        executor.shutdown(wait=False)
+
+    def submit(self, lexicon_path, fn, *args):
+        """(executor, future) for fn(*args) on the pool, rebuilding the pool once if it is broken"""
+        executor = self.executor(lexicon_path)
+        try:
+            return executor, executor.submit(fn, *args)
+        except BrokenProcessPool:
+            self.discard(executor)
+            executor = self.executor(lexicon_path)
+            return executor, executor.submit(fn, *args)
+
+
+batch_pool = BatchWorkerPool(BATCH_WORKERS)
+
+
+job_queue = JobQueue(run_job_document, workers=JOB_WORKERS, per_user_limit=JOB_USER_CONCURRENCY,
+                     max_pending=JOB_MAX_PENDING, retention=JOB_RETENTION, max_bytes=JOB_MAX_BYTES)
+
+background_services_lock = threading.Lock()
+background_services_started = False
+
+
+def start_background_services():
+    """Load and watch the lexicon and start the job workers, once per serving process.
+
+    Nothing starts on import, so tools and tests can import this module
+    without compiling a lexicon or spawning threads.
+    """
+    global background_services_started
+    with background_services_lock:
+        if background_services_started:
+            return
+        background_services_started = True
+    lexicon_manager.start_watching(LEXICON_RELOAD_INTERVAL)
+    if EXTRACTION_MODE != 'subprocess':
+        job_queue.start()
+
+
+def create_app():
+    """App factory for WSGI servers, e.g. `gunicorn 'api_server:create_app()'`"""
+    init_database()
+    start_background_services()
+    return app
+
+
 @app.after_request
 def after_request(response):
     response.headers['Access-Control-Allow-Origin'] = '*'
     response.headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS'
-    response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
+    response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization'
+    response.headers['Access-Control-Expose-Headers'] = 'ETag, X-Cache'
     return response
 
 @app.route('/', methods=['GET'])
@@ -36,9 +388,12 @@ def home():
         'version': '1.3',
         'endpoints': {
             'health': '/health',
+            'lexicon_reload': '/admin/reload-lexicon',
             'database_debug': '/debug/database',
             'supabase_debug': '/debug/supabase',
             'process': '/process-document',
+            'jobs': '/jobs',
+            'process_batch': '/process-batch',
             'azure_config': '/config/azure',
             'user_register': '/users/register',
             'user_login': '/users/login',
@@ -55,9 +410,51 @@ def health_check():
     return jsonify({
         'status': 'healthy',
         'message': 'API server is running',
-        'service': 'RxNorm Document Processor'
+        'service': 'RxNorm Document Processor',
+        'lexicon': lexicon_manager.status(),
+        'jobs': job_queue.stats(),
+        'result_cache': result_cache.status()
     })
 
+def is_admin_request():
+    """True if the request carries `Authorization: Bearer <ADMIN_TOKEN>` (never when ADMIN_TOKEN is unset)"""
+    supplied = request.headers.get('Authorization', '')
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(supplied.encode('utf-8'), f'Bearer {ADMIN_TOKEN}'.encode('utf-8'))
+
+def authenticated_user():
+    """Username of a portal account given as HTTP Basic credentials, None if missing or wrong.
+
+    Raises DatabaseUnavailable (answered with 503) if the accounts cannot be checked.
+    """
+    auth = request.authorization
+    if auth is None or auth.type != 'basic' or not auth.username or not auth.password:
+        return None
+    user = get_user(auth.username.strip().lower())
+    release_request_connection()  # before the upload is read
+    if not user or not hmac.compare_digest((user.get('password') or '').encode('utf-8'), auth.password.encode('utf-8')):
+        return None
+    return user['username']
+
+@app.errorhandler(DatabaseUnavailable)
+def database_unavailable(e):
+    """503, not 401, when accounts cannot be checked: the credentials may be fine"""
+    print(f"❌ Database unavailable: {e}")
+    return jsonify({'error': 'Database unavailable, try again shortly'}), 503
+
+@app.route('/admin/reload-lexicon', methods=['POST', 'OPTIONS'])
+def reload_lexicon():
+    """Load the lexicon source again in the background; poll /health for the active version"""
+    if request.method == 'OPTIONS':
+        return jsonify({'message': 'CORS preflight'})
+    if not is_admin_request():
+        return jsonify({'error': 'Admin token required (Authorization: Bearer <ADMIN_TOKEN>)'}), 401
+
+    started = lexicon_manager.reload()
+    return jsonify({
+        'message': 'Lexicon reload started' if started else 'Lexicon reload already running',
+        'lexicon': lexicon_manager.status()
+    }), 202
+
 @app.route('/debug/database', methods=['GET'])
 def debug_database():
     """Database connection diagnostic endpoint"""
@@ -75,12 +472,14 @@ def debug_database():
             
             try:
                 conn = get_db_connection()
-                cursor = conn.cursor()
-                cursor.execute('SELECT version();')
-                version = cursor.fetchone()[0]
-                cursor.execute('SELECT COUNT(*) FROM users;')
-                user_count = cursor.fetchone()[0]
-                conn.close()
+                try:
+                    cursor = conn.cursor()
+                    cursor.execute('SELECT version();')
+                    version = cursor.fetchone()[0]
+                    cursor.execute('SELECT COUNT(*) FROM users;')
+                    user_count = cursor.fetchone()[0]
+                finally:
+                    release_db_connection(conn)
                 
                 db_info.update({
                     'connection_test': 'success',
@@ -97,10 +496,12 @@ def debug_database():
         else:
             try:
                 conn = get_db_connection()
-                cursor = conn.cursor()
-                cursor.execute('SELECT COUNT(*) FROM users;')
-                user_count = cursor.fetchone()[0]
-                conn.close()
+                try:
+                    cursor = conn.cursor()
+                    cursor.execute('SELECT COUNT(*) FROM users;')
+                    user_count = cursor.fetchone()[0]
+                finally:
+                    release_db_connection(conn)
                 
                 db_info.update({
                     'connection_test': 'success',
@@ -199,17 +600,12 @@ def debug_supabase():
 
 # Replace the process_document function with this updated version:
 
-@app.route('/process-document', methods=['POST', 'OPTIONS'])
 @app.route('/process-document', methods=['POST', 'OPTIONS'])
 def process_document():
     # Handle CORS preflight request
     if request.method == 'OPTIONS':
         return jsonify({'message': 'CORS preflight'})
     
-    # Handle CORS preflight request
-    if request.method == 'OPTIONS':
-        return jsonify({'message': 'CORS preflight'})
-    
     try:
         print("Processing document request received...")  # Debug log
         
@@ -221,94 +617,431 @@ def process_document():
             return jsonify({'error': 'No file selected'}), 400
         
         print(f"Processing file: {file.filename}")  # Debug log
+
+        try:
+            fields, instrument = request_options()
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        data = file.read()
+
+        # Snapshot the active lexicon: a reload during this request does not affect it
+        lexicon = lexicon_manager.current()
+        pipeline = lexicon['pipeline']
+        if pipeline is None:
+            # Isolation fallback (EXTRACTION_MODE=subprocess or no warm pipeline loaded yet)
+            return process_document_subprocess(file.filename, data, lexicon, fields, instrument)
+
+        try:
+            html_text = decode_upload(file.filename, data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        # Timings are only meaningful for a real run, so instrumented requests skip the cache
+        instrumentation = PipelineInstrumentation() if instrument else None
+        timings = instrumentation.begin_document(file.filename) if instrument else None
+        in_worker = len(data) > INPROCESS_MAX_BYTES
+        if in_worker:
+            try:
+                result, key, tier = extract_in_worker(lexicon, file.filename, html_text, fields, timings)
+            except FutureTimeoutError:
+                print(f"⏱️ {file.filename} took longer than {DOCUMENT_TIMEOUT}s; its worker was stopped")
+                return jsonify({'error': f'Processing timed out after {DOCUMENT_TIMEOUT}s'}), 504
+        elif instrument:
+            result = pipeline.process_document(file.filename, html_text, fields, timings)
+            key = tier = None
+        else:
+            result, key, tier = extract_cached(pipeline, file.filename, html_text, fields)
+        if 'error' in result:
+            return jsonify({'error': f"Processing failed: {result['error']}"}), 500
+
+        if tier is None:
+            print(f"✅ Processed {file.filename} {'on a batch worker' if in_worker else 'in-process'}: "
+                  f"{len(result['medications'])} medications")
+        response = jsonify(document_response(file.filename, result, fields, instrumentation))
+        if key is not None:
+            # Weak: processed_at differs between otherwise identical responses. The body
+            # echoes the filename, so the tag covers it as well as the cache key
+            response.set_etag(hashlib.sha256(f'{key}\0{file.filename}'.encode('utf-8')).hexdigest(), weak=True)
+            response.headers['X-Cache'] = f'HIT-{tier.upper()}' if tier else 'MISS'
+        return response
+
+    except Exception as e:
+        print(f"Error in process_document: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+def request_options():
+    """(fields, instrument) from the form or query string; raises ValueError for unknown fields
+
+    fields is an optional comma-separated list of output fields (unrequested
+    stages are skipped and the raw medications are returned instead of
+    annotations); instrument asks for per-stage timings.
+    """
+    fields = request.form.get('fields') or request.args.get('fields')
+    if fields:
+        fields = MedicationExtractionPipeline.validate_fields(fields)
+    instrument = (request.form.get('instrument') or request.args.get('instrument') or '').lower() in ('1', 'true', 'yes')
+    return fields or None, instrument
+
+def decode_upload(filename, data):
+    """An uploaded document's text; raises ValueError if it is not UTF-8"""
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError:
+        raise ValueError(f'{filename} is not valid UTF-8 text')
+
+def document_response(filename, result, fields, instrumentation):
+    """The /process-document response body for an in-process pipeline result"""
+    response = {
+        'success': True,
+        'annotations': [] if fields else [annotation._asdict() for annotation in
+                                          annotations_from_medications(result['medications'])],
+        'filename': filename,
+        'lexicon_version': result['lexicon_version'],
+        'processed_at': processed_at()
+    }
+    if fields:
+        response['fields'] = fields
+        response['medications'] = result['medications']
+    if instrumentation is not None:
+        instrumentation.on_document(result.pop('instrumentation'))
+        print(instrumentation.report())
+        response['instrumentation'] = instrumentation.summary()
+    return response
+
+def batch_documents(files):
+    """(filename, html_text) for each uploaded HTML file and each HTML member of uploaded zip/tar archives"""
+    documents = []
+    total_bytes = 0
+
+    def add(filename, data):
+        nonlocal total_bytes
+        total_bytes += len(data)
+        if len(documents) >= BATCH_MAX_DOCUMENTS:
+            raise ValueError(f'More than {BATCH_MAX_DOCUMENTS} documents in one batch')
+        if total_bytes > BATCH_MAX_BYTES:
+            raise ValueError(f'Batch is larger than {BATCH_MAX_BYTES} bytes')
+        documents.append((filename, decode_upload(filename, data)))
+
+    for file in files:
+        data = file.read()
+        name = file.filename.lower()
+        if name.endswith('.zip'):
+            with zipfile.ZipFile(io.BytesIO(data)) as archive:
+                for member in archive.infolist():
+                    if not member.is_dir() and member.filename.lower().endswith(BATCH_DOCUMENT_EXTENSIONS):
+                        if total_bytes + member.file_size > BATCH_MAX_BYTES:
+                            raise ValueError(f'Batch is larger than {BATCH_MAX_BYTES} bytes')
+                        add(member.filename, archive.read(member))
+        elif name.endswith(('.tar', '.tar.gz', '.tgz')):
+            with tarfile.open(fileobj=io.BytesIO(data)) as archive:
+                for member in archive:
+                    if member.isfile() and member.name.lower().endswith(BATCH_DOCUMENT_EXTENSIONS):
+                        if total_bytes + member.size > BATCH_MAX_BYTES:
+                            raise ValueError(f'Batch is larger than {BATCH_MAX_BYTES} bytes')
+                        add(member.name, archive.extractfile(member).read())
+        else:
+            add(file.filename, data)
+    return documents
+
+@app.route('/process-batch', methods=['POST', 'OPTIONS'])
+def process_batch():
+    """Process many documents in one request, streaming an NDJSON line per document as it finishes
+
+    Accepts any number of 'file' parts, each an HTML document or a zip/tar
+    archive of them. Lines come in completion order, not upload order; each
+    is a /process-document response plus 'index', the document's position
+    in the batch. The optional fields parameter works as for
+    /process-document.
+    """
+    if request.method == 'OPTIONS':
+        return jsonify({'message': 'CORS preflight'})
+
+    files = [file for file in request.files.getlist('file') if file.filename]
+    if not files:
+        return jsonify({'error': 'No file provided'}), 400
+    try:
+        fields, _ = request_options()
+        documents = batch_documents(files)
+    except (ValueError, zipfile.BadZipFile, tarfile.TarError) as e:
+        return jsonify({'error': str(e)}), 400
+    if not documents:
+        return jsonify({'error': 'No HTML documents in the upload'}), 400
+
+    # Snapshot the active lexicon for the whole batch
+    lexicon = lexicon_manager.current()
+    pipeline = lexicon['pipeline'] if BATCH_WORKERS <= 1 else None
+    print(f"📦 Processing batch of {len(documents)} documents "
+          f"({'in-process' if pipeline is not None else f'{BATCH_WORKERS} workers'})")
+
+    def line(index, filename, result):
+        if 'error' in result:
+            response = {'success': False, 'filename': filename, 'error': f"Processing failed: {result['error']}"}
+        else:
+            response = document_response(filename, result, fields, None)
+        response['index'] = index
+        return json.dumps(response) + '\n'
+
+    def generate():
+        if pipeline is not None:
+            for index, (filename, html_text) in enumerate(documents):
+                yield line(index, filename, extract_cached(pipeline, filename, html_text, fields)[0])
+            return
+        # Cached documents go out first; the rest fan out to the workers
+        keys = {}
+        misses = []
+        for index, (filename, html_text) in enumerate(documents):
+            if lexicon['version'] is None:
+                misses.append(index)
+                continue
+            keys[index] = ResultCache.key(html_text, lexicon['version'], ENGINE_VERSION, fields)
+            result, _ = result_cache.get(keys[index])
+            if result is None:
+                misses.append(index)
+            else:
+                yield line(index, filename, result)
+        # A worker that dies breaks the whole pool and fails every document in flight:
+        # those are retried once on a fresh pool, then reported as errors
+        for attempt in range(2):
+            futures = {}  # future -> (document index, executor)
+            for index in misses:
+                executor, future = batch_pool.submit(lexicon['path'], _process_document_in_worker,
+                                                     *documents[index], fields)
+                futures[future] = index, executor
+            misses = []
+            broken = set()
+            try:
+                for future in as_completed(futures):
+                    index, executor = futures[future]
+                    filename = documents[index][0]
+                    try:
+                        result = future.result()
+                    except BrokenProcessPool as e:
+                        broken.add(executor)
+                        if attempt == 0:
+                            misses.append(index)
+                            continue
+                        result = {'error': repr(e)}
+                    except Exception as e:
+                        result = {'error': repr(e)}
+                    if 'error' not in result and index in keys:
+                        result_cache.put(keys[index], result)
+                    yield line(index, filename, result)
+            finally:
+                # Client went away: drop the documents not started yet
+                for future in futures:
+                    future.cancel()
+            for executor in broken:
+                batch_pool.discard(executor)
+            if not misses:
+                break
+            print(f"⚠️ Batch worker pool broke; retrying {len(misses)} documents on a fresh pool")
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson',
+                    headers={'X-Batch-Documents': str(len(documents))})
+
+@app.route('/jobs', methods=['POST', 'OPTIONS'])
+def submit_job():
+    """Queue one or more uploaded documents ('file' parts) and return a job ID at once
+
+    Form fields: fields and instrument as for /process-document, and priority
+    (interactive, normal or bulk). The portal account's username and password
+    go in an HTTP Basic Authorization header; jobs running at once are capped
+    per account, and only that account can read the job.
+    """
+    if request.method == 'OPTIONS':
+        return jsonify({'message': 'CORS preflight'})
+    if EXTRACTION_MODE == 'subprocess':
+        return jsonify({'error': 'Jobs need EXTRACTION_MODE=inprocess'}), 503
+    user = authenticated_user()
+    if user is None:
+        return jsonify({'error': 'Username and password required (HTTP Basic)'}), 401
+
+    files = [file for file in request.files.getlist('file') if file.filename]
+    if not files:
+        return jsonify({'error': 'No file provided'}), 400
+    try:
+        fields, instrument = request_options()
+        documents = [(file.filename, decode_upload(file.filename, file.read())) for file in files]
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    priority = (request.form.get('priority') or request.args.get('priority') or 'normal').lower()
+
+    try:
+        job = job_queue.submit(documents, user, priority, {'fields': fields, 'instrument': instrument})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except QueueFull as e:
+        return jsonify({'error': f'Job queue is full: {e}'}), 429
+
+    print(f"📥 Queued job {job.id} ({len(documents)} documents, {priority}, user {user})")
+    response = job.status_dict()
+    response['status_url'] = f'/jobs/{job.id}'
+    response['result_url'] = f'/jobs/{job.id}/result'
+    return jsonify(response), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Status and progress (documents processed of total) of a job"""
+    job = job_queue.get(job_id)
+    if job is None or job.user != authenticated_user():
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    return jsonify(job.status_dict())
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    """One /process-document style response per document once the job is done; 202 until then"""
+    job = job_queue.get(job_id)
+    if job is None or job.user != authenticated_user():
+        return jsonify({'error': 'Unknown or expired job'}), 404
+    response = job.status_dict()
+    if job.status == FAILED:
+        return jsonify(response), 500
+    if job.status != DONE:
+        return jsonify(response), 202
+    response['results'] = job.results
+    return jsonify(response)
+
+def process_document_subprocess(filename, data, lexicon, fields, instrument):
+    """Run one uploaded document through a fresh `python main.py` process (isolation fallback)"""
+    # Save the uploaded file temporarily
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.html', mode='w+b') as temp_input:
+        temp_input.write(data)
+        temp_input_path = temp_input.name
+    
+
+    temp_output_dir = tempfile.mkdtemp()
+    
+    try:
+        print(f"Running main.py with input: {temp_input_path}, output: {temp_output_dir}")
+
+        # Run main.py with correct arguments
+        command = [
+            'python', 'main.py', 
+            '--input', temp_input_path,
+            '--output', temp_output_dir
+        ]
+        command += ['--rxnorm-csv', lexicon['path']]
+        if fields:
+            command += ['--fields', ','.join(fields)]
+        instrumentation_path = os.path.join(temp_output_dir, 'instrumentation.ndjson')
+        if instrument:
+            command += ['--instrument', instrumentation_path]
+        try:
+            result = subprocess.run(command, capture_output=True, text=True, timeout=DOCUMENT_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            print(f"⏱️ {filename} took longer than {DOCUMENT_TIMEOUT}s; main.py was stopped")
+            return jsonify({'error': f'Processing timed out after {DOCUMENT_TIMEOUT}s'}), 504
         
-        # Save the uploaded file temporarily
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.html', mode='w+b') as temp_input:
-            file.save(temp_input.name)
-            temp_input_path = temp_input.name
+        print(f"main.py exit code: {result.returncode}")
+        print(f"main.py stdout: {result.stdout}")
+        print(f"main.py stderr: {result.stderr}")
         
-
-        temp_output_dir = tempfile.mkdtemp()
+        if result.returncode != 0:
+            return jsonify({'error': f'Processing failed: {result.stderr}'}), 500
         
+        # Read the output JSON file
+        annotations = []
+        medications = None
+        lexicon_version = lexicon['version']
         try:
-            print(f"Running main.py with input: {temp_input_path}, output: {temp_output_dir}")
-
-            # Run main.py with correct arguments
-            result = subprocess.run([
-                'python', 'main.py', 
-                '--input', temp_input_path,
-                '--output', temp_output_dir
-            ], capture_output=True, text=True, timeout=60)
+            # List files in output directory
+            output_files = os.listdir(temp_output_dir)
+            print(f"Files created in output directory: {output_files}")
             
-            print(f"main.py exit code: {result.returncode}")
-            print(f"main.py stdout: {result.stdout}")
-            print(f"main.py stderr: {result.stderr}")
+            # Look for JSON files
+            json_files = [f for f in output_files if f.endswith('.json')]
             
-            if result.returncode != 0:
-                return jsonify({'error': f'Processing failed: {result.stderr}'}), 500
-            
-            # Read the output JSON file
-            annotations = []
-            try:
-                # List files in output directory
-                output_files = os.listdir(temp_output_dir)
-                print(f"Files created in output directory: {output_files}")
+            if json_files:
+                # Read the first JSON file found
+                json_file_path = os.path.join(temp_output_dir, json_files[0])
+                print(f"Reading JSON output from: {json_file_path}")
                 
-                # Look for JSON files
-                json_files = [f for f in output_files if f.endswith('.json')]
+                with open(json_file_path, 'r') as f:
+                    output_data = json.load(f)
                 
-                if json_files:
-                    # Read the first JSON file found
-                    json_file_path = os.path.join(temp_output_dir, json_files[0])
-                    print(f"Reading JSON output from: {json_file_path}")
-                    
-                    with open(json_file_path, 'r') as f:
-                        output_data = json.load(f)
-                    
+                if isinstance(output_data, dict):
+                    lexicon_version = output_data.get('lexicon_version', lexicon_version)
+                if fields:
+                    medications = output_data.get('medications', [])
+                else:
                     # Convert main.py output to annotation format
                     annotations = convert_main_py_output_to_annotations(output_data)
-                    print(f"Successfully loaded {len(annotations)} annotations from output file")
-                else:
-                    print("No JSON files found in output directory, trying to parse stdout...")
-                    # Fallback to parsing stdout if no JSON files created
-                    if result.stdout.strip():
-                        try:
-                            output_data = json.loads(result.stdout)
-                            annotations = convert_main_py_output_to_annotations(output_data)
-                        except json.JSONDecodeError:
-                            annotations = parse_main_py_text_output(result.stdout)
-                    
-            except Exception as e:
-                print(f"Error reading output files: {e}")
-                # Try parsing stdout as fallback
-                annotations = parse_main_py_text_output(result.stdout)
-            
-            return jsonify({
-                'success': True,
-                'annotations': annotations,
-                'filename': file.filename,
-                'processed_at': subprocess.run(['date'], capture_output=True, text=True).stdout.strip()
-            })
-            
-        finally:
-            # Clean up temporary files and directories
-            try:
-                os.unlink(temp_input_path)
-                print(f"Cleaned up temp input file: {temp_input_path}")
-            except:
-                pass
-            
-            try:
-                # Clean up output directory and all files in it
-                import shutil
-                shutil.rmtree(temp_output_dir)
-                print(f"Cleaned up temp output directory: {temp_output_dir}")
-            except:
-                pass
-            
-    except Exception as e:
-        print(f"Error in process_document: {str(e)}")
-        return jsonify({'error': str(e)}), 500
+                print(f"Successfully loaded {len(annotations)} annotations from output file")
+            else:
+                print("No JSON files found in output directory, trying to parse stdout...")
+                # Fallback to parsing stdout if no JSON files created
+                if result.stdout.strip():
+                    try:
+                        output_data = json.loads(result.stdout)
+                        annotations = convert_main_py_output_to_annotations(output_data)
+                    except json.JSONDecodeError:
+                        annotations = parse_main_py_text_output(result.stdout)
+                
+        except Exception as e:
+            print(f"Error reading output files: {e}")
+            # Try parsing stdout as fallback
+            annotations = parse_main_py_text_output(result.stdout)
+        
+        response = {
+            'success': True,
+            'annotations': annotations,
+            'filename': filename,
+            'lexicon_version': lexicon_version,
+            'processed_at': processed_at()
+        }
+        if fields:
+            response['fields'] = fields
+            response['medications'] = medications if medications is not None else []
+        if instrument and os.path.exists(instrumentation_path):
+            instrumentation = load_instrumentation(instrumentation_path)
+            print(instrumentation.report())
+            response['instrumentation'] = instrumentation.summary()
+        return jsonify(response)
+        
+    finally:
+        # Clean up temporary files and directories
+        try:
+            os.unlink(temp_input_path)
+            print(f"Cleaned up temp input file: {temp_input_path}")
+        except:
+            pass
+        
+        try:
+            # Clean up output directory and all files in it
+            import shutil
+            shutil.rmtree(temp_output_dir)
+            print(f"Cleaned up temp output directory: {temp_output_dir}")
+        except:
+            pass
+
+
+class Annotation(NamedTuple):
+    """One medication as the annotation portal consumes it"""
+    text: str
+    status: str
+    confidence: float
+    source: str
+    rxnorm_code: Optional[str]
+
+
+def annotations_from_medications(medications) -> List[Annotation]:
+    """Annotations for pipeline results, without the JSON round trip of convert_main_py_output_to_annotations"""
+    return [Annotation(text=med['text'].strip(), status=med.get('active_status', 'active'),
+                       confidence=med.get('confidence', 0.9), source='main.py', rxnorm_code=med.get('rx_cui'))
+            for med in medications]
+
+
+def processed_at():
+    """Local time in the format of `date`, e.g. 'Sat Oct 17 03:23:57 UTC 2026'"""
+    return datetime.now().astimezone().strftime('%a %b %d %H:%M:%S %Z %Y')
+
+def load_instrumentation(path):
+    """Aggregate the per-document stage timings written by `main.py --instrument`"""
+    instrumentation = PipelineInstrumentation()
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                instrumentation.on_document(json.loads(line))
+    return instrumentation
 
 # Replace the convert_main_py_output_to_annotations function with this:
 def convert_main_py_output_to_annotations(output_data):
@@ -428,6 +1161,12 @@ def parse_main_py_text_output(output):
 # For production: Use external database URL if available, fallback to local SQLite
 DATABASE_URL = os.environ.get('DATABASE_URL')
 DATABASE_FILE = os.environ.get('DATABASE_FILE', '/tmp/users.db') if not DATABASE_URL else None
+# PostgreSQL connection pool (a connection is checked out per query; see database.py)
+DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', '1'))
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '5'))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '10'))  # seconds to wait for a free connection
+DB_POOL_CHECK_IDLE = float(os.environ.get('DB_POOL_CHECK_IDLE', '30'))  # ping connections idle longer than this
+DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', '5000'))
 
 def init_database():
     """Initialize database for user storage - supports both SQLite and PostgreSQL"""
@@ -576,53 +1315,79 @@ def init_database():
     except Exception as e:
         print(f"⚠️ Error initializing database: {e}")
 
+db_pool = None  # PostgresPool, created on first use
+db_pool_lock = threading.Lock()
+
+def get_db_pool():
+    global db_pool
+    with db_pool_lock:
+        if db_pool is None:
+            # Same connection settings as initialization
+            if 'supabase.co' in DATABASE_URL:
+                connect_kwargs = {'sslmode': 'require', 'connect_timeout': 10, 'application_name': 'rxnorm-portal'}
+            else:
+                connect_kwargs = {'sslmode': 'require'}
+            db_pool = PostgresPool(DB_POOL_MIN, DB_POOL_MAX, DB_POOL_TIMEOUT, DB_POOL_CHECK_IDLE,
+                                   DATABASE_URL, **connect_kwargs)
+            print(f"✅ PostgreSQL connection pool ready ({DB_POOL_MIN}-{DB_POOL_MAX} connections)")
+        return db_pool
+
 def get_db_connection():
-    """Get database connection (PostgreSQL or SQLite) with improved error handling"""
-    global DATABASE_URL, DATABASE_FILE
-    
+    """Get database connection (PostgreSQL or SQLite) with improved error handling
+
+    A PostgreSQL connection comes from the pool; pass it to
+    release_db_connection as soon as the work on it is done. A failed
+    checkout raises DatabaseUnavailable: it fails this operation only, and
+    the next one tries PostgreSQL again (the pool is rebuilt if it was never made).
+    """
     if DATABASE_URL:
         try:
             if not PSYCOPG2_AVAILABLE:
                 raise ImportError("psycopg2 not available")
-            
-            # Use same connection settings as initialization
-            if 'supabase.co' in DATABASE_URL:
-                return psycopg2.connect(
-                    DATABASE_URL, 
-                    sslmode='require',
-                    connect_timeout=10,
-                    application_name='rxnorm-portal'
-                )
-            else:
-                return psycopg2.connect(DATABASE_URL, sslmode='require')
-                
+            return get_db_pool().getconn()
         except Exception as e:
             print(f"❌ PostgreSQL connection failed in get_db_connection: {e}")
-            print("🔄 Falling back to SQLite for this operation...")
-            DATABASE_URL = None
-            DATABASE_FILE = '/tmp/users.db'
-            return sqlite3.connect(DATABASE_FILE)
+            raise DatabaseUnavailable(str(e)) from e
     else:
         return sqlite3.connect(DATABASE_FILE)
 
+def release_db_connection(conn, discard=False):
+    """Done with a get_db_connection connection: close SQLite, return a pooled one to the pool"""
+    if isinstance(conn, sqlite3.Connection):
+        conn.close()
+    else:
+        db_pool.putconn(conn, discard=discard)
+
 def execute_query(query, params=None, fetch_one=False, fetch_all=False):
-    """Execute database query with proper parameter substitution"""
+    """Execute database query with proper parameter substitution
+
+    Within a request, every query reuses one pooled connection, returned by
+    release_request_connection (at the latest when the request ends); outside
+    one, each query checks a connection out and returns it when done. Raises
+    DatabaseUnavailable if no connection can be had; a failed query returns None.
+    """
+    if DATABASE_URL:
+        try:
+            if not PSYCOPG2_AVAILABLE:
+                raise ImportError("psycopg2 not available")
+            pool = get_db_pool()
+        except Exception as e:
+            print(f"❌ PostgreSQL connection failed in execute_query: {e}")
+            raise DatabaseUnavailable(str(e)) from e
+        if not has_request_context():
+            return execute_pooled(pool, query, params, fetch_one, fetch_all, DB_STATEMENT_TIMEOUT_MS)
+        if 'db_session' not in g:
+            g.db_session = PooledSession(pool, DB_STATEMENT_TIMEOUT_MS)
+        return g.db_session.execute(query, params, fetch_one, fetch_all)
+
+    conn = sqlite3.connect(DATABASE_FILE)
     try:
-        conn = get_db_connection()
         cursor = conn.cursor()
-        
-        if DATABASE_URL:
-            # PostgreSQL uses %s for all parameters
-            if params:
-                cursor.execute(query.replace('?', '%s'), params)
-            else:
-                cursor.execute(query)
+        # SQLite uses ?
+        if params:
+            cursor.execute(query, params)
         else:
-            # SQLite uses ?
-            if params:
-                cursor.execute(query, params)
-            else:
-                cursor.execute(query)
+            cursor.execute(query)
         
         result = None
         if fetch_one:
@@ -631,11 +1396,21 @@ def execute_query(query, params=None, fetch_one=False, fetch_all=False):
             result = cursor.fetchall()
         
         conn.commit()
-        conn.close()
         return result
     except Exception as e:
         print(f"⚠️ Database error: {e}")
         return None
+    finally:
+        conn.close()
+
+
+@app.teardown_request
+def release_request_connection(exc=None):
+    """Return the request's pooled connection, if it took one; handlers with slow work
+    ahead of them (uploads, extraction) call this once their queries are done"""
+    session = g.pop('db_session', None)
+    if session is not None:
+        session.release()
 
 
 def get_user(username_or_email):
@@ -659,6 +1434,8 @@ def get_user(username_or_email):
                 'assignment_order': result[8] if len(result) > 8 else None
             }
         return None
+    except DatabaseUnavailable:
+        raise
     except Exception as e:
         print(f"⚠️ Error getting user: {e}")
         return None
@@ -671,6 +1448,8 @@ def create_user(username, email, password, name):
             VALUES (?, ?, ?, ?)
         ''', (username, email, password, name))
         return True
+    except DatabaseUnavailable:
+        raise
     except Exception as e:
         if "UNIQUE constraint" in str(e) or "duplicate key" in str(e):
             print(f"⚠️ User creation failed - duplicate entry: {e}")
@@ -684,6 +1463,8 @@ def update_last_login(username):
         execute_query('UPDATE users SET last_login = ? WHERE username = ?', 
                      (datetime.now(), username))
         return True
+    except DatabaseUnavailable:
+        raise
     except Exception as e:
         print(f"⚠️ Error updating last login: {e}")
         return False
@@ -707,14 +1488,16 @@ def get_all_users():
                 })
             return users
         return []
+    except DatabaseUnavailable:
+        raise
     except Exception as e:
         print(f"⚠️ Error listing users: {e}")
         return []
         print(f"⚠️ Error getting all users: {e}")
         return []
 
-# Initialize database on startup
-init_database()
+# The database is initialized by create_app() or __main__, not on import: batch
+# workers import this module again (forkserver/spawn) and must not connect
 
 # Global configuration storage (in production, use a database)
 global_config = {}
@@ -769,6 +1552,8 @@ def register_user():
         else:
             return jsonify({'error': 'Failed to create user - username or email may already exist'}), 409
         
+    except DatabaseUnavailable:
+        raise  # answered with 503 by database_unavailable
     except Exception as e:
         print(f"❌ Registration error: {e}")
         return jsonify({'error': str(e)}), 500
@@ -812,6 +1597,8 @@ def login_user():
             }
         })
         
+    except DatabaseUnavailable:
+        raise  # answered with 503 by database_unavailable
     except Exception as e:
         print(f"❌ Login error: {e}")
         return jsonify({'error': str(e)}), 500
@@ -889,6 +1676,8 @@ def get_folder_assignments():
             'expected_folders': list(range(1, 91))  # Should be 1-90
         })
         
+    except DatabaseUnavailable:
+        raise
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -1081,6 +1870,8 @@ if __name__ == '__main__':
     except Exception as e:
         print(f"❌ Database initialization failed: {e}")
     
+    start_background_services()
+
     # Get port from environment variable (Render requirement)
     port = int(os.environ.get('PORT', 8000))
     host = '0.0.0.0'  # Required for Render
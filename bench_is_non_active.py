@@ -0,0 +1,93 @@
+"""Microbenchmark for LocalMedicationLLM._is_non_active.
+
+Collects every mention the extractor finds in the corpus, then classifies the
+same mentions with the legacy per-call regexes and with the precompiled rule
+bank, checks that both give identical decisions and reports per-mention cost.
+Finally classifies each document with and without the per-document
+classification memo and reports its hit rate.
+
+Usage: python bench_is_non_active.py [--corpus data_900] [--limit N]
+"""
+import argparse
+import glob
+import os
+import time
+
+from main import LocalMedicationLLM, RxNormMapper
+
+
+def collect_mentions(extractor: LocalMedicationLLM, files):
+    """Return (text, start, end) for every deduplicated mention in the corpus"""
+    mentions = []
+    for file_path in files:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            text = f.read()
+        seen = set()
+        for med in extractor._extract_by_automaton(text):
+            key = (med['text'].lower(), med['start_offset'], med['end_offset'])
+            if key not in seen and len(med['text']) > 2:
+                seen.add(key)
+                mentions.append((text, med['start_offset'], med['end_offset']))
+    return mentions
+
+
+def time_classifier(extractor: LocalMedicationLLM, mentions):
+    """Classify all mentions, returning (decisions, seconds)"""
+    start_time = time.perf_counter()
+    decisions = [extractor._is_non_active(text, start, end) for text, start, end in mentions]
+    return decisions, time.perf_counter() - start_time
+
+
+def time_documents(extractor: LocalMedicationLLM, files):
+    """Classify every document's mentions with classify_medications, returning (decisions, seconds)"""
+    documents = []
+    for file_path in files:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            text = f.read()
+        documents.append((text, extractor._deduplicate_and_filter(extractor._extract_by_automaton(text))))
+    start_time = time.perf_counter()
+    decisions = [[med['active_status'] for med in extractor.classify_medications(medications, text)]
+                 for text, medications in documents]
+    return decisions, time.perf_counter() - start_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark _is_non_active before/after the precompiled rule bank')
+    parser.add_argument('--corpus', default='data_900', help='Folder of *_clean.html files (searched recursively)')
+    parser.add_argument('--rxnorm-csv', default='Medication-label-set.csv', help='Path to RxNorm CSV file')
+    parser.add_argument('--limit', type=int, default=0, help='Only use the first N files')
+    args = parser.parse_args()
+
+    files = sorted(glob.glob(os.path.join(args.corpus, '**', '*.html'), recursive=True))
+    if args.limit:
+        files = files[:args.limit]
+    lexicon = RxNormMapper(args.rxnorm_csv).rxnorm_db
+    legacy = LocalMedicationLLM(lexicon, use_rule_bank=False)
+    compiled = LocalMedicationLLM(lexicon, use_rule_bank=True)
+
+    mentions = collect_mentions(compiled, files)
+    print(f"Corpus: {len(files)} files, {len(mentions)} mentions")
+    if not mentions:
+        return
+
+    legacy_decisions, legacy_seconds = time_classifier(legacy, mentions)
+    compiled_decisions, compiled_seconds = time_classifier(compiled, mentions)
+    mismatches = sum(1 for a, b in zip(legacy_decisions, compiled_decisions) if a != b)
+
+    print(f"Before (per-call regexes): {legacy_seconds * 1e6 / len(mentions):8.1f} us/mention  ({legacy_seconds:.2f}s)")
+    print(f"After  (rule bank):        {compiled_seconds * 1e6 / len(mentions):8.1f} us/mention  ({compiled_seconds:.2f}s)")
+    print(f"Speedup: {legacy_seconds / compiled_seconds:.1f}x")
+    print(f"Decision mismatches: {mismatches}")
+
+    compiled.memoize_classification = False
+    plain_decisions, plain_seconds = time_documents(compiled, files)
+    compiled.memoize_classification = True
+    memo_decisions, memo_seconds = time_documents(compiled, files)
+    stats = compiled.classification_memo_stats
+    print(f"Per-document classification: {plain_seconds:.2f}s without memo, {memo_seconds:.2f}s with memo")
+    print(f"Memo hits: {stats['hits']}/{stats['lookups']} ({stats['hits'] / max(1, stats['lookups']):.1%}), "
+          f"decision mismatches: {sum(a != b for a, b in zip(plain_decisions, memo_decisions))}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+"""Memory and load-time report for RRF-scale lexicons.
+
+Writes a synthetic RXNCONSO.RRF / RXNREL.RRF pair at roughly full RxNorm
+scale (no licensed data needed), ingests it with CompactLexicon and compares
+the compact columns against the CSV loader's dict-of-dicts layout. It then
+builds MedicationExtractionPipeline on the lexicon end to end (entry hashes,
+brand mapping, combination index and Aho-Corasick build included), which is
+what a worker actually pays. Each measurement runs in a fresh interpreter so
+resident memory is not shared.
+
+With --workers N it also compiles the lexicon into both compile-lexicon
+formats and loads each in N concurrent processes, reporting per-worker RSS,
+PSS and private memory: the mapped file's pages are shared between workers.
+
+Usage: python bench_rrf_lexicon.py [--rrf-dir DIR] [--concepts N] [--ttys IN,MIN,PIN,BN] [--workers N]
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+TTY_MIX = (('IN', 0.05), ('PIN', 0.01), ('MIN', 0.02), ('BN', 0.05), ('SCD', 0.3), ('SBD', 0.2),
+           ('SY', 0.17), ('SCDC', 0.2))
+
+
+def write_synthetic_rrf(rrf_dir: str, concepts: int, seed: int = 7):
+    """RXNCONSO rows for `concepts` RXCUIs with a realistic TTY mix, plus tradename links"""
+    rng = random.Random(seed)
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    ingredient_cuis, brand_cuis = [], []
+    with open(os.path.join(rrf_dir, 'RXNCONSO.RRF'), 'w', encoding='utf-8') as f:
+        for rx_cui in range(1, concepts + 1):
+            roll, tty = rng.random(), 'SY'
+            for candidate, share in TTY_MIX:
+                if roll < share:
+                    tty = candidate
+                    break
+                roll -= share
+            name = ''.join(rng.choice(letters) for _ in range(rng.randint(6, 14)))
+            if tty == 'MIN':
+                name = ' / '.join(''.join(rng.choice(letters) for _ in range(9)) for _ in range(rng.randint(2, 3)))
+            elif tty in ('SCD', 'SBD', 'SCDC'):
+                name += f" {rng.randint(1, 500)} MG Oral Tablet"
+            if tty in ('IN', 'PIN', 'MIN'):
+                ingredient_cuis.append(rx_cui)
+            elif tty == 'BN':
+                brand_cuis.append(rx_cui)
+            f.write(f"{rx_cui}|ENG||||||A{rx_cui}||||RXNORM|{tty}|{rx_cui}|{name}||N|4096|\n")
+    with open(os.path.join(rrf_dir, 'RXNREL.RRF'), 'w', encoding='utf-8') as f:
+        for brand_cui in brand_cuis:
+            ingredient = rng.choice(ingredient_cuis)
+            f.write(f"{brand_cui}||CUI|RN|{ingredient}||CUI|tradename_of|R{brand_cui}||RXNORM||||N||\n")
+            f.write(f"{ingredient}||CUI|RB|{brand_cui}||CUI|has_tradename|R{brand_cui}b||RXNORM||||N||\n")
+        for i in range(concepts):
+            f.write(f"{rng.randint(1, concepts)}||CUI|RO|{rng.randint(1, concepts)}||CUI|consists_of|X{i}||RXNORM||||N||\n")
+
+
+MEASURE = r'''
+import json, sys, time
+sys.path.insert(0, {root!r})
+def rss_kb():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * 4096 // 1024
+import main
+before = rss_kb()
+start = time.perf_counter()
+lexicon = main.CompactLexicon.load({path!r})
+if {as_dicts!r}:
+    lexicon = {{name: lexicon[name] for name in lexicon}}
+seconds = time.perf_counter() - start
+mapper_start = time.perf_counter()
+brand_to_generic = {{brand: generic for generic, info in lexicon.items() for brand in info['brand_names']}}
+mapper_seconds = time.perf_counter() - mapper_start
+print(json.dumps({{'entries': len(lexicon), 'load_s': seconds, 'brand_map_s': mapper_seconds,
+                  'rss_delta_mb': (rss_kb() - before) / 1024}}))
+'''
+
+
+def measure(path: str, as_dicts: bool) -> dict:
+    code = MEASURE.format(root=os.path.dirname(os.path.abspath(__file__)), path=path, as_dicts=as_dicts)
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+PIPELINE = r'''
+import json, resource, sys, time
+sys.path.insert(0, {root!r})
+def rss_kb():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * 4096 // 1024
+import main
+mapper_s = []
+build_mapper = main.RxNormMapper.__init__
+def timed_mapper(self, *args, **kwargs):
+    start = time.perf_counter()
+    build_mapper(self, *args, **kwargs)
+    mapper_s.append(time.perf_counter() - start)
+main.RxNormMapper.__init__ = timed_mapper
+before = rss_kb()
+start = time.perf_counter()
+pipeline = main.MedicationExtractionPipeline({path!r})
+seconds = time.perf_counter() - start
+built_kb = rss_kb()
+start = time.perf_counter()
+pipeline.process_document('first.html', '<p>Currently taking aspirin 81 mg daily.</p>')
+first_s = time.perf_counter() - start
+print(json.dumps({{'build_s': seconds, 'mapper_s': mapper_s[0], 'extractor_s': seconds - mapper_s[0],
+                  'first_document_s': first_s, 'rss_delta_mb': (built_kb - before) / 1024,
+                  'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}}))
+'''
+
+
+def measure_pipeline(path: str) -> dict:
+    """Build the full pipeline on the lexicon in a fresh interpreter: time split and memory"""
+    code = PIPELINE.format(root=os.path.dirname(os.path.abspath(__file__)), path=path)
+    output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+WORKER = r'''
+import json, sys, time
+sys.path.insert(0, {root!r})
+import main
+start = time.perf_counter()
+pipeline = main.MedicationExtractionPipeline({path!r})
+seconds = time.perf_counter() - start
+names = [name for _, name in zip(range(2000), pipeline.rxnorm_mapper.rxnorm_db)]
+sample = [{{'text': name}} for name in names]
+pipeline.rxnorm_mapper.map_to_cui(sample)
+pipeline.medication_extractor.matcher.find_all(' taking '.join(names))
+print(json.dumps({{'load_s': seconds}}), flush=True)
+sys.stdin.read()
+'''
+
+
+def memory_kb(pid: int) -> dict:
+    """Rss, Pss and private (Private_Clean + Private_Dirty) of a live process, in kB"""
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[1].isdigit():
+                fields[parts[0].rstrip(':')] = int(parts[1])
+    return {'rss': fields.get('Rss', 0), 'pss': fields.get('Pss', 0),
+            'private': fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0)}
+
+
+def measure_workers(path: str, workers: int) -> dict:
+    """Load the lexicon in `workers` concurrent processes and sample their memory while all are alive"""
+    code = WORKER.format(root=os.path.dirname(os.path.abspath(__file__)), path=path)
+    processes = [subprocess.Popen([sys.executable, '-c', code], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                  text=True) for _ in range(workers)]
+    loads = [json.loads(process.stdout.readline())['load_s'] for process in processes]
+    memory = [memory_kb(process.pid) for process in processes]
+    for process in processes:
+        process.stdin.close()
+        process.wait()
+    return {'load_s': sum(loads) / workers,
+            'rss_mb': sum(m['rss'] for m in memory) / workers / 1024,
+            'pss_mb': sum(m['pss'] for m in memory) / workers / 1024,
+            'private_mb': sum(m['private'] for m in memory) / workers / 1024}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Report load time and RSS of the compact RRF lexicon')
+    parser.add_argument('--rrf-dir', help='Real RRF folder (default: generate synthetic data)')
+    parser.add_argument('--concepts', type=int, default=400000, help='Synthetic RXNCONSO rows')
+    parser.add_argument('--ttys', default='IN,MIN,PIN,BN', help='Term types to ingest (passed to ingest-rrf)')
+    parser.add_argument('--workers', type=int, default=0, help='Also compare compiled formats across N processes')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        rrf_dir = args.rrf_dir
+        if not rrf_dir:
+            rrf_dir = work_dir
+            write_synthetic_rrf(rrf_dir, args.concepts)
+            print(f"Synthetic RRF: {args.concepts} RXNCONSO rows in {rrf_dir}")
+        lexicon_path = os.path.join(work_dir, 'rxnorm.rxlex')
+        start = time.perf_counter()
+        subprocess.run([sys.executable, 'main.py', 'ingest-rrf', '--rrf-dir', rrf_dir, '-o', lexicon_path,
+                        '--ttys', args.ttys], check=True, capture_output=True)
+        print(f"Ingest (RRF -> compact file): {time.perf_counter() - start:.1f}s, "
+              f"{os.path.getsize(lexicon_path) / 1e6:.1f} MB on disk")
+        compact = measure(lexicon_path, as_dicts=False)
+        dicts = measure(lexicon_path, as_dicts=True)
+        print(f"Entries: {compact['entries']}")
+        print(f"Compact columns:  load {compact['load_s']:.2f}s  RSS +{compact['rss_delta_mb']:.1f} MB")
+        print(f"Dict-of-dicts:    load {dicts['load_s']:.2f}s  RSS +{dicts['rss_delta_mb']:.1f} MB")
+        pipeline = measure_pipeline(lexicon_path)
+        print(f"Full pipeline:    build {pipeline['build_s']:.2f}s (mapper {pipeline['mapper_s']:.2f}s, "
+              f"extractor {pipeline['extractor_s']:.2f}s)  first document {pipeline['first_document_s']:.2f}s  "
+              f"RSS +{pipeline['rss_delta_mb']:.1f} MB  peak RSS {pipeline['peak_rss_mb']:.0f} MB")
+
+        if args.workers:
+            print(f"\nPipeline per worker, {args.workers} concurrent workers:")
+            for label, fmt in (('pickle artifact', 'pickle'), ('mapped file', 'mmap')):
+                artifact_path = os.path.join(work_dir, 'rxnorm.' + fmt)
+                subprocess.run([sys.executable, 'main.py', 'compile-lexicon', '--rxnorm-csv', lexicon_path,
+                                '-o', artifact_path, '--format', fmt], check=True, capture_output=True)
+                result = measure_workers(artifact_path, args.workers)
+                print(f"  {label:16s} load {result['load_s']:.2f}s  RSS {result['rss_mb']:.0f} MB  "
+                      f"PSS {result['pss_mb']:.0f} MB  private {result['private_mb']:.0f} MB")
+
+
+if __name__ == '__main__':
+    main()
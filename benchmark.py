@@ -0,0 +1,228 @@
+"""Extraction benchmark over the bundled corpora.
+
+Runs MedicationExtractionPipeline over data_900 and organized_data_900
+(optionally replicated N times) and reports throughput (documents/sec,
+MB/sec), per-document latency percentiles, time per stage (from the
+pipeline's PipelineInstrumentation hooks, plus serialization) and peak
+RSS. Results can be saved as JSON and compared against a saved baseline;
+throughput or latency regressions beyond --tolerance are flagged and make
+the run exit with status 1. --compare-text-mode also runs every corpus in
+text mode (HTMLTextLayer) and reports the visible-text/HTML UTF-8 byte ratio and
+the end-to-end speedup of text mode over HTML mode.
+
+Usage: python benchmark.py [--corpus data_900 organized_data_900] [--scale N]
+                           [--text-mode | --compare-text-mode]
+                           [--save results.json] [--baseline baseline.json]
+"""
+import argparse
+import glob
+import json
+import math
+import os
+import platform
+import resource
+import sys
+import time
+from datetime import datetime
+
+from main import HTMLTextLayer, MedicationExtractionPipeline, PipelineInstrumentation
+
+
+def percentile(sorted_values, fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def run_document(pipeline: MedicationExtractionPipeline, file_path: str) -> tuple:
+    """Process and serialize one file; returns (bytes, mentions, serialize seconds, total seconds)"""
+    start = time.perf_counter()
+    result = pipeline.process_single_file(file_path)
+    result.pop('instrumentation', None)
+    serialize_start = time.perf_counter()
+    json.dumps(result, indent=2)
+    end = time.perf_counter()
+    return os.path.getsize(file_path), len(result['medications']), end - serialize_start, end - start
+
+
+def benchmark_corpus(pipeline: MedicationExtractionPipeline, files, scale: int) -> dict:
+    """Run every file `scale` times and summarize; stage times come from the pipeline's instrumentation"""
+    pipeline.instrumentation = PipelineInstrumentation()
+    latencies = []
+    total_bytes = total_mentions = 0
+    serialize_seconds = 0.0
+    start_time = time.perf_counter()
+    for _ in range(scale):
+        for file_path in files:
+            size, mentions, serialize, seconds = run_document(pipeline, file_path)
+            total_bytes += size
+            total_mentions += mentions
+            serialize_seconds += serialize
+            latencies.append(seconds)
+    wall_seconds = time.perf_counter() - start_time
+    latencies.sort()
+    stage_seconds = pipeline.instrumentation.summary()['stages']
+    stage_seconds['serialize'] = serialize_seconds
+    return {
+        'documents': len(latencies),
+        'megabytes': total_bytes / 1e6,
+        'mentions': total_mentions,
+        'wall_seconds': wall_seconds,
+        'docs_per_sec': len(latencies) / wall_seconds if wall_seconds else 0.0,
+        'mb_per_sec': total_bytes / 1e6 / wall_seconds if wall_seconds else 0.0,
+        'latency_ms': {name: percentile(latencies, fraction) * 1000
+                       for name, fraction in (('p50', 0.50), ('p95', 0.95), ('p99', 0.99))},
+        'stage_seconds': stage_seconds
+    }
+
+
+def text_bytes_ratio(files) -> float:
+    """UTF-8 bytes of visible text per UTF-8 byte of HTML over the files (what text mode scans)"""
+    html_bytes = text_bytes = 0
+    for file_path in files:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            html_text = f.read()
+        html_bytes += len(html_text.encode('utf-8'))
+        text_bytes += len(HTMLTextLayer(html_text).text.encode('utf-8'))
+    return text_bytes / html_bytes if html_bytes else 0.0
+
+
+def compare_text_mode(html_summary: dict, text_pipeline: MedicationExtractionPipeline, files, scale: int) -> dict:
+    """Run the files in text mode and compare with the HTML-mode summary of the same files"""
+    summary = benchmark_corpus(text_pipeline, files, scale)
+    return {
+        'text_bytes_ratio': text_bytes_ratio(files),
+        'wall_seconds': summary['wall_seconds'],
+        'speedup': html_summary['wall_seconds'] / summary['wall_seconds'] if summary['wall_seconds'] else 0.0,
+        'mentions': summary['mentions'],
+        'stage_seconds': summary['stage_seconds']
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Regressions of results against baseline beyond tolerance (a fraction)"""
+    regressions = []
+    for corpus, current in results['corpora'].items():
+        previous = baseline.get('corpora', {}).get(corpus)
+        if previous is None:
+            continue
+        checks = [('docs_per_sec', current['docs_per_sec'], previous['docs_per_sec'], False),
+                  ('mb_per_sec', current['mb_per_sec'], previous['mb_per_sec'], False)]
+        checks += [(f'latency {name}', current['latency_ms'][name], previous['latency_ms'][name], True)
+                   for name in ('p50', 'p95', 'p99')]
+        for name, now, before, lower_is_better in checks:
+            if not before:
+                continue
+            change = (now - before) / before
+            if (change > tolerance) if lower_is_better else (change < -tolerance):
+                regressions.append(f"{corpus}: {name} {before:.2f} -> {now:.2f} ({change:+.1%})")
+    previous_rss = baseline.get('peak_rss_mb')
+    if previous_rss and (results['peak_rss_mb'] - previous_rss) / previous_rss > tolerance:
+        regressions.append(f"peak RSS {previous_rss:.1f} -> {results['peak_rss_mb']:.1f} MB")
+    return regressions
+
+
+def print_report(corpus: str, summary: dict):
+    print(f"\n📊 {corpus}: {summary['documents']} documents, {summary['megabytes']:.1f} MB, "
+          f"{summary['mentions']} mentions in {summary['wall_seconds']:.2f}s")
+    print(f"   Throughput: {summary['docs_per_sec']:.1f} docs/sec, {summary['mb_per_sec']:.2f} MB/sec")
+    latency = summary['latency_ms']
+    print(f"   Latency: p50 {latency['p50']:.2f} ms | p95 {latency['p95']:.2f} ms | p99 {latency['p99']:.2f} ms")
+    stages = summary['stage_seconds']
+    staged = sum(seconds for stage, seconds in stages.items() if '.' not in stage)
+    for stage, seconds in sorted(stages.items(), key=lambda item: -item[1]):
+        if '.' not in stage:
+            print(f"   {stage:18s} {seconds:7.2f}s  {seconds / staged:6.1%}")
+    # Rule groups and cue lookups inside the classifier
+    for stage, seconds in sorted(stages.items(), key=lambda item: -item[1]):
+        if '.' in stage:
+            print(f"     {stage:40s} {seconds:7.2f}s")
+    text_mode = summary.get('text_mode')
+    if text_mode is not None:
+        print(f"   Text mode: {text_mode['wall_seconds']:.2f}s ({text_mode['speedup']:.2f}x HTML mode), "
+              f"text/HTML size {text_mode['text_bytes_ratio']:.2f}, {text_mode['mentions']} mentions")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark MedicationExtractionPipeline over the bundled corpora')
+    parser.add_argument('--corpus', nargs='+', default=['data_900', 'organized_data_900'],
+                        help='Folders of HTML files (searched recursively)')
+    parser.add_argument('--rxnorm-csv', default='Medication-label-set.csv',
+                        help='Path to RxNorm CSV file, a compiled lexicon artifact or an ingest-rrf lexicon')
+    parser.add_argument('--scale', type=int, default=1, help='Replicate each corpus N times (synthetic scaling)')
+    parser.add_argument('--limit', type=int, default=0, help='Only use the first N files of each corpus')
+    parser.add_argument('--legacy-extract', action='store_true',
+                        help='Use the per-name find() extractors (separate generic/brand stages) instead of the automaton')
+    parser.add_argument('--text-mode', action='store_true', help='Extract from the visible text instead of raw HTML')
+    parser.add_argument('--compare-text-mode', action='store_true',
+                        help='Also run each corpus in text mode and report its speedup and text/HTML size ratio')
+    parser.add_argument('--save', help='Write results to this JSON file')
+    parser.add_argument('--baseline', help='Compare against a JSON file written by --save')
+    parser.add_argument('--tolerance', type=float, default=0.10,
+                        help='Allowed relative slowdown before a metric is flagged (default 0.10)')
+    args = parser.parse_args()
+
+    load_start = time.perf_counter()
+    if args.text_mode and args.compare_text_mode:
+        parser.error('--text-mode and --compare-text-mode are exclusive')
+    pipeline = MedicationExtractionPipeline(args.rxnorm_csv, text_mode=args.text_mode)
+    if args.legacy_extract:
+        pipeline.medication_extractor.matcher = None
+    load_seconds = time.perf_counter() - load_start
+    text_pipeline = None
+    if args.compare_text_mode:
+        text_pipeline = MedicationExtractionPipeline(args.rxnorm_csv, text_mode=True)
+        if args.legacy_extract:
+            text_pipeline.medication_extractor.matcher = None
+    print(f"Pipeline loaded in {load_seconds:.2f}s (engine {pipeline.engine_version}, "
+          f"lexicon {pipeline.rxnorm_mapper.lexicon_version})")
+
+    results = {
+        'timestamp': datetime.now().isoformat(),
+        'engine_version': pipeline.engine_version,
+        'lexicon_version': pipeline.rxnorm_mapper.lexicon_version,
+        'python': platform.python_version(),
+        'scale': args.scale,
+        'legacy_extract': args.legacy_extract,
+        'text_mode': args.text_mode,
+        'load_seconds': load_seconds,
+        'corpora': {}
+    }
+    for corpus in args.corpus:
+        files = sorted(glob.glob(os.path.join(corpus, '**', '*.html'), recursive=True))
+        if args.limit:
+            files = files[:args.limit]
+        if not files:
+            print(f"⚠️ No HTML files in {corpus}, skipping")
+            continue
+        summary = benchmark_corpus(pipeline, files, args.scale)
+        if text_pipeline is not None:
+            summary['text_mode'] = compare_text_mode(summary, text_pipeline, files, args.scale)
+        results['corpora'][corpus] = summary
+        print_report(corpus, summary)
+
+    # ru_maxrss is in kilobytes on Linux
+    results['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"\nPeak RSS: {results['peak_rss_mb']:.1f} MB")
+
+    if args.save:
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"✅ Results saved to {args.save}")
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"❌ {len(regressions)} regression(s) against {args.baseline} (tolerance {args.tolerance:.0%}):")
+            for regression in regressions:
+                print(f"   {regression}")
+            sys.exit(1)
+        print(f"✅ No regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,160 @@
+"""Pooled PostgreSQL access for the portal's account queries.
+
+PostgresPool hands out health-checked connections and makes a checkout wait
+for a free one. A PooledSession checks one connection out on its first
+statement and reuses it for every later one until released, so a web request
+makes one checkout however many queries it runs; each statement is its own
+transaction. execute_pooled runs a single statement on a connection that goes
+back to the pool as soon as the statement is done. A checkout that fails
+(pool exhausted past its timeout, server unreachable) raises
+DatabaseUnavailable, which callers can tell apart from a query that simply
+found nothing. Nothing here depends on Flask (see api_server.py).
+"""
+import threading
+import time
+
+try:
+    import psycopg2
+    import psycopg2.extensions
+    import psycopg2.pool
+except ImportError:
+    psycopg2 = None
+
+
+class DatabaseUnavailable(Exception):
+    """Raised when no database connection can be checked out"""
+
+
+class PostgresPool:
+    """Thread-safe pool of PostgreSQL connections with health-checked checkout.
+
+    Wraps psycopg2's ThreadedConnectionPool, which raises instead of waiting
+    when all `maxconn` connections are out; a semaphore makes checkout wait
+    up to `timeout` seconds for one to come back. A connection that was idle
+    for more than `check_idle` seconds is pinged before it is handed out, and
+    a dead one is discarded and replaced. Connections carry no session
+    settings: behind a transaction-mode pooler (Supabase port 6543) a
+    session is not ours to keep, so execute_pooled sets statement_timeout per
+    transaction instead.
+    """
+
+    def __init__(self, minconn, maxconn, timeout, check_idle, dsn, **connect_kwargs):
+        self.pool = psycopg2.pool.ThreadedConnectionPool(minconn, maxconn, dsn, **connect_kwargs)
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.check_idle = check_idle
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._returned_at = {}  # id(connection) -> time.monotonic() when last returned
+
+    def getconn(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise psycopg2.pool.PoolError(f'No database connection free after {self.timeout}s')
+        try:
+            for _ in range(self.maxconn + 1):
+                conn = self.pool.getconn()
+                if self._healthy(conn):
+                    return conn
+                print("⚠️ Discarding dead pooled database connection")
+                self._returned_at.pop(id(conn), None)
+                self.pool.putconn(conn, close=True)
+            raise psycopg2.OperationalError('No healthy database connection')
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn, discard=False):
+        try:
+            if not conn.closed and not discard and \
+                    conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()  # never hand out a connection in the middle of a transaction
+            discard = discard or bool(conn.closed)
+        except psycopg2.Error:
+            discard = True
+        if discard:
+            self._returned_at.pop(id(conn), None)
+        else:
+            self._returned_at[id(conn)] = time.monotonic()
+        self.pool.putconn(conn, close=discard)
+        self._slots.release()
+
+    def _healthy(self, conn):
+        if conn.closed:
+            return False
+        returned_at = self._returned_at.get(id(conn))
+        if returned_at is not None and time.monotonic() - returned_at < self.check_idle:
+            return True
+        try:
+            cursor = conn.cursor()
+            cursor.execute('SELECT 1')
+            cursor.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+
+class PooledSession:
+    """One pooled connection, checked out on the first statement and reused until release().
+
+    Every statement still runs in its own transaction, so the connection is
+    idle between statements and a transaction-mode pooler may serve it from
+    any server session. release() returns the connection (a no-op if no
+    statement ran); call it when the unit of work, e.g. a web request, ends.
+    """
+
+    def __init__(self, pool, statement_timeout_ms=None):
+        self.pool = pool
+        self.statement_timeout_ms = statement_timeout_ms
+        self.conn = None
+
+    def execute(self, query, params=None, fetch_one=False, fetch_all=False):
+        """Run one statement (with ? placeholders) and return the fetched row(s), or None.
+
+        A failed statement is printed, rolled back and also returns None; a
+        connection that cannot roll back is discarded and the next statement
+        checks out another. Raises DatabaseUnavailable if no connection can
+        be checked out.
+        """
+        if self.conn is None:
+            try:
+                self.conn = self.pool.getconn()
+            except Exception as e:
+                raise DatabaseUnavailable(str(e)) from e
+        try:
+            cursor = self.conn.cursor()
+            if self.statement_timeout_ms is not None:
+                # Scoped to this transaction, so it also holds behind a transaction-mode pooler
+                cursor.execute('SET LOCAL statement_timeout = %s', (self.statement_timeout_ms,))
+            # PostgreSQL uses %s for all parameters
+            if params:
+                cursor.execute(query.replace('?', '%s'), params)
+            else:
+                cursor.execute(query)
+            result = None
+            if fetch_one:
+                result = cursor.fetchone()
+            elif fetch_all:
+                result = cursor.fetchall()
+            self.conn.commit()
+            return result
+        except Exception as e:
+            print(f"⚠️ Database error: {e}")
+            try:
+                self.conn.rollback()  # a failed statement aborts the transaction for later queries
+            except Exception:
+                self.release(discard=True)
+            return None
+
+    def release(self, discard=False):
+        if self.conn is not None:
+            conn, self.conn = self.conn, None
+            self.pool.putconn(conn, discard=discard)
+
+
+def execute_pooled(pool, query, params=None, fetch_one=False, fetch_all=False, statement_timeout_ms=None):
+    """Run one statement on a connection checked out for it alone (see PooledSession.execute)"""
+    session = PooledSession(pool, statement_timeout_ms)
+    try:
+        return session.execute(query, params, fetch_one, fetch_all)
+    finally:
+        session.release()
@@ -0,0 +1,204 @@
+"""Asynchronous extraction jobs: submit documents now, poll for the results later.
+
+A JobQueue holds submitted jobs in memory and runs them on a bounded pool of
+worker threads, so a web request only has to enqueue the upload and return a
+job ID. A job is one or more documents; its progress is the number of
+documents processed so far. Pending jobs are taken in priority order
+(interactive before normal before bulk, oldest first within a priority), but
+a job is skipped while its user already has `per_user_limit` jobs running, so
+one user's bulk submission cannot occupy every worker. Finished jobs are kept
+for `retention` seconds after they finish and are then forgotten. Jobs live
+in this process only: a restart loses queued and finished jobs.
+
+Memory is bounded by `max_bytes`: the documents of queued and running jobs
+plus the results of finished ones. When a submission does not fit, finished
+jobs are forgotten early (oldest first); if it still does not fit the queue
+is full.
+
+The queue knows nothing about extraction itself; the handler passed in turns
+one document into one result dict (see api_server.py).
+"""
+import bisect
+import itertools
+import json
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+PRIORITIES = {'interactive': 0, 'normal': 5, 'bulk': 10}
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+
+class QueueFull(Exception):
+    """Raised by JobQueue.submit when max_pending jobs are waiting or max_bytes are held"""
+
+
+class Job:
+    """One submitted job: its documents, options, state and per-document results"""
+
+    def __init__(self, documents: List[Tuple[str, str]], user: str, priority: str, options: Dict, sequence: int):
+        self.id = uuid.uuid4().hex
+        self.documents = documents  # [(filename, html_text)], dropped once processed
+        self.user = user
+        self.priority = priority
+        self.options = options
+        self.sequence = sequence
+        self.status = QUEUED
+        self.submitted_at = datetime.now().isoformat()
+        self.started_at = None
+        self.finished_at = None
+        self.finished = None  # time.time() when done or failed, for expiry
+        self.total = len(documents)
+        self.completed = 0
+        self.results = []
+        self.error = None
+        # UTF-8 bytes held for this job: its documents until processed, then its results as JSON
+        self.size = sum(len(html_text.encode('utf-8')) for _, html_text in documents)
+
+    def sort_key(self) -> Tuple[int, int]:
+        return PRIORITIES[self.priority], self.sequence
+
+    def status_dict(self) -> Dict:
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'user': self.user,
+            'priority': self.priority,
+            'progress': {'completed': self.completed, 'total': self.total,
+                         'fraction': self.completed / self.total if self.total else 1.0},
+            'submitted_at': self.submitted_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'error': self.error
+        }
+
+
+class JobQueue:
+    """Priority queue of extraction jobs served by a bounded pool of worker threads"""
+
+    def __init__(self, handler: Callable[[Job, str, str], Dict], workers: int = 2, per_user_limit: int = 1,
+                 max_pending: int = 1000, retention: int = 3600, max_bytes: int = 256 * 1024 * 1024):
+        self.handler = handler
+        self.workers = workers
+        self.per_user_limit = per_user_limit
+        self.max_pending = max_pending
+        self.retention = retention
+        self.max_bytes = max_bytes
+        self.held_bytes = 0  # sum of Job.size over self.jobs
+        self.jobs = {}  # job id -> Job, until expired
+        self.pending = []  # sorted by Job.sort_key
+        self.running = {}  # user -> jobs running
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._threads = []
+
+    def start(self):
+        """Start the worker threads (idempotent)"""
+        with self._condition:
+            while len(self._threads) < self.workers:
+                worker = threading.Thread(target=self._work, name=f'extraction-job-{len(self._threads)}', daemon=True)
+                self._threads.append(worker)
+                worker.start()
+
+    def submit(self, documents: List[Tuple[str, str]], user: str, priority: str = 'normal',
+               options: Optional[Dict] = None) -> Job:
+        """Queue documents as one job for an authenticated user
+
+        Raises ValueError for an unknown priority or a job larger than
+        max_bytes, and QueueFull when the queue is full.
+        """
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority '{priority}' (expected one of: {', '.join(PRIORITIES)})")
+        if not documents:
+            raise ValueError("A job needs at least one document")
+        job = Job(documents, user, priority, options or {}, next(self._sequence))
+        if job.size > self.max_bytes:
+            raise ValueError(f"Job is larger than {self.max_bytes} bytes")
+        with self._condition:
+            self._expire()
+            if len(self.pending) >= self.max_pending:
+                raise QueueFull(f"{len(self.pending)} jobs already queued")
+            if not self._make_room(job.size):
+                raise QueueFull(f"{self.held_bytes} bytes already held by queued and running jobs")
+            self.jobs[job.id] = job
+            self.held_bytes += job.size
+            keys = [pending.sort_key() for pending in self.pending]
+            self.pending.insert(bisect.bisect_right(keys, job.sort_key()), job)
+            self._condition.notify()
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._condition:
+            self._expire()
+            return self.jobs.get(job_id)
+
+    def stats(self) -> Dict:
+        with self._condition:
+            return {
+                'workers': self.workers,
+                'per_user_limit': self.per_user_limit,
+                'queued': len(self.pending),
+                'running': sum(self.running.values()),
+                'jobs': len(self.jobs),
+                'held_bytes': self.held_bytes,
+                'max_bytes': self.max_bytes
+            }
+
+    def _next_job(self) -> Optional[Job]:
+        """Highest-priority pending job whose user is under the limit (caller holds the condition)"""
+        for index, job in enumerate(self.pending):
+            if self.running.get(job.user, 0) < self.per_user_limit:
+                return self.pending.pop(index)
+        return None
+
+    def _expire(self):
+        """Forget jobs finished more than `retention` seconds ago (caller holds the condition)"""
+        cutoff = time.time() - self.retention
+        for job_id in [job_id for job_id, job in self.jobs.items() if job.finished is not None and job.finished < cutoff]:
+            self.held_bytes -= self.jobs.pop(job_id).size
+
+    def _make_room(self, size: int) -> bool:
+        """Forget finished jobs, oldest first, until size more bytes fit (caller holds the condition)"""
+        if self.held_bytes + size <= self.max_bytes:
+            return True
+        finished = sorted((job for job in self.jobs.values() if job.finished is not None), key=lambda job: job.finished)
+        for job in finished:
+            self.held_bytes -= self.jobs.pop(job.id).size
+            if self.held_bytes + size <= self.max_bytes:
+                return True
+        return False
+
+    def _work(self):
+        while True:
+            with self._condition:
+                job = self._next_job()
+                while job is None:
+                    self._condition.wait()
+                    job = self._next_job()
+                self.running[job.user] = self.running.get(job.user, 0) + 1
+                job.status = RUNNING
+                job.started_at = datetime.now().isoformat()
+            try:
+                for filename, html_text in job.documents:
+                    job.results.append(self.handler(job, filename, html_text))
+                    job.completed += 1
+                job.status = DONE
+            except Exception as e:
+                job.error = str(e)
+                job.status = FAILED
+                print(f"❌ Job {job.id} failed: {e}")
+            job.documents = []
+            job.finished_at = datetime.now().isoformat()
+            size = sum(len(json.dumps(result, separators=(',', ':')).encode('utf-8')) for result in job.results)
+            with self._condition:
+                self.held_bytes += size - job.size
+                job.size = size
+                job.finished = time.time()
+                self.running[job.user] -= 1
+                if not self.running[job.user]:
+                    del self.running[job.user]
+                # A slot for this user may unblock a job another worker skipped
+                self._condition.notify_all()
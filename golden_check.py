@@ -0,0 +1,276 @@
+"""Golden-output equivalence check for the extraction engines.
+
+Runs a candidate engine (an ENGINE_PRESETS name) over the corpus, in
+parallel worker processes, and diffs every mention against a reference on
+span, text, match_type, active_status, rx_cui and mapping_method. The
+default reference, 'baseline', is the stored output of the pre-optimization
+code (golden_baseline.json.gz, recorded by running that commit's own
+main.py), keyed on each file's SHA-256 so any spelling of --corpus finds
+it; any preset, e.g. 'legacy', can be the reference instead. Each mismatch
+is reported with the surrounding document text; the summary gives the
+candidate's speed relative to a live run of the reference (of the 'legacy'
+preset when the reference is stored). The exit status is 1 when there are
+more mismatches than --allow, when a file has no stored baseline or when
+no file was compared, so the check can gate a release.
+
+Usage: python golden_check.py [--candidate exact] [--reference baseline|legacy] [--jobs N]
+                              [--corpus data_900 organized_data_900] [--report mismatches.json]
+       python golden_check.py --record-baseline COMMIT   (rewrite golden_baseline.json.gz)
+"""
+import argparse
+import glob
+import gzip
+import hashlib
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List
+
+from main import ENGINE_PRESETS, MedicationExtractionPipeline
+
+COMPARED_FIELDS = ('text', 'match_type', 'active_status', 'rx_cui', 'mapping_method')
+
+BASELINE = 'baseline'
+GOLDEN_PATH = 'golden_baseline.json.gz'
+# Preset timed live as the speed reference when the mentions come from the stored baseline
+TIMING_REFERENCE = 'legacy'
+
+# (reference, timed pipeline, candidate) owned by each worker process. The reference is a
+# pipeline, or {file SHA-256: stored annotations}; the timed pipeline is the reference
+# pipeline itself, or the TIMING_REFERENCE preset next to stored annotations
+_engines = None
+
+
+def _init_worker(rxnorm_csv_path: str, reference: str, candidate: str, golden_path: str):
+    global _engines
+    if reference == BASELINE:
+        reference_engine = load_golden(golden_path, rxnorm_csv_path)['files']
+        timed = MedicationExtractionPipeline(rxnorm_csv_path, engine=TIMING_REFERENCE)
+    else:
+        reference_engine = timed = MedicationExtractionPipeline(rxnorm_csv_path, engine=reference)
+    _engines = (reference_engine, timed, MedicationExtractionPipeline(rxnorm_csv_path, engine=candidate))
+
+
+def file_sha256(path: str) -> str:
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def read_document(path: str):
+    """(SHA-256 of the file's bytes, its text)"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    return hashlib.sha256(data).hexdigest(), data.decode('utf-8')
+
+
+def load_golden(golden_path: str, rxnorm_csv_path: str) -> Dict:
+    """Stored baseline annotations; raises ValueError if they were recorded with another lexicon
+    or are keyed on paths (recorded before files were keyed on their content)"""
+    with gzip.open(golden_path, 'rt', encoding='utf-8') as f:
+        golden = json.load(f)
+    if golden.get('keyed_by') != 'sha256':
+        raise ValueError(f"{golden_path} is keyed on file paths; "
+                         f"re-record it with --record-baseline {golden['commit']}")
+    if golden['rxnorm_csv_sha256'] != file_sha256(rxnorm_csv_path):
+        raise ValueError(f"{golden_path} was recorded with a different lexicon than {rxnorm_csv_path}; "
+                         f"re-record it with --record-baseline {golden['commit']}")
+    return golden
+
+
+def record_baseline(commit: str, files: List[str], rxnorm_csv_path: str, golden_path: str):
+    """Annotate the corpus with `commit`'s own main.py and store the result as the golden baseline"""
+    source = subprocess.run(['git', 'show', f'{commit}:main.py'], capture_output=True, text=True, check=True).stdout
+    with tempfile.TemporaryDirectory() as work_dir:
+        module_path = os.path.join(work_dir, 'baseline_main.py')
+        with open(module_path, 'w', encoding='utf-8') as f:
+            f.write(source)
+        spec = importlib.util.spec_from_file_location('baseline_main', module_path)
+        baseline = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(baseline)
+        pipeline = baseline.MedicationExtractionPipeline(rxnorm_csv_path)
+        annotations = {}
+        for file_path in files:
+            digest, text = read_document(file_path)
+            if digest not in annotations:
+                annotations[digest] = annotate(pipeline, text)
+    golden = {'commit': commit, 'rxnorm_csv_sha256': file_sha256(rxnorm_csv_path), 'keyed_by': 'sha256',
+              'files': annotations}
+    with gzip.open(golden_path, 'wt', encoding='utf-8') as f:
+        json.dump(golden, f, separators=(',', ':'))
+    print(f"✅ Recorded {sum(map(len, annotations.values()))} mentions in {len(annotations)} distinct files "
+          f"from {commit} to {golden_path}")
+
+
+def annotate(pipeline, text: str) -> List[tuple]:
+    """(start, end, text, match_type, active_status, rx_cui, mapping_method) for every mention"""
+    medications = pipeline.medication_extractor.extract_medications(text)
+    # map_to_cui keeps the order of its input but does not carry match_type over
+    mapped = pipeline.rxnorm_mapper.map_to_cui(medications)
+    return [(med['start_offset'], med['end_offset'], med['text'], source.get('match_type'),
+             med['active_status'], med['rx_cui'], med['mapping_method'])
+            for source, med in zip(medications, mapped)]
+
+
+def context(text: str, start: int, end: int, width: int) -> str:
+    """The mention in [[ ]] with `width` characters either side, on one line"""
+    snippet = (text[max(0, start - width):start] + '[[' + text[start:end] + ']]' + text[end:end + width])
+    return ' '.join(snippet.split())
+
+
+def diff_document(file_path: str, text: str, expected: List[tuple], actual: List[tuple], width: int) -> List[Dict]:
+    """Mismatches between two annotation lists, matched up by span"""
+    by_span = {}
+    for side, mentions in (('reference', expected), ('candidate', actual)):
+        for mention in mentions:
+            by_span.setdefault(mention[:2], {'reference': [], 'candidate': []})[side].append(mention)
+    mismatches = []
+    for (start, end), sides in sorted(by_span.items()):
+        if sorted(sides['reference']) == sorted(sides['candidate']):
+            continue
+        reference = sides['reference'][0] if sides['reference'] else None
+        candidate = sides['candidate'][0] if sides['candidate'] else None
+        if reference is None:
+            kind = 'extra'
+        elif candidate is None:
+            kind = 'missing'
+        else:
+            kind = 'changed'
+        mismatch = {'file': file_path, 'span': [start, end], 'kind': kind,
+                    'context': context(text, start, end, width)}
+        for label, mention in (('reference', reference), ('candidate', candidate)):
+            if mention is not None:
+                mismatch[label] = dict(zip(COMPARED_FIELDS, mention[2:]))
+        if kind == 'changed':
+            mismatch['fields'] = [field for field in COMPARED_FIELDS
+                                  if mismatch['reference'][field] != mismatch['candidate'][field]]
+        mismatches.append(mismatch)
+    return mismatches
+
+
+def compare_files(file_paths: List[str], width: int) -> Dict:
+    """Worker side: run both engines on each file and diff them"""
+    reference, timed, candidate = _engines
+    summary = {'files': 0, 'mentions': 0, 'reference_seconds': 0.0, 'candidate_seconds': 0.0, 'mismatches': [],
+               'unrecorded': []}
+    for file_path in file_paths:
+        digest, text = read_document(file_path)
+        if isinstance(reference, dict) and digest not in reference:
+            summary['unrecorded'].append(file_path)
+            continue
+        start = time.perf_counter()
+        timed_mentions = annotate(timed, text)
+        middle = time.perf_counter()
+        actual = annotate(candidate, text)
+        summary['reference_seconds'] += middle - start
+        summary['candidate_seconds'] += time.perf_counter() - middle
+        if isinstance(reference, dict):
+            expected = [tuple(mention) for mention in reference[digest]]
+        else:
+            expected = timed_mentions
+        summary['files'] += 1
+        summary['mentions'] += len(expected)
+        summary['mismatches'].extend(diff_document(file_path, text, expected, actual, width))
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Diff a candidate extraction engine against the reference engine')
+    parser.add_argument('--corpus', nargs='+', default=['data_900', 'organized_data_900'],
+                        help='Folders of HTML files (searched recursively)')
+    parser.add_argument('--rxnorm-csv', default='Medication-label-set.csv',
+                        help='Path to RxNorm CSV file, a compiled lexicon artifact or an ingest-rrf lexicon')
+    parser.add_argument('--reference', choices=[BASELINE] + list(ENGINE_PRESETS), default=BASELINE,
+                        help=f"Engine taken as golden ('{BASELINE}': the outputs stored in --golden)")
+    parser.add_argument('--golden', default=GOLDEN_PATH, help='Stored baseline annotations')
+    parser.add_argument('--record-baseline', metavar='COMMIT',
+                        help="Annotate the corpus with COMMIT's main.py, write --golden and exit")
+    parser.add_argument('--candidate', choices=list(ENGINE_PRESETS), default='exact', help='Engine under test')
+    parser.add_argument('--jobs', '-j', type=int, default=0, help='Worker processes (0 = one per CPU)')
+    parser.add_argument('--limit', type=int, default=0, help='Only use the first N files of each corpus')
+    parser.add_argument('--context', type=int, default=80, help='Characters of context shown around a mismatch')
+    parser.add_argument('--show', type=int, default=20, help='Mismatches printed (all go to --report)')
+    parser.add_argument('--report', help='Write every mismatch to this JSON file')
+    parser.add_argument('--allow', type=int, default=0, help='Mismatches tolerated before the check fails')
+    args = parser.parse_args()
+
+    files = []
+    for corpus in args.corpus:
+        corpus_files = sorted(glob.glob(os.path.join(corpus, '**', '*.html'), recursive=True))
+        files.extend(corpus_files[:args.limit] if args.limit else corpus_files)
+    if not files:
+        print("No HTML files found.")
+        sys.exit(2)
+    if args.record_baseline:
+        record_baseline(args.record_baseline, files, args.rxnorm_csv, args.golden)
+        return
+    if args.reference == BASELINE:
+        try:
+            load_golden(args.golden, args.rxnorm_csv)  # fail early on a missing or mismatched baseline
+        except (OSError, ValueError) as e:
+            print(f"❌ Cannot use the stored baseline: {e}")
+            sys.exit(2)
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+    chunks = [files[i::jobs * 4] for i in range(min(len(files), jobs * 4))]
+    print(f"Comparing '{args.candidate}' against '{args.reference}' on {len(files)} files with {jobs} worker(s)...")
+
+    start_time = time.perf_counter()
+    totals = {'files': 0, 'mentions': 0, 'reference_seconds': 0.0, 'candidate_seconds': 0.0, 'mismatches': [],
+              'unrecorded': []}
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                             initargs=(args.rxnorm_csv, args.reference, args.candidate, args.golden)) as executor:
+        for summary in executor.map(compare_files, chunks, [args.context] * len(chunks)):
+            for key in ('files', 'mentions', 'reference_seconds', 'candidate_seconds'):
+                totals[key] += summary[key]
+            totals['mismatches'].extend(summary['mismatches'])
+            totals['unrecorded'].extend(summary['unrecorded'])
+    wall = time.perf_counter() - start_time
+    mismatches = sorted(totals['mismatches'], key=lambda m: (m['file'], m['span']))
+
+    for mismatch in mismatches[:args.show]:
+        print(f"\n❌ {mismatch['kind']} {os.path.basename(mismatch['file'])} {mismatch['span']}: {mismatch['context']}")
+        if mismatch['kind'] == 'changed':
+            for field in mismatch['fields']:
+                print(f"   {field}: {mismatch['reference'][field]!r} -> {mismatch['candidate'][field]!r}")
+        else:
+            print(f"   {mismatch.get('reference') or mismatch.get('candidate')}")
+    if len(mismatches) > args.show:
+        print(f"\n... {len(mismatches) - args.show} more")
+
+    kinds = {}
+    for mismatch in mismatches:
+        kinds[mismatch['kind']] = kinds.get(mismatch['kind'], 0) + 1
+    speed = totals['reference_seconds'] / totals['candidate_seconds'] if totals['candidate_seconds'] else 0.0
+    print(f"\n📊 {totals['files']} files, {totals['mentions']} reference mentions, "
+          f"{len(mismatches)} mismatches{' ' + str(kinds) if kinds else ''} in {wall:.1f}s")
+    timed = TIMING_REFERENCE if args.reference == BASELINE else args.reference
+    print(f"   Reference '{timed}' (live): {totals['reference_seconds']:.2f}s | "
+          f"candidate '{args.candidate}': {totals['candidate_seconds']:.2f}s | speedup {speed:.2f}x")
+
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump({'reference': args.reference, 'timing_reference': timed, 'candidate': args.candidate,
+                       'files': totals['files'], 'mentions': totals['mentions'], 'speedup': speed,
+                       'unrecorded': sorted(totals['unrecorded']), 'mismatches': mismatches}, f, indent=2)
+        print(f"✅ Mismatch report saved to {args.report}")
+
+    failures = []
+    if len(mismatches) > args.allow:
+        failures.append(f"{len(mismatches)} mismatches (allowed {args.allow})")
+    if totals['unrecorded']:
+        failures.append(f"{len(totals['unrecorded'])} files have no stored baseline in {args.golden} "
+                        f"(e.g. {totals['unrecorded'][0]}); re-record it with --record-baseline")
+    if not totals['files']:
+        failures.append("no files were compared")
+    if failures:
+        print(f"❌ Golden check failed: {'; '.join(failures)}")
+        sys.exit(1)
+    print("✅ Golden check passed")
+
+
+if __name__ == '__main__':
+    main()
@@ -365,22 +365,884 @@
 
 
 
-from typing import List, Dict, Optional
+from typing import Callable, List, Dict, Optional, NamedTuple
 from datetime import datetime
 import os
 import glob
 import argparse
 import json
 import re
+import html
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter, deque
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import queue
+import signal
+import threading
+import time
+import hashlib
+import gzip
+import sys
+import pickle
+import mmap
+import struct
+import zlib
+
+# Bump whenever a change to extraction, classification or mapping can change results
+ENGINE_VERSION = '2.1.2'
+
+# LocalMedicationLLM options per named engine. 'legacy' is the original
+# per-name find()/per-call regex engine. 'exact' keeps the optimizations that
+# do not change labels: its mentions and statuses match 'legacy' (checked on
+# the golden corpus by golden_check.py); the section map only answers header
+# proximity and adds each mention's 'section'. 'default' also resolves
+# overlapping mentions and marks every mention under a past/discontinued
+# <h2>/<h3> section non-active (classify_by_section).
+ENGINE_PRESETS = {
+    'legacy': dict(use_automaton=False, use_rule_bank=False, use_cue_index=False, use_sections=False,
+                   resolve_overlaps=False, memoize_classification=False, classify_by_section=False),
+    'exact': dict(resolve_overlaps=False, classify_by_section=False),
+    'default': {},
+}
+
+
+class HTMLTextLayer:
+    """Visible text of an HTML document plus a compact offset map back to the HTML.
+
+    The tokenizer is one TOKEN_RE pass over the whole document, which is
+    held in memory; it is not an incremental (streaming) tokenizer.
+    Comments, <script>, <style>, <title> and inline tags are dropped, a run of adjacent tags
+    containing a block-level tag becomes a single newline and character
+    references are decoded. Only these tokens are recorded in the map (four
+    parallel arrays: text start/end, HTML start/end); the text between them
+    is copied verbatim, so offsets there map 1:1.
+    """
+
+    # Comments, invisible elements, runs of adjacent tags, character references
+    TOKEN_RE = re.compile(
+        r'(?=[<&])(?:<!--.*?-->|<(script|style|title)\b[^>]*>.*?</\1\s*>'
+        r'|(?:<(?!!--|(?:script|style|title)\b)[^>]*>)+'
+        r'|&(?:#[0-9]+|#[xX][0-9a-fA-F]+|[A-Za-z][A-Za-z0-9]*);)',
+        re.IGNORECASE | re.DOTALL
+    )
+    BLOCK_TAG_RE = re.compile(
+        r'</?(?:address|article|aside|blockquote|br|caption|dd|div|dl|dt|footer|h[1-6]|header'
+        r'|hr|li|ol|p|pre|section|table|tbody|td|tfoot|th|thead|tr|ul)\b',
+        re.IGNORECASE
+    )
+
+    def __init__(self, html_text: str):
+        self.html = html_text
+        text_starts, text_ends, html_starts, html_ends = [], [], [], []
+        chunks = []
+        position = 0
+        text_length = 0
+        is_block = self.BLOCK_TAG_RE.search
+        for token in self.TOKEN_RE.finditer(html_text):
+            token_start, token_end = token.span()
+            if token_start > position:
+                chunks.append(html_text[position:token_start])
+                text_length += token_start - position
+            position = token_end
+            raw = token.group(0)
+            if raw[0] == '&':
+                replacement = html.unescape(raw)
+            elif token.group(1) is None and raw[1] != '!' and is_block(raw):
+                replacement = '\n'
+            else:
+                replacement = ''
+            text_starts.append(text_length)
+            html_starts.append(token_start)
+            html_ends.append(token_end)
+            if replacement:
+                chunks.append(replacement)
+                text_length += len(replacement)
+            text_ends.append(text_length)
+        chunks.append(html_text[position:])
+        self.text = ''.join(chunks)
+        self.text_starts = array('l', text_starts)
+        self.text_ends = array('l', text_ends)
+        self.html_starts = array('l', html_starts)
+        self.html_ends = array('l', html_ends)
+
+    def to_html_span(self, start: int, end: int) -> tuple:
+        """Map a [start, end) text span to the HTML span it was read from"""
+        # Last token whose replacement starts at or before the first / last character
+        i = bisect_right(self.text_starts, start) - 1
+        if i < 0:
+            html_start = start
+        elif start < self.text_ends[i]:
+            html_start = self.html_starts[i]
+        else:
+            html_start = self.html_ends[i] + (start - self.text_ends[i])
+        j = bisect_right(self.text_starts, end - 1) - 1
+        if j < 0:
+            html_end = end
+        elif end - 1 < self.text_ends[j]:
+            html_end = self.html_ends[j]
+        else:
+            html_end = self.html_ends[j] + (end - self.text_ends[j])
+        return html_start, html_end
+
+    def to_text_offset(self, html_offset: int) -> int:
+        """Map an HTML offset to the text offset of the first visible character at or after it"""
+        i = bisect_right(self.html_starts, html_offset) - 1
+        if i < 0:
+            return html_offset
+        if html_offset < self.html_ends[i]:
+            return self.text_starts[i]
+        return self.text_ends[i] + (html_offset - self.html_ends[i])
+
+
+class AhoCorasickMatcher:
+    """Multi-pattern matcher: finds every lexicon string in one linear pass over the text"""
+
+    def __init__(self):
+        self.goto = [{}]      # state -> {char: next_state}
+        self.fail = [0]       # state -> failure link
+        self.output = [()]    # state -> ids of patterns ending in this state
+        self.patterns = []    # pattern id -> (pattern, payload)
+        self.compiled = False
+
+    def add_pattern(self, pattern: str, payload: Dict) -> int:
+        """Add a (lowercased) pattern with the payload to emit when it matches"""
+        pattern_id = len(self.patterns)
+        self.patterns.append((pattern, payload))
+        if not pattern:
+            return pattern_id
+        state = 0
+        for ch in pattern:
+            next_state = self.goto[state].get(ch)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto[state][ch] = next_state
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append(())
+            state = next_state
+        self.output[state] = self.output[state] + (pattern_id,)
+        self.compiled = False
+        return pattern_id
+
+    def to_state(self) -> tuple:
+        """Compiled tables as plain built-in containers (for serialization)"""
+        if not self.compiled:
+            self.compile()
+        return self.goto, self.fail, self.output, self.patterns
+
+    @classmethod
+    def from_state(cls, state: tuple) -> 'AhoCorasickMatcher':
+        matcher = cls()
+        matcher.goto, matcher.fail, matcher.output, matcher.patterns = state
+        matcher.compiled = True
+        return matcher
+
+    def compile(self):
+        """Build failure links breadth-first so scanning never backtracks"""
+        queue = deque()
+        for next_state in self.goto[0].values():
+            self.fail[next_state] = 0
+            queue.append(next_state)
+        while queue:
+            state = queue.popleft()
+            for ch, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and ch not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(ch, 0)
+                self.output[next_state] = self.output[next_state] + self.output[self.fail[next_state]]
+        self.compiled = True
+
+    def find_all(self, lowered_text: str) -> List[tuple]:
+        """Return (pattern_id, start) for every match, sorted by pattern id then offset.
+
+        Occurrences of the same pattern never overlap, which mirrors repeated
+        str.find() calls that resume after the previous match.
+        """
+        if not self.compiled:
+            self.compile()
+        goto, fail, output, patterns = self.goto, self.fail, self.output, self.patterns
+        next_allowed = {}
+        matches = []
+        state = 0
+        for i, ch in enumerate(lowered_text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if output[state]:
+                for pattern_id in output[state]:
+                    start = i + 1 - len(patterns[pattern_id][0])
+                    if start >= next_allowed.get(pattern_id, 0):
+                        matches.append((pattern_id, start))
+                        next_allowed[pattern_id] = i + 1
+        matches.sort()
+        return matches
+
+
+class _DecodedCache(dict):
+    """dict that fills itself from a decoder on first access to a key"""
+
+    def __init__(self, decode):
+        super().__init__()
+        self.decode = decode
+
+    def __missing__(self, key):
+        value = self[key] = self.decode(key)
+        return value
+
+
+class MappedAhoCorasickMatcher(AhoCorasickMatcher):
+    """AhoCorasickMatcher whose tables live in a MappedLexiconFile.
+
+    Failure links are read straight from the mapping. Transitions, outputs
+    and patterns are decoded the first time a scan reaches them and cached
+    per process, so a worker only materializes the part of the automaton its
+    documents actually touch: clinical text reaches a small fraction of the
+    states, and even a fully decoded cache is smaller than the unpickled
+    automaton (bench_rrf_lexicon.py --workers reports the per-worker split).
+    """
+
+    def __init__(self, lexicon_file: 'MappedLexiconFile'):
+        super().__init__()
+        section = lexicon_file.section
+        self.fail = section('ac.fail')
+        self._out_offsets, self._out_ids = section('ac.out_offsets'), section('ac.out_ids')
+        self._trans_offsets = section('ac.trans_offsets')
+        self._trans_chars, self._trans_next = section('ac.trans_chars'), section('ac.trans_next')
+        pattern_strings, pattern_payloads = section('ac.patterns'), section('ac.pattern_payloads')
+        pattern_generics = section('ac.pattern_generics')
+        templates = lexicon_file.header['payload_templates']
+
+        def decode_pattern(pattern_id):
+            payload = dict(templates[pattern_payloads[pattern_id]])
+            generic_name = lexicon_file.string(pattern_generics[pattern_id])
+            if generic_name is not None:
+                payload['generic_name'] = generic_name
+            return lexicon_file.string(pattern_strings[pattern_id]), payload
+
+        # None until decoded; plain lists keep the per-character lookups as fast as the dict matcher's
+        self.goto = [None] * len(self.fail)
+        self.output = [None] * len(self.fail)
+        self.patterns = _DecodedCache(decode_pattern)
+        self.compiled = True
+
+    def add_pattern(self, pattern: str, payload: Dict) -> int:
+        raise TypeError("a mapped matcher is read-only")
+
+    def _transitions(self, state: int) -> Dict[str, int]:
+        a, b = self._trans_offsets[state], self._trans_offsets[state + 1]
+        transitions = self.goto[state] = dict(zip(map(chr, self._trans_chars[a:b]), self._trans_next[a:b]))
+        return transitions
+
+    def _output(self, state: int) -> tuple:
+        output = self.output[state] = tuple(self._out_ids[self._out_offsets[state]:self._out_offsets[state + 1]])
+        return output
+
+    def to_state(self) -> tuple:
+        raise TypeError("a mapped matcher is already serialized")
+
+    def find_all(self, lowered_text: str) -> List[tuple]:
+        """Same scan as AhoCorasickMatcher.find_all, decoding states on first visit"""
+        goto, fail, output, patterns = self.goto, self.fail, self.output, self.patterns
+        next_allowed = {}
+        matches = []
+        state = 0
+        transitions = goto[0]
+        if transitions is None:
+            transitions = self._transitions(0)
+        for i, ch in enumerate(lowered_text):
+            while state and ch not in transitions:
+                state = fail[state]
+                transitions = goto[state]
+                if transitions is None:
+                    transitions = self._transitions(state)
+            state = transitions.get(ch, 0)
+            transitions = goto[state]
+            if transitions is None:
+                transitions = self._transitions(state)
+            state_output = output[state]
+            if state_output is None:
+                state_output = self._output(state)
+            if state_output:
+                for pattern_id in state_output:
+                    start = i + 1 - len(patterns[pattern_id][0])
+                    if start >= next_allowed.get(pattern_id, 0):
+                        matches.append((pattern_id, start))
+                        next_allowed[pattern_id] = i + 1
+        matches.sort()
+        return matches
+
+
+class NonActiveRuleBank:
+    """Negation/temporal regex rules used by _is_non_active for one medication term"""
+
+    def __init__(self, med_text: str, compiled: bool = True):
+        self.med_text = med_text
+        self.compiled = compiled
+        self.patterns = self.build_patterns(med_text)
+        if compiled:
+            # One alternation per rule group: re.search(a|b) matches iff a or b does
+            self.patterns = {
+                group: re.compile('|'.join('(?:%s)' % p for p in patterns), re.IGNORECASE)
+                for group, patterns in self.patterns.items()
+            }
+
+    def matches(self, group: str, haystack: str, pos: int = 0, endpos: Optional[int] = None) -> bool:
+        """True if any rule in the group matches haystack[pos:endpos]
+
+        The rules use no anchors or lookbehind, so searching with pos/endpos
+        gives the same answer as searching the slice.
+        """
+        if endpos is None:
+            endpos = len(haystack)
+        if self.compiled:
+            return self.patterns[group].search(haystack, pos, endpos) is not None
+        if pos or endpos != len(haystack):
+            haystack = haystack[pos:endpos]
+        return any(re.search(pattern, haystack, re.IGNORECASE) for pattern in self.patterns[group])
+
+    @staticmethod
+    def build_patterns(med_text: str) -> Dict[str, List[str]]:
+        """Build the regex source for every rule group around the escaped term"""
+        med = re.escape(med_text)
+        return {
+            # Treatment failure patterns that should be non-active
+            'treatment_failure': [
+                r'no\s+improvement\s+with\s+\w*\s*' + med,
+                r'no\s+response\s+to\s+\w*\s*' + med,
+                r'ineffective\s+\w*\s*' + med,
+                r'not\s+working\s+\w*\s*' + med,
+                r'failed\s+\w*\s*' + med,
+                r'no\s+benefit\s+(from|with)\s+\w*\s*' + med,
+                r'minimal\s+improvement\s+with\s+\w*\s*' + med,
+                r'poor\s+response\s+to\s+\w*\s*' + med,
+            ],
+            'strong_active': [
+                r'maintain\s+(his|her|their|the)?\s*\w*\s*' + med,
+                r'continue\s+(his|her|their|the)?\s*\w*\s*' + med,
+                r'continuing\s+(his|her|their|the)?\s*\w*\s*' + med,
+                r'keep\s+(him|her|them|patient)?\s*on\s*\w*\s*' + med,
+                r'remain\s+on\s+\w*\s*' + med,
+                r'stay\s+on\s+\w*\s*' + med,
+            ],
+            'maintain_context': [
+                r'maintain.*?' + med,
+                r'having.*?maintain.*?' + med,
+                r'continue.*?' + med,
+            ],
+            'current_medication': [
+                r'(current|currently|taking|on)\s+\w*\s*' + med,
+                r'continue\s+' + med,
+                r'refill\s+' + med,
+                r'maintain\s+' + med,
+                r'high\s+dose.*?' + med,  # "on High dose still with symptoms"
+                r'still\s+(on|taking|with).*?' + med,
+            ],
+            'dose_change': [
+                r'(increase|decrease|adjust|titrate|change\s+dose|modify\s+dose|raise|lower)\s+\w*\s*' + med,
+                r'increase\s+' + med,
+                r'decrease\s+' + med,
+                r'adjust\s+' + med,
+                r'titrate\s+' + med,
+                r'escalate\s+' + med,
+                r'reduce\s+' + med,
+                r'continue\s+' + med,
+                r'refill\s+' + med,
+                r'maintain\s+' + med,
+            ],
+            'non_active': [
+                # Past tense patterns - ADD THESE
+                r'took\s+\w*\s*' + med,  # "took apixaban"
+                r'was\s+taking\s+\w*\s*' + med,  # "was taking apixaban"
+                r'had\s+taken\s+\w*\s*' + med,  # "had taken apixaban"
+                r'has\s+taken\s+\w*\s*' + med,  # "has taken apixaban"
+
+                # Duration patterns indicating past use - ADD THESE
+                r'took\s+\w*\s*' + med + r'\s+for\s+\d+',  # "took med for 3 months"
+                r'was\s+on\s+\w*\s*' + med + r'\s+for\s+\d+',  # "was on med for 3 months"
+                r'taking\s+\w*\s*' + med + r'\s+for\s+\d+\s+(months?|weeks?|days?)',  # past duration
+                r'had\s+been\s+\w*\s*' + med + r'\s+for\s+\d+\s+(months?|weeks?|days?)',  # past duration
+                # Past tense patterns
+                r'(was|were)\s+(on|taking|prescribed)\s+\w*\s*' + med,
+                r'had\s+(been\s+)?(taking|on|prescribed)\s+\w*\s*' + med,
+                r'used\s+to\s+(take|be\s+on)\s+\w*\s*' + med,
+                r'previously\s+(took|taking|on|prescribed)\s+\w*\s*' + med,
+                r'formerly\s+(took|taking|on)\s+\w*\s*' + med,
+
+                # Discontinuation patterns
+                r'(discontinued|stopped|ceased|quit|ended)\s+\w*\s*' + med,
+                r'no\s+longer\s+(taking|on)\s+\w*\s*' + med,
+                r'came\s+off\s+(of\s+)?\w*\s*' + med,
+                r'weaned\s+off\s+(of\s+)?\w*\s*' + med,
+                r'tapered\s+off\s+(of\s+)?\w*\s*' + med,
+
+                # Refusal/avoidance patterns
+                r'(refusing|refused|denies|declines)\s+\w*\s*' + med,
+                r'wants?\s+to\s+(remain\s+)?off\s+(of\s+)?\w*\s*' + med,
+                r'(avoid|avoiding|stayed\s+away\s+from)\s+\w*\s*' + med,
+                r'not\s+(currently\s+)?(taking|on)\s+\w*\s*' + med,
+                r'off\s+(of\s+)?\w*\s*' + med,
+
+                # Allergy/contraindication patterns
+                r'(allergic|allergy)\s+to\s+\w*\s*' + med,
+                r'contraindicated\s+\w*\s*' + med,
+                r'intolerant\s+to\s+\w*\s*' + med,
+                r'adverse\s+reaction\s+to\s+\w*\s*' + med,
+
+                # Temporal indicators of past use
+                r'in\s+the\s+past\s+\w*\s*' + med,
+                r'historically\s+\w*\s*' + med,
+                r'prior\s+to\s+\w*\s*' + med,
+                r'before\s+\w*\s*' + med,
+
+                # Trial/temporary use patterns
+                r'tried\s+\w*\s*' + med,
+                r'attempted\s+\w*\s*' + med,
+                r'briefly\s+(took|on)\s+\w*\s*' + med,
+                r'short\s+trial\s+of\s+\w*\s*' + med,
+
+                # Failed therapy patterns
+                r'failed\s+\w*\s*' + med,
+                r'ineffective\s+\w*\s*' + med,
+                r'did\s+not\s+tolerate\s+\w*\s*' + med,
+                r'could\s+not\s+tolerate\s+\w*\s*' + med,
+
+                # Switching medications patterns
+                r'(his|her|their|the)?\s*' + med + r'\s+was\s+(changed|switched)\s+to',
+                r'change\s+(from\s+)?' + med + r'\s+to',
+                r'switch\s+(from\s+)?' + med + r'\s+to',
+                r'replaced\s+' + med + r'\s+with',
+                r'substitute\s+' + med + r'\s+with',
+                r'transition\s+(from\s+)?' + med + r'\s+to',
+
+                # Including/listing patterns (often non-active)
+                r'including\s+\w*\s*' + med,
+                r'such\s+as\s+\w*\s*' + med,
+                r'like\s+\w*\s*' + med,
+            ],
+        }
+
+
+class Section(NamedTuple):
+    """One interval of a document's section map"""
+    start: int
+    end: int
+    title: str
+    kind: Optional[str]  # 'past', 'discontinued' or None
+    level: int           # 2 or 3 for <h2>/<h3>
+
+
+class DocumentSectionMap:
+    """Interval map from document offsets to the section they fall in.
+
+    Built from the <h2>/<h3> anchors and the Table of Contents that these
+    CDA exports share. Each heading opens a section that runs to the next
+    heading, so the intervals are sorted and disjoint and any offset
+    resolves with a bisect. Header phrases that appear inline rather than
+    as headings (inline_headers, by kind) are located once per document, so
+    "is there such a header just before this offset" is also a bisect.
+    Nothing is parsed until the first query.
+    """
+
+    HEADING_RE = re.compile(r'<h([23])[^>]*>(.*?)</h\1\s*>', re.IGNORECASE | re.DOTALL)
+    ANCHOR_NAME_RE = re.compile(r'<a\s[^>]*\bname="([^"]+)"', re.IGNORECASE)
+    TOC_ENTRY_RE = re.compile(r'<a\s[^>]*\bhref="#([^"]+)"[^>]*>(.*?)</a>', re.IGNORECASE | re.DOTALL)
+    TAG_RE = re.compile(r'<[^>]+>')
+
+    def __init__(self, text: str, header_kinds: Dict[str, str], text_layer: Optional[HTMLTextLayer] = None,
+                 inline_headers: Optional[Dict[str, tuple]] = None):
+        self.text = text
+        self.header_kinds = header_kinds
+        self.text_layer = text_layer
+        self.inline_headers = inline_headers or {}
+        self._sections = None
+        self._section_starts = None
+        self._header_positions = {}  # kind -> (sorted starts, suffix-min ends)
+        self._lowered_text = None
+
+    @property
+    def sections(self) -> List[Section]:
+        if self._sections is None:
+            if self.text_layer is None:
+                sections = self._build_sections(self.text)
+            else:
+                # Headings are found in the HTML; boundaries are moved into text offsets
+                sections = [
+                    section._replace(start=self.text_layer.to_text_offset(section.start),
+                                     end=self.text_layer.to_text_offset(section.end))
+                    for section in self._build_sections(self.text_layer.html)
+                ]
+            self._section_starts = [section.start for section in sections]
+            self._sections = sections
+        return self._sections
+
+    def _title_kind(self, title: str) -> Optional[str]:
+        lowered = title.lower()
+        for header, kind in self.header_kinds.items():
+            if header in lowered:
+                return kind
+        return None
+
+    def _clean_title(self, markup: str) -> str:
+        return ' '.join(html.unescape(self.TAG_RE.sub(' ', markup)).split())
+
+    def _build_sections(self, text: str) -> List[Section]:
+        headings = list(self.HEADING_RE.finditer(text))
+        # The Table of Contents names every section anchor
+        toc_titles = {}
+        for i, heading in enumerate(headings):
+            anchor = self.ANCHOR_NAME_RE.search(heading.group(2))
+            if anchor and anchor.group(1) == 'toc':
+                toc_end = headings[i + 1].start() if i + 1 < len(headings) else len(text)
+                for entry in self.TOC_ENTRY_RE.finditer(text, heading.end(), toc_end):
+                    toc_titles[entry.group(1)] = self._clean_title(entry.group(2))
+        sections = []
+        for i, heading in enumerate(headings):
+            anchor = self.ANCHOR_NAME_RE.search(heading.group(2))
+            title = (anchor and toc_titles.get(anchor.group(1))) or self._clean_title(heading.group(2))
+            end = headings[i + 1].start() if i + 1 < len(headings) else len(text)
+            sections.append(Section(heading.start(), end, title, self._title_kind(title), int(heading.group(1))))
+        return sections
+
+    def section_at(self, offset: int) -> Optional[Section]:
+        """The <h2>/<h3> section containing offset, if any"""
+        sections = self.sections
+        i = bisect_right(self._section_starts, offset) - 1
+        if i >= 0 and offset < sections[i].end:
+            return sections[i]
+        return None
+
+    def _lowered(self) -> Optional[str]:
+        """The document lowercased once, or None where lowering would shift offsets (see DocumentCueIndex)"""
+        if self._lowered_text is None:
+            lowered = self.text.lower()
+            self._lowered_text = lowered if len(lowered) == len(self.text) and 'Σ' not in self.text else ''
+        return self._lowered_text or None
+
+    def header_before(self, kind: str, offset: int, distance: int) -> bool:
+        """True if an inline header phrase of `kind` lies entirely in [offset - distance, offset)"""
+        entry = self._header_positions.get(kind)
+        if entry is None:
+            spans = []
+            lowered = self._lowered()
+            for phrase in self.inline_headers.get(kind, ()):
+                if lowered is not None:
+                    idx = lowered.find(phrase)
+                    while idx != -1:
+                        spans.append((idx, idx + len(phrase)))
+                        idx = lowered.find(phrase, idx + 1)
+                else:
+                    spans.extend(match.span() for match in re.finditer(re.escape(phrase), self.text, re.IGNORECASE))
+            spans.sort()
+            starts = [span_start for span_start, _ in spans]
+            min_ends = [span_end for _, span_end in spans]
+            for i in range(len(min_ends) - 2, -1, -1):
+                if min_ends[i + 1] < min_ends[i]:
+                    min_ends[i] = min_ends[i + 1]
+            entry = self._header_positions[kind] = (starts, min_ends)
+        starts, min_ends = entry
+        i = bisect_left(starts, max(0, offset - distance))
+        return i < len(starts) and min_ends[i] <= offset
+
+    def kind_at(self, offset: int) -> Optional[str]:
+        """'past' or 'discontinued' if offset lies in such a section"""
+        section = self.section_at(offset)
+        return section.kind if section is not None else None
+
+
+class DocumentWindowView:
+    """Answers classifier queries by slicing and lowercasing windows of the document"""
+
+    def __init__(self, text: str, sections: Optional[DocumentSectionMap] = None):
+        self.text = text
+        self.sections = sections
+
+    def section_kind(self, offset: int) -> Optional[str]:
+        """Kind of the section the offset falls in, when a section map is available"""
+        return self.sections.kind_at(offset) if self.sections is not None else None
+
+    def header_before(self, kind: str, cues: tuple, offset: int, distance: int) -> bool:
+        """True if a `kind` header phrase (one of cues) ends within distance characters before offset.
+
+        With a section map this is a lookup in its header index; without one
+        the window is scanned for the cues.
+        """
+        if self.sections is not None:
+            return self.sections.header_before(kind, offset, distance)
+        return self.has_cue(cues, max(0, offset - distance), offset)
+
+    def lowered_slice(self, start: int, end: int) -> str:
+        return self.text[start:end].lower()
+
+    def has_cue(self, cues: tuple, window_start: int, window_end: int) -> bool:
+        """True if any cue phrase occurs entirely inside [window_start, window_end)"""
+        window = self.text[window_start:window_end].lower()
+        return any(cue in window for cue in cues)
+
+    def rule_matches(self, rules: NonActiveRuleBank, group: str, window_start: int, window_end: int) -> bool:
+        """True if a rule group matches inside [window_start, window_end)"""
+        return rules.matches(group, self.text[window_start:window_end].lower())
+
+
+class DocumentCueIndex(DocumentWindowView):
+    """Sorted cue positions for one document, so window checks are bisect lookups.
+
+    Only the text that a classifier window can reach is indexed: the spans
+    around the document's mentions are merged into regions, each region is
+    lowercased once, and every cue phrase is located in it once. "Is there a
+    cue of this group in [a, b)" is then a bisect on the sorted start offsets
+    plus a suffix minimum of the end offsets, and regex rules run on the
+    lowered region with pos/endpos instead of freshly lowered slices.
+    """
+
+    def __init__(self, text: str, mention_spans: List[tuple], reach: int,
+                 sections: Optional[DocumentSectionMap] = None):
+        super().__init__(text, sections)
+        # Merge the windows first, then slice and lower each region once
+        bounds = []  # [region_start, region_end]
+        for start, end in sorted(mention_spans):
+            next_start, next_end = max(0, start - reach), min(len(text), end + reach)
+            if bounds and next_start <= bounds[-1][1]:
+                bounds[-1][1] = max(bounds[-1][1], next_end)
+            else:
+                bounds.append([next_start, next_end])
+        self._region_starts = [region_start for region_start, _ in bounds]
+        self._regions = [(region_start, text[region_start:region_end].lower())  # (region_start, lowered text)
+                         for region_start, region_end in bounds]
+        self._positions = {}  # cue tuple -> (sorted starts, suffix-min ends)
+
+    @classmethod
+    def build(cls, text: str, mention_spans: List[tuple], reach: int,
+              sections: Optional[DocumentSectionMap] = None) -> Optional['DocumentCueIndex']:
+        """Index the document, or None if lowercasing would shift offsets.
+
+        Offsets in a lowered region match the original only if lowering is
+        1:1; final sigma is the one context-dependent lowering in str.lower().
+        """
+        index = cls(text, mention_spans, reach, sections)
+        for region_start, lowered in index._regions:
+            original = text[region_start:region_start + len(lowered)]
+            if len(lowered) != len(original) or 'Σ' in original:
+                return None
+        return index
+
+    def _region(self, pos: int) -> tuple:
+        return self._regions[bisect_right(self._region_starts, pos) - 1]
+
+    def lowered_slice(self, start: int, end: int) -> str:
+        region_start, lowered = self._region(start)
+        return lowered[start - region_start:end - region_start]
+
+    def _cue_positions(self, cues: tuple) -> tuple:
+        entry = self._positions.get(cues)
+        if entry is None:
+            spans = []
+            for region_start, lowered in self._regions:
+                for cue in set(cues):
+                    idx = lowered.find(cue)
+                    while idx != -1:
+                        spans.append((region_start + idx, region_start + idx + len(cue)))
+                        idx = lowered.find(cue, idx + 1)
+            spans.sort()
+            starts = [span_start for span_start, _ in spans]
+            min_ends = [span_end for _, span_end in spans]
+            for i in range(len(min_ends) - 2, -1, -1):
+                if min_ends[i + 1] < min_ends[i]:
+                    min_ends[i] = min_ends[i + 1]
+            entry = self._positions[cues] = (starts, min_ends)
+        return entry
+
+    def has_cue(self, cues: tuple, window_start: int, window_end: int) -> bool:
+        starts, min_ends = self._cue_positions(cues)
+        i = bisect_left(starts, window_start)
+        return i < len(starts) and min_ends[i] <= window_end
+
+    def rule_matches(self, rules: NonActiveRuleBank, group: str, window_start: int, window_end: int) -> bool:
+        region_start, lowered = self._region(window_start)
+        return rules.matches(group, lowered, window_start - region_start, window_end - region_start)
+
+
+class StageTimings:
+    """Seconds per stage and event counters for one document"""
+
+    __slots__ = ('file', 'stages', 'counts')
+
+    def __init__(self, file_name: str):
+        self.file = file_name
+        self.stages = {}
+        self.counts = {}
+
+    def lap(self, stage: str, since: float) -> float:
+        """Add the time since `since` to stage; returns now, to start the next lap"""
+        now = time.perf_counter()
+        self.stages[stage] = self.stages.get(stage, 0.0) + now - since
+        return now
+
+    def count(self, name: str, n: int = 1):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def as_dict(self) -> Dict:
+        return {'file': self.file, 'stages': self.stages, 'counts': self.counts}
+
+
+class PipelineInstrumentation:
+    """Hooks for per-stage timers and counters in MedicationExtractionPipeline.
+
+    Disabled (the pipeline's instrumentation is None) it costs nothing: every
+    timing point is behind an `is not None` check and the classifier only
+    gets a timing view of the document when enabled. Enabled, the pipeline
+    calls begin_document, fills the StageTimings in and passes it to
+    end_document, which hands the finished record to on_document. The
+    default on_document keeps running totals; override it to forward records
+    to a metrics system.
+
+    Stage names: read, text_layer, extract_automaton (or extract_generic and
+    extract_brand), dedup, classify, map; classify.rule.<group> and
+    classify.cue.<group> time the checks inside _is_non_active.
+    """
+
+    def __init__(self):
+        self.documents = 0
+        self.stages = {}
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    def begin_document(self, file_path: str) -> StageTimings:
+        return StageTimings(os.path.basename(file_path))
+
+    def end_document(self, timings: StageTimings) -> Dict:
+        record = timings.as_dict()
+        self.on_document(record)
+        return record
+
+    def on_document(self, record: Dict):
+        """Add one per-document record (possibly from a worker process) to the totals"""
+        with self._lock:
+            self.documents += 1
+            for stage, seconds in record['stages'].items():
+                self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+            for name, n in record['counts'].items():
+                self.counts[name] = self.counts.get(name, 0) + n
+
+    def summary(self) -> Dict:
+        with self._lock:
+            return {'documents': self.documents, 'stages': dict(self.stages), 'counts': dict(self.counts)}
+
+    def report(self) -> str:
+        """Stage totals, slowest first, with nested stages indented under their parent"""
+        summary = self.summary()
+        lines = [f"⏱️ Stage timings over {summary['documents']} documents:"]
+        for stage, seconds in sorted(summary['stages'].items(), key=lambda item: -item[1]):
+            if '.' in stage:
+                continue
+            lines.append(f"   {stage:24s} {seconds:8.3f}s")
+            nested = [(name, value) for name, value in summary['stages'].items() if name.startswith(stage + '.')]
+            for name, value in sorted(nested, key=lambda item: -item[1]):
+                calls = summary['counts'].get(name, 0)
+                lines.append(f"     {name[len(stage) + 1:]:30s} {value:8.3f}s  {calls} calls")
+        counters = [f"{name} {n}" for name, n in sorted(summary['counts'].items())
+                    if name not in summary['stages']]
+        if counters:
+            lines.append('   Counts: ' + ', '.join(counters))
+        return '\n'.join(lines)
+
+
+class InstrumentedWindowView(DocumentWindowView):
+    """Delegates to another document view and times each rule group and cue lookup"""
+
+    def __init__(self, view: DocumentWindowView, timings: StageTimings, cue_names: Dict[tuple, str]):
+        super().__init__(view.text, view.sections)
+        self.view = view
+        self.timings = timings
+        self.cue_names = cue_names
+
+    def section_kind(self, offset: int) -> Optional[str]:
+        return self.view.section_kind(offset)
+
+    def header_before(self, kind: str, cues: tuple, offset: int, distance: int) -> bool:
+        if self.sections is None:
+            return super().header_before(kind, cues, offset, distance)  # timed as a cue lookup
+        name = 'classify.section.' + kind
+        start = time.perf_counter()
+        found = self.view.header_before(kind, cues, offset, distance)
+        self.timings.lap(name, start)
+        self.timings.count(name)
+        return found
+
+    def lowered_slice(self, start: int, end: int) -> str:
+        return self.view.lowered_slice(start, end)
+
+    def has_cue(self, cues: tuple, window_start: int, window_end: int) -> bool:
+        name = 'classify.cue.' + self.cue_names.get(cues, 'other')
+        start = time.perf_counter()
+        found = self.view.has_cue(cues, window_start, window_end)
+        self.timings.lap(name, start)
+        self.timings.count(name)
+        return found
+
+    def rule_matches(self, rules: NonActiveRuleBank, group: str, window_start: int, window_end: int) -> bool:
+        name = 'classify.rule.' + group
+        start = time.perf_counter()
+        found = self.view.rule_matches(rules, group, window_start, window_end)
+        self.timings.lap(name, start)
+        self.timings.count(name)
+        return found
+
 
 class LocalMedicationLLM:
     """Medication extraction with confidence-based filtering and active/non-active tagging"""
 
-    def __init__(self, medication_lexicon: Dict[str, Dict]):
+    def __init__(self, medication_lexicon: Dict[str, Dict], use_automaton: bool = True,
+                 use_rule_bank: bool = True, use_cue_index: bool = True, use_sections: bool = True,
+                 resolve_overlaps: bool = True, memoize_classification: bool = False,
+                 classify_by_section: bool = True, artifact: Optional[Dict] = None):
         self.medication_lexicon = medication_lexicon
-        self.generic_names = list(medication_lexicon.keys())
-        self.brand_names = self._extract_brand_names(medication_lexicon)
         self.min_confidence_threshold = 0.95
+        self.use_automaton = use_automaton
+        if artifact is not None:
+            # Tables and matcher come prebuilt from a compiled lexicon artifact
+            self.generic_names = artifact.get('generic_names') or list(medication_lexicon.keys())
+            self.brand_names = artifact['brand_names']
+            self.combination_variants = artifact['combination_variants']
+            self.matcher = artifact['matcher'] if use_automaton else None
+        else:
+            self.generic_names = list(medication_lexicon.keys())
+            self.brand_names = self._extract_brand_names(medication_lexicon)
+            self.combination_variants = {
+                generic_name: self._create_combination_variations(generic_name)
+                for generic_name in self.generic_names
+                if '/' in generic_name or ' / ' in generic_name
+            }
+            # Compiled once per lexicon; scans replace the per-entry find() loops
+            self.matcher = self._build_matcher() if use_automaton else None
+        # Precompiled negation/temporal rules keyed by term. They belong to this
+        # extractor, so a hot-reloaded lexicon's banks are freed with its pipeline.
+        # With an artifact or an RRF-scale lexicon they compile lazily, on the
+        # first mention of each term.
+        self.use_rule_bank = use_rule_bank
+        self._rule_banks: Dict[str, NonActiveRuleBank] = {}
+        if use_rule_bank and artifact is None and not isinstance(medication_lexicon, CompactLexicon):
+            for term in self._lexicon_terms():
+                self._rule_bank(term)
+        # Per-document cue position index for the substring checks in _is_non_active
+        self.use_cue_index = use_cue_index
+        # Per-document section map from <h2>/<h3> anchors and inline sub-headers
+        self.use_sections = use_sections
+        # Treat a mention under a past/discontinued section heading as non-active (needs use_sections)
+        self.classify_by_section = classify_by_section
+        # Keep only the longest, highest-confidence mention per overlapping region
+        self.resolve_overlaps = resolve_overlaps
+        # Classify each distinct (context window, mention, section) once per document. Off by
+        # default: repeats are rare in clinical notes and each key copies ~2 * CONTEXT_REACH chars
+        self.memoize_classification = memoize_classification
+        # Shared by every thread using this extractor, so updated under a lock once per document
+        self.classification_memo_stats = {'lookups': 0, 'hits': 0}
+        self._memo_stats_lock = threading.Lock()
 
     def _extract_brand_names(self, lexicon: Dict[str, Dict]) -> Dict[str, str]:
         """Extract brand names and map to generic names"""
@@ -391,21 +1253,44 @@ class LocalMedicationLLM:
                     brand_to_generic[brand.lower()] = generic
         return brand_to_generic
 
-    def extract_medications(self, text: str) -> List[Dict]:
-        """Extract medication mentions from text - only high confidence results"""
+    def extract_medications(self, text: str, text_layer: Optional[HTMLTextLayer] = None,
+                            classify: bool = True, timings: Optional[StageTimings] = None) -> List[Dict]:
+        """Extract medication mentions from text - only high confidence results
+
+        When text is the visible text of an HTMLTextLayer, pass the layer so
+        sections are read from the original markup. With classify=False the
+        mentions are returned without active_status/section; classify them
+        later, if at all, with classify_medications. Stage times and counts
+        go to timings when given.
+        """
+        start = time.perf_counter() if timings is not None else 0.0
         medications = []
-        # Method 1: Generic name matching (highest confidence: 0.98)
-        medications.extend(self._extract_by_generic_names(text))
-        # Method 2: Brand name matching (high confidence: 0.96)
-        medications.extend(self._extract_by_brand_names(text))
-        # Remove duplicates and filter by confidence threshold, tag active/non-active
-        medications = self._deduplicate_and_filter(medications, text)
-        # Filter to only keep medications with confidence >= 0.95
-        high_confidence_medications = [
-            med for med in medications
-            if med.get('confidence', 0) >= self.min_confidence_threshold
-        ]
-        return high_confidence_medications
+        if self.matcher is not None:
+            # Methods 1 and 2 in a single pass over the document
+            medications.extend(self._extract_by_automaton(text))
+            if timings is not None:
+                start = timings.lap('extract_automaton', start)
+        else:
+            # Method 1: Generic name matching (highest confidence: 0.98)
+            medications.extend(self._extract_by_generic_names(text))
+            if timings is not None:
+                start = timings.lap('extract_generic', start)
+            # Method 2: Brand name matching (high confidence: 0.96)
+            medications.extend(self._extract_by_brand_names(text))
+            if timings is not None:
+                start = timings.lap('extract_brand', start)
+        if timings is not None:
+            timings.count('candidates', len(medications))
+        # Filter by confidence threshold and remove duplicates before any classification work
+        medications = self._deduplicate_and_filter(medications)
+        if timings is not None:
+            start = timings.lap('dedup', start)
+            timings.count('mentions', len(medications))
+        if classify:
+            self.classify_medications(medications, text, text_layer, timings)
+            if timings is not None:
+                timings.lap('classify', start)
+        return medications
 
     def _extract_by_generic_names(self, text: str) -> List[Dict]:
         """Extract using generic drug names - highest confidence with improved combination drug matching"""
@@ -498,293 +1383,472 @@ class LocalMedicationLLM:
                 idx += len(brand_name)
         return medications
 
-    # def _is_non_active(self, text: str, start: int, end: int) -> bool:
-    #     """Check if medication mention is non-active (negated, discontinued, or in past history section)"""
-    #     context_start = max(0, start - 100)
-    #     context_end = min(len(text), end + 100)
-    #     context = text[context_start:context_end].lower()
-
-    #     # Section-based detection
-    #     section_context = text[max(0, start-500):start].lower()
-    #     past_section_headers = [
-    #         "past medical history", "past medications", "previous medications",
-    #         "history of present illness", "medications previously taken"
-    #     ]
-    #     for header in past_section_headers:
-    #         if header in section_context[-200:]:
-    #             return True
-
-    #     # Context-based detection
-    #     non_active_words = [
-    #         'no longer', 'stopped', 'discontinued', 'not taking', 'previously took',
-    #         'allergic', 'allergy', 'refused', 'denies', 'avoid', 'contraindicated'
-    #     ]
-    #     return any(word in context for word in non_active_words)
-
-
-    import re
-
-    def _is_non_active(self, text: str, start: int, end: int) -> bool:
+    def _lexicon_terms(self) -> List[str]:
+        """All lowercased strings the extractors search for"""
+        terms = []
+        for generic_name in self.generic_names:
+            terms.append(generic_name.lower())
+            terms.extend(v.lower() for v in self.combination_variants.get(generic_name, ()))
+        terms.extend(brand_name.lower() for brand_name in self.brand_names)
+        return terms
+
+    def _build_matcher(self) -> AhoCorasickMatcher:
+        """Compile generics, combination variants and brands into one automaton.
+
+        Patterns are added in the same order the find() loops visit them, so
+        results come back in the same order as the legacy extractors.
+        """
+        matcher = AhoCorasickMatcher()
+        for generic_name in self.generic_names:
+            matcher.add_pattern(generic_name.lower(), {'confidence': 0.98, 'match_type': 'generic_exact'})
+            for variation in self.combination_variants.get(generic_name, ()):
+                matcher.add_pattern(variation.lower(), {'confidence': 0.97, 'match_type': 'generic_combination'})
+        for brand_name, generic_name in self.brand_names.items():
+            matcher.add_pattern(brand_name.lower(), {'confidence': 0.96, 'match_type': 'brand',
+                                                     'generic_name': generic_name})
+        matcher.compile()
+        return matcher
+
+    def _extract_by_automaton(self, text: str) -> List[Dict]:
+        """Extract generic, combination and brand mentions in one linear scan"""
+        medications = []
+        patterns = self.matcher.patterns
+        for pattern_id, idx in self.matcher.find_all(text.lower()):
+            pattern, payload = patterns[pattern_id]
+            end = idx + len(pattern)
+            med = {
+                'text': text[idx:end],
+                'start_offset': idx,
+                'end_offset': end,
+                'confidence': payload['confidence'],
+                'match_type': payload['match_type']
+            }
+            if 'generic_name' in payload:
+                med['generic_name'] = payload['generic_name']
+            medications.append(med)
+        return medications
+
+    # Substring cues checked around each mention
+    DISCONTINUATION_HEADERS = (
+        "medications discontinued during this encounter",
+        "discontinued medications", "stopped medications"
+    )
+    TABLE_INDICATORS = (
+        '<table', '</table>', '<tr>', '</tr>', '<td>', '</td>',
+        'medications:', 'current medications', 'medication list',
+        'sig (take, route, frequency, duration)', 'status', 'active'
+    )
+    TABLE_STOP_WORDS = ('not-taking', 'discontinued', 'completed', 'stopped')
+    MAINTAIN_CUE = ('maintain',)
+    # Furthest any classifier window extends beyond a mention
+    CONTEXT_REACH = 500
+    INCREASE_KEYWORDS = ('increase', 'start', 'begin', 'new', 'change to', 'adjust to')
+    STOP_KEYWORDS = ('stop', 'discontinue', 'old', 'previous')
+    PAST_SECTION_HEADERS = (
+        "past medical history", "past medications", "previous medications",
+        "history of present illness", "medications previously taken",
+        "previous drug history", "prior medications", "past drug therapy"
+    )
+    # <h2>/<h3> titles that mark every mention in the section as past/discontinued.
+    # HPI narrates current therapy too, so it only counts as a nearby header.
+    SECTION_HEADER_KINDS = dict(
+        [(header, 'discontinued') for header in DISCONTINUATION_HEADERS] +
+        [(header, 'past') for header in PAST_SECTION_HEADERS if header != "history of present illness"]
+    )
+    NON_ACTIVE_WORDS = (
+        'was changed to', 'was switched to', 'changed from', 'switched from',
+        'replaced with', 'substituted with', 'transitioned to',
+        'no improvement with', 'no response to', 'not working',
+        'failed', 'ineffective', 'no benefit from', 'poor response',
+        'minimal improvement', 'not helping','no longer', 'stopped','completed', 'discontinued', 'not taking', 'previously took',
+        'allergic', 'allergy', 'refused', 'denies', 'avoid', 'contraindicated',
+        'was on', 'had been taking', 'used to take', 'wants to remain off',
+        'came off', 'weaned off', 'tapered off', 'tried', 'failed', 'ineffective',
+        'switched from', 'changed from', 'intolerant', 'adverse reaction',
+        'briefly took', 'short trial', 'historically', 'in the past',
+        'prior to', 'before', 'formerly', 'attempted', 'could not tolerate', 'no need', 'DC','dc', 'previously'
+    )
+    # Names for instrumentation of has_cue lookups
+    CUE_GROUP_NAMES = {
+        DISCONTINUATION_HEADERS: 'discontinuation_headers', TABLE_INDICATORS: 'table_indicators',
+        TABLE_STOP_WORDS: 'table_stop_words', MAINTAIN_CUE: 'maintain', INCREASE_KEYWORDS: 'increase_keywords',
+        STOP_KEYWORDS: 'stop_keywords', PAST_SECTION_HEADERS: 'past_section_headers', NON_ACTIVE_WORDS: 'non_active_words'
+    }
+
+    def _rule_bank(self, med_text: str) -> NonActiveRuleBank:
+        """Rules for a mention: this extractor's compiled bank for the term, or fresh patterns in legacy mode"""
+        if not self.use_rule_bank:
+            return NonActiveRuleBank(med_text, compiled=False)
+        bank = self._rule_banks.get(med_text)
+        if bank is None:
+            bank = self._rule_banks[med_text] = NonActiveRuleBank(med_text)
+        return bank
+
+    def _document_view(self, text: str, mention_spans: List[tuple],
+                       text_layer: Optional[HTMLTextLayer] = None) -> DocumentWindowView:
+        """Per-document view used to classify every mention in the text"""
+        sections = None
+        if self.use_sections:
+            sections = DocumentSectionMap(text, self.SECTION_HEADER_KINDS, text_layer,
+                                          {'discontinued': self.DISCONTINUATION_HEADERS,
+                                           'past': self.PAST_SECTION_HEADERS})
+        if self.use_cue_index:
+            index = DocumentCueIndex.build(text, mention_spans, self.CONTEXT_REACH, sections)
+            if index is not None:
+                return index
+        return DocumentWindowView(text, sections)
+
+    def _is_non_active(self, text: str, start: int, end: int, doc: Optional[DocumentWindowView] = None) -> bool:
         """Check if medication mention is non-active (comprehensive pattern detection)"""
-        context_start = max(0, start - 150)
-        context_end = min(len(text), end + 150)
-        context = text[context_start:context_end].lower()
+        if doc is None:
+            doc = DocumentWindowView(text)
+        context = (max(0, start - 150), min(len(text), end + 150))
         
         # Get medication name for specific checks
-        med_text = text[start:end].lower()
-
-        # Treatment failure patterns that should be non-active
-        treatment_failure_patterns = [
-            r'no\s+improvement\s+with\s+\w*\s*' + re.escape(med_text),
-            r'no\s+response\s+to\s+\w*\s*' + re.escape(med_text),
-            r'ineffective\s+\w*\s*' + re.escape(med_text),
-            r'not\s+working\s+\w*\s*' + re.escape(med_text),
-            r'failed\s+\w*\s*' + re.escape(med_text),
-            r'no\s+benefit\s+(from|with)\s+\w*\s*' + re.escape(med_text),
-            r'minimal\s+improvement\s+with\s+\w*\s*' + re.escape(med_text),
-            r'poor\s+response\s+to\s+\w*\s*' + re.escape(med_text),
-        ]
+        med_text = doc.lowered_slice(start, end)
+        rules = self._rule_bank(med_text)
 
         # Check for treatment failure patterns
-        for pattern in treatment_failure_patterns:
-            if re.search(pattern, context, re.IGNORECASE):
-                return True  # Mark as non-active
-
-        strong_active_patterns = [
-            r'maintain\s+(his|her|their|the)?\s*\w*\s*' + re.escape(med_text),
-            r'continue\s+(his|her|their|the)?\s*\w*\s*' + re.escape(med_text),
-            r'continuing\s+(his|her|their|the)?\s*\w*\s*' + re.escape(med_text),
-            r'keep\s+(him|her|them|patient)?\s*on\s*\w*\s*' + re.escape(med_text),
-            r'remain\s+on\s+\w*\s*' + re.escape(med_text),
-            r'stay\s+on\s+\w*\s*' + re.escape(med_text),
-        ]
-        
+        if doc.rule_matches(rules, 'treatment_failure', *context):
+            return True  # Mark as non-active
+
         # If we find strong active language, override section-based logic
-        for pattern in strong_active_patterns:
-            if re.search(pattern, context, re.IGNORECASE):
-                return False  # Force ACTIVE status
+        if doc.rule_matches(rules, 'strong_active', *context):
+            return False  # Force ACTIVE status
         
         # PRIORITY 2: Check for broader context of maintaining medications
         # Look for "maintain" in a wider context around this medication
-        wider_context_start = max(0, start - 500)
-        wider_context_end = min(len(text), end + 500)
-        wider_context = text[wider_context_start:wider_context_end].lower()
-        
-        maintain_context_patterns = [
-            r'maintain.*?' + re.escape(med_text),
-            r'having.*?maintain.*?' + re.escape(med_text),
-            r'continue.*?' + re.escape(med_text),
-        ]
+        wider_context = (max(0, start - 500), min(len(text), end + 500))
         
-        for pattern in maintain_context_patterns:
-            if re.search(pattern, wider_context, re.IGNORECASE):
-                return False  # Force ACTIVE status
+        if doc.rule_matches(rules, 'maintain_context', *wider_context):
+            return False  # Force ACTIVE status
         
         # PRIORITY 3: Your existing section and pattern detection
-        # Section-based detection
-        section_context = text[max(0, start-500):start].lower()
-        
         # Only mark as non-active if in discontinuation section AND no maintain language
-        discontinuation_headers = [
-            "medications discontinued during this encounter",
-            "discontinued medications", "stopped medications"
-        ]
-        
-        for header in discontinuation_headers:
-            if header in section_context[-300:]:
-                # But check if there's maintain language in broader context
-                if 'maintain' not in wider_context:
-                    return True  # Only if no maintain language found
-        
+        section_kind = doc.section_kind(start) if self.classify_by_section else None
+        if (section_kind == 'discontinued' or
+                doc.header_before('discontinued', self.DISCONTINUATION_HEADERS, start, 300)):
+            # But check if there's maintain language in broader context
+            if not doc.has_cue(self.MAINTAIN_CUE, *wider_context):
+                return True  # Only if no maintain language found
 
         # NEW: Check if we're in a medications table/list (should be active)
-        table_indicators = [
-            '<table', '</table>', '<tr>', '</tr>', '<td>', '</td>',
-            'medications:', 'current medications', 'medication list',
-            'sig (take, route, frequency, duration)', 'status', 'active'
-        ]
-        
-        if any(indicator in context for indicator in table_indicators):
+        if doc.has_cue(self.TABLE_INDICATORS, *context):
             # We're likely in a current medications table
             # Check if explicitly marked as non-active in table
-            if any(word in context for word in ['not-taking', 'discontinued', 'completed','stopped']):
+            if doc.has_cue(self.TABLE_STOP_WORDS, *context):
                 return True
             else:
                 return False  # Assume active if in medications table
         
-
-        current_medication_patterns = [
-            r'(current|currently|taking|on)\s+\w*\s*' + re.escape(med_text),
-            r'continue\s+' + re.escape(med_text),
-            r'refill\s+' + re.escape(med_text),
-            r'maintain\s+' + re.escape(med_text),
-            r'high\s+dose.*?' + re.escape(med_text),  # "on High dose still with symptoms"
-            r'still\s+(on|taking|with).*?' + re.escape(med_text),
-        ]
-        
         # If it shows current use despite "started on" language, keep it active
-        for pattern in current_medication_patterns:
-            if re.search(pattern, context, re.IGNORECASE):
-                return False  # Keep as ACTIVE
-            
+        if doc.rule_matches(rules, 'current_medication', *context):
+            return False  # Keep as ACTIVE
 
-        dose_adjustment_context = text[max(0, start - 300):min(len(text), end + 300)].lower()
-    
-        dose_change_patterns = [
-            r'(increase|decrease|adjust|titrate|change\s+dose|modify\s+dose|raise|lower)\s+\w*\s*' + re.escape(med_text),
-            r'increase\s+' + re.escape(med_text),
-            r'decrease\s+' + re.escape(med_text),
-            r'adjust\s+' + re.escape(med_text),
-            r'titrate\s+' + re.escape(med_text),
-            r'escalate\s+' + re.escape(med_text),
-            r'reduce\s+' + re.escape(med_text),
-            r'continue\s+' + re.escape(med_text),
-            r'refill\s+' + re.escape(med_text),
-            r'maintain\s+' + re.escape(med_text),
-        ]
-        
         # If it's a dose adjustment, keep it active (return False)
-        for pattern in dose_change_patterns:
-            if re.search(pattern, dose_adjustment_context, re.IGNORECASE):
-                # Check if this mention comes after "increase/start" keywords
-                text_before_med = text[max(0, start-100):start].lower()
-                text_after_med = text[end:min(len(text), end+100)].lower()
-                
-                # If "increase", "start", "begin", "new" appears before this mention
-                increase_keywords = ['increase', 'start', 'begin', 'new', 'change to', 'adjust to']
-                if any(keyword in text_before_med[-50:] for keyword in increase_keywords):
-                    return False  # This is the NEW active dose
-                
-                # If "stop", "discontinue" appears before this mention
-                stop_keywords = ['stop', 'discontinue', 'old', 'previous']
-                if any(keyword in text_before_med[-50:] for keyword in stop_keywords):
-                    return True 
+        if doc.rule_matches(rules, 'dose_change', max(0, start - 300), min(len(text), end + 300)):
+            # If "increase", "start", "begin", "new" appears in the 50 chars before this mention
+            if doc.has_cue(self.INCREASE_KEYWORDS, max(0, start - 50), start):
+                return False  # This is the NEW active dose
+            
+            # If "stop", "discontinue" appears before this mention
+            if doc.has_cue(self.STOP_KEYWORDS, max(0, start - 50), start):
+                return True 
         
         # Section-based detection
-        section_context = text[max(0, start-500):start].lower()
-        past_section_headers = [
-            "past medical history", "past medications", "previous medications",
-            "history of present illness", "medications previously taken",
-            "previous drug history", "prior medications", "past drug therapy"
-        ]
-        for header in past_section_headers:
-            if header in section_context[-200:]:
-                return True
+        if section_kind == 'past' or doc.header_before('past', self.PAST_SECTION_HEADERS, start, 200):
+            return True
         
         # Enhanced pattern detection with regex
-        non_active_patterns = [
-            # Past tense patterns - ADD THESE
-            r'took\s+\w*\s*' + re.escape(med_text),  # "took apixaban"
-            r'was\s+taking\s+\w*\s*' + re.escape(med_text),  # "was taking apixaban"
-            r'had\s+taken\s+\w*\s*' + re.escape(med_text),  # "had taken apixaban"
-            r'has\s+taken\s+\w*\s*' + re.escape(med_text),  # "has taken apixaban"
-            
-            # Duration patterns indicating past use - ADD THESE
-            r'took\s+\w*\s*' + re.escape(med_text) + r'\s+for\s+\d+',  # "took med for 3 months"
-            r'was\s+on\s+\w*\s*' + re.escape(med_text) + r'\s+for\s+\d+',  # "was on med for 3 months"
-            r'taking\s+\w*\s*' + re.escape(med_text) + r'\s+for\s+\d+\s+(months?|weeks?|days?)',  # past duration
-            r'had\s+been\s+\w*\s*' + re.escape(med_text) + r'\s+for\s+\d+\s+(months?|weeks?|days?)',  # past duration
-            # Past tense patterns
-            r'(was|were)\s+(on|taking|prescribed)\s+\w*\s*' + re.escape(med_text),
-            r'had\s+(been\s+)?(taking|on|prescribed)\s+\w*\s*' + re.escape(med_text),
-            r'used\s+to\s+(take|be\s+on)\s+\w*\s*' + re.escape(med_text),
-            r'previously\s+(took|taking|on|prescribed)\s+\w*\s*' + re.escape(med_text),
-            r'formerly\s+(took|taking|on)\s+\w*\s*' + re.escape(med_text),
-            
-            # Discontinuation patterns
-            r'(discontinued|stopped|ceased|quit|ended)\s+\w*\s*' + re.escape(med_text),
-            r'no\s+longer\s+(taking|on)\s+\w*\s*' + re.escape(med_text),
-            r'came\s+off\s+(of\s+)?\w*\s*' + re.escape(med_text),
-            r'weaned\s+off\s+(of\s+)?\w*\s*' + re.escape(med_text),
-            r'tapered\s+off\s+(of\s+)?\w*\s*' + re.escape(med_text),
-            
-            # Refusal/avoidance patterns
-            r'(refusing|refused|denies|declines)\s+\w*\s*' + re.escape(med_text),
-            r'wants?\s+to\s+(remain\s+)?off\s+(of\s+)?\w*\s*' + re.escape(med_text),
-            r'(avoid|avoiding|stayed\s+away\s+from)\s+\w*\s*' + re.escape(med_text),
-            r'not\s+(currently\s+)?(taking|on)\s+\w*\s*' + re.escape(med_text),
-            r'off\s+(of\s+)?\w*\s*' + re.escape(med_text),
-            
-            # Allergy/contraindication patterns
-            r'(allergic|allergy)\s+to\s+\w*\s*' + re.escape(med_text),
-            r'contraindicated\s+\w*\s*' + re.escape(med_text),
-            r'intolerant\s+to\s+\w*\s*' + re.escape(med_text),
-            r'adverse\s+reaction\s+to\s+\w*\s*' + re.escape(med_text),
-            
-            # Temporal indicators of past use
-            r'in\s+the\s+past\s+\w*\s*' + re.escape(med_text),
-            r'historically\s+\w*\s*' + re.escape(med_text),
-            r'prior\s+to\s+\w*\s*' + re.escape(med_text),
-            r'before\s+\w*\s*' + re.escape(med_text),
-            
-            # Trial/temporary use patterns
-            r'tried\s+\w*\s*' + re.escape(med_text),
-            r'attempted\s+\w*\s*' + re.escape(med_text),
-            r'briefly\s+(took|on)\s+\w*\s*' + re.escape(med_text),
-            r'short\s+trial\s+of\s+\w*\s*' + re.escape(med_text),
-            
-            # Failed therapy patterns
-            r'failed\s+\w*\s*' + re.escape(med_text),
-            r'ineffective\s+\w*\s*' + re.escape(med_text),
-            r'did\s+not\s+tolerate\s+\w*\s*' + re.escape(med_text),
-            r'could\s+not\s+tolerate\s+\w*\s*' + re.escape(med_text),
-            
-            # Switching medications patterns
-            r'(his|her|their|the)?\s*' + re.escape(med_text) + r'\s+was\s+(changed|switched)\s+to',
-            r'change\s+(from\s+)?' + re.escape(med_text) + r'\s+to',
-            r'switch\s+(from\s+)?' + re.escape(med_text) + r'\s+to',
-            r'replaced\s+' + re.escape(med_text) + r'\s+with',
-            r'substitute\s+' + re.escape(med_text) + r'\s+with',
-            r'transition\s+(from\s+)?' + re.escape(med_text) + r'\s+to',
-
-            
-            # Including/listing patterns (often non-active)
-            r'including\s+\w*\s*' + re.escape(med_text),
-            r'such\s+as\s+\w*\s*' + re.escape(med_text),
-            r'like\s+\w*\s*' + re.escape(med_text),
-        ]
-        
-        # Check for any matching pattern
-        for pattern in non_active_patterns:
-            if re.search(pattern, context, re.IGNORECASE):
-                return True
+        if doc.rule_matches(rules, 'non_active', *context):
+            return True
         
         # Simple word-based detection (fallback)
-        non_active_words = [
-            'was changed to', 'was switched to', 'changed from', 'switched from',
-            'replaced with', 'substituted with', 'transitioned to',
-            'no improvement with', 'no response to', 'not working',
-            'failed', 'ineffective', 'no benefit from', 'poor response',
-            'minimal improvement', 'not helping','no longer', 'stopped','completed', 'discontinued', 'not taking', 'previously took',
-            'allergic', 'allergy', 'refused', 'denies', 'avoid', 'contraindicated',
-            'was on', 'had been taking', 'used to take', 'wants to remain off',
-            'came off', 'weaned off', 'tapered off', 'tried', 'failed', 'ineffective',
-            'switched from', 'changed from', 'intolerant', 'adverse reaction',
-            'briefly took', 'short trial', 'historically', 'in the past',
-            'prior to', 'before', 'formerly', 'attempted', 'could not tolerate', 'no need', 'DC','dc', 'previously'
-        ]
-        
-        return any(word in context for word in non_active_words)
+        return doc.has_cue(self.NON_ACTIVE_WORDS, *context)
 
-    def _deduplicate_and_filter(self, medications: List[Dict], text: str) -> List[Dict]:
-        """Remove duplicates (by offset) and tag as active/non-active"""
+    def _deduplicate_and_filter(self, medications: List[Dict]) -> List[Dict]:
+        """Keep mentions with confidence >= 0.95, then remove duplicates (by offset, or overlapping spans)"""
+        medications = [med for med in medications if med.get('confidence', 0) >= self.min_confidence_threshold]
+        if self.resolve_overlaps:
+            return self._resolve_overlaps(medications)
         seen = set()
         filtered = []
         for med in medications:
             key = (med['text'].lower(), med['start_offset'], med['end_offset'])
             if key not in seen and len(med['text']) > 2:
                 seen.add(key)
-                med['active_status'] = 'non-active' if self._is_non_active(text, med['start_offset'], med['end_offset']) else 'active'
                 filtered.append(med)
         return filtered
 
+    def classify_medications(self, medications: List[Dict], text: str, text_layer: Optional[HTMLTextLayer] = None,
+                             timings: Optional[StageTimings] = None) -> List[Dict]:
+        """Tag mentions of text as active/non-active (and with their section), in place"""
+        if not medications:
+            return medications
+        doc = self._document_view(text, [(med['start_offset'], med['end_offset']) for med in medications], text_layer)
+        if timings is not None:
+            doc = InstrumentedWindowView(doc, timings, self.CUE_GROUP_NAMES)
+        memo = {} if self.memoize_classification else None
+        for med in medications:
+            if doc.sections is not None:
+                section = doc.sections.section_at(med['start_offset'])
+                med['section'] = section.title if section is not None else None
+            if memo is not None:
+                non_active = self._is_non_active_memoized(text, med['start_offset'], med['end_offset'], doc, memo)
+            else:
+                non_active = self._is_non_active(text, med['start_offset'], med['end_offset'], doc)
+            med['active_status'] = 'non-active' if non_active else 'active'
+        if memo is not None:
+            hits = len(medications) - len(memo)
+            with self._memo_stats_lock:
+                self.classification_memo_stats['lookups'] += len(medications)
+                self.classification_memo_stats['hits'] += hits
+            if timings is not None:
+                timings.count('classify_memo_hits', hits)
+        return medications
+
+    def _is_non_active_memoized(self, text: str, start: int, end: int, doc: DocumentWindowView, memo: Dict) -> bool:
+        """_is_non_active, reusing the decision for a repeat of the same context in this document.
+
+        Every check reads the lowered text within CONTEXT_REACH of the mention
+        plus the section kind, so those (with the mention's position in the
+        window) decide the result. Repeated medication tables hit the memo.
+        """
+        window_start, window_end = max(0, start - self.CONTEXT_REACH), min(len(text), end + self.CONTEXT_REACH)
+        key = (doc.lowered_slice(window_start, window_end), start - window_start, end - window_start,
+               doc.section_kind(start))
+        non_active = memo.get(key)
+        if non_active is None:
+            non_active = memo[key] = self._is_non_active(text, start, end, doc)
+        return non_active
+
+    @staticmethod
+    def _resolve_overlaps(medications: List[Dict]) -> List[Dict]:
+        """Keep the longest, then highest-confidence, then earliest mention of each overlapping region.
+
+        Candidates are visited once in that priority order; a candidate is kept
+        if it overlaps no span kept so far, i.e. if no kept span that starts
+        before its end reaches past its start. A Fenwick tree over the distinct
+        start offsets holds the furthest end kept per start prefix, so each
+        check and each insert is O(log m) and the pass is O(m log m).
+        Survivors keep their original order.
+        """
+        order = sorted(
+            (i for i, med in enumerate(medications) if len(med['text']) > 2),
+            key=lambda i: (medications[i]['start_offset'] - medications[i]['end_offset'],
+                           -medications[i].get('confidence', 0), medications[i]['start_offset'], i))
+        starts = sorted({medications[i]['start_offset'] for i in order})
+        furthest_end = [-1] * (len(starts) + 1)  # Fenwick tree of max end, indexed by start rank
+        kept = []
+        for i in order:
+            start, end = medications[i]['start_offset'], medications[i]['end_offset']
+            reach = -1
+            node = bisect_left(starts, end)  # kept spans starting before `end`
+            while node:
+                reach = max(reach, furthest_end[node])
+                node -= node & -node
+            if reach > start:
+                continue
+            node = bisect_left(starts, start) + 1
+            while node <= len(starts):
+                if furthest_end[node] < end:
+                    furthest_end[node] = end
+                node += node & -node
+            kept.append(i)
+        kept.sort()
+        return [medications[i] for i in kept]
+
+
+class CompactLexicon(Mapping):
+    """Read-only, rxnorm_db-compatible lexicon stored as columns, for RRF-scale data.
+
+    Concepts are integer ids into parallel arrays: RXCUI and term type, plus
+    CSR-style brand links (brand_offsets[i]:brand_offsets[i + 1] slices
+    brand_ids, which index the interned brand_strings). lexicon[name] builds
+    the same {'rx_cui', 'brand_names', 'cui_type'} dict the CSV loader
+    stores, so existing lookups keep working.
+    """
+
+    MAGIC = b'RXLEX\n'
+    FORMAT_VERSION = 1
+    DEFAULT_TTYS = ('IN', 'MIN', 'PIN', 'BN')
+    TRADENAME_RELAS = ('has_tradename', 'tradename_of')
+
+    def __init__(self, names: List[str], rx_cuis: array, ttys: array, tty_names: List[str],
+                 brand_offsets: array, brand_ids: array, brand_strings: List[str]):
+        self.names = names
+        self.rx_cuis = rx_cuis
+        self.ttys = ttys
+        self.tty_names = tty_names
+        self.brand_offsets = brand_offsets
+        self.brand_ids = brand_ids
+        self.brand_strings = brand_strings
+        self._index = {name: i for i, name in enumerate(names)}
+
+    def __getitem__(self, name: str) -> Dict:
+        i = self._index[name]
+        return {
+            'rx_cui': str(self.rx_cuis[i]),
+            'brand_names': [self.brand_strings[b]
+                            for b in self.brand_ids[self.brand_offsets[i]:self.brand_offsets[i + 1]]],
+            'cui_type': self.tty_names[self.ttys[i]]
+        }
+
+    def __contains__(self, name) -> bool:
+        return name in self._index
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @classmethod
+    def from_rrf(cls, rrf_dir: str, ttys: tuple = DEFAULT_TTYS) -> 'CompactLexicon':
+        """Build from RXNCONSO.RRF (and RXNREL.RRF for brand links) in rrf_dir.
+
+        Keeps current English RXNORM atoms of the given term types. BN atoms
+        become brand names linked to ingredients through has_tradename /
+        tradename_of relations; the other types become lexicon entries keyed
+        by their lowercased string (first atom wins).
+        """
+        wanted = set(ttys)
+        tty_names = [tty for tty in ttys if tty != 'BN']
+        tty_codes = {tty: code for code, tty in enumerate(tty_names)}
+        names, rx_cuis, tty_column = [], array('l'), array('B')
+        concept_ids = {}     # RXCUI -> concept ids of its entries
+        brands_by_cui = {}   # BN RXCUI -> interned brand string
+        seen = set()
+        with open(os.path.join(rrf_dir, 'RXNCONSO.RRF'), 'r', encoding='utf-8') as f:
+            for line in f:
+                fields = line.split('|')
+                # RXCUI|LAT|TS|LUI|STT|SUI|ISPREF|RXAUI|SAUI|SCUI|SDUI|SAB|TTY|CODE|STR|SRL|SUPPRESS|CVF|
+                tty = fields[12]
+                if tty not in wanted or fields[11] != 'RXNORM' or fields[1] != 'ENG' or fields[16] not in ('N', ''):
+                    continue
+                rx_cui = int(fields[0])
+                name = sys.intern(fields[14].strip().lower())
+                if tty == 'BN':
+                    brands_by_cui.setdefault(rx_cui, name)
+                    continue
+                if name in seen:
+                    continue
+                seen.add(name)
+                concept_ids.setdefault(rx_cui, []).append(len(names))
+                names.append(name)
+                rx_cuis.append(rx_cui)
+                tty_column.append(tty_codes[tty])
+        links = {}  # concept id -> brand strings, in relation order
+        rel_path = os.path.join(rrf_dir, 'RXNREL.RRF')
+        if brands_by_cui and os.path.exists(rel_path):
+            with open(rel_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    fields = line.split('|')
+                    # RXCUI1|RXAUI1|STYPE1|REL|RXCUI2|RXAUI2|STYPE2|RELA|RUI|SRUI|SAB|SL|DIR|RG|SUPPRESS|CVF|
+                    if fields[7] not in cls.TRADENAME_RELAS or fields[10] != 'RXNORM':
+                        continue
+                    cui1, cui2 = int(fields[0]), int(fields[4])
+                    # Direction varies between releases; the BN side is the brand
+                    if cui1 in brands_by_cui and cui2 in concept_ids:
+                        brand, concepts = brands_by_cui[cui1], concept_ids[cui2]
+                    elif cui2 in brands_by_cui and cui1 in concept_ids:
+                        brand, concepts = brands_by_cui[cui2], concept_ids[cui1]
+                    else:
+                        continue
+                    for concept_id in concepts:
+                        concept_brands = links.setdefault(concept_id, [])
+                        if brand not in concept_brands:
+                            concept_brands.append(brand)
+        brand_strings, brand_string_ids = [], {}
+        brand_offsets, brand_ids = array('l', [0]), array('l')
+        for concept_id in range(len(names)):
+            for brand in links.get(concept_id, ()):
+                if brand not in brand_string_ids:
+                    brand_string_ids[brand] = len(brand_strings)
+                    brand_strings.append(brand)
+                brand_ids.append(brand_string_ids[brand])
+            brand_offsets.append(len(brand_ids))
+        return cls(names, rx_cuis, tty_column, tty_names, brand_offsets, brand_ids, brand_strings)
+
+    @classmethod
+    def is_compact(cls, path: str) -> bool:
+        try:
+            with open(path, 'rb') as f:
+                return f.read(len(cls.MAGIC)) == cls.MAGIC
+        except OSError:
+            return False
+
+    def save(self, path: str):
+        header = {'format': self.FORMAT_VERSION, 'entries': len(self.names),
+                  'brands': len(self.brand_strings), 'created': datetime.now().isoformat()}
+        payload = (self.names, self.rx_cuis, self.ttys, self.tty_names,
+                   self.brand_offsets, self.brand_ids, self.brand_strings)
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(self.MAGIC)
+            f.write(json.dumps(header).encode('utf-8') + b'\n')
+            pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'CompactLexicon':
+        with open(path, 'rb') as f:
+            if f.read(len(cls.MAGIC)) != cls.MAGIC:
+                raise ValueError(f"{path} is not a compact RxNorm lexicon")
+            header = json.loads(f.readline())
+            if header.get('format') != cls.FORMAT_VERSION:
+                raise ValueError(f"{path} has format {header.get('format')}; re-run `python main.py ingest-rrf`")
+            names, rx_cuis, ttys, tty_names, brand_offsets, brand_ids, brand_strings = pickle.load(f)
+        return cls([sys.intern(name) for name in names], rx_cuis, ttys, tty_names,
+                   brand_offsets, brand_ids, brand_strings)
+
+
+def ingest_rrf_main(argv: List[str]):
+    """`python main.py ingest-rrf`: build a compact lexicon from RxNorm RRF files"""
+    parser = argparse.ArgumentParser(prog='main.py ingest-rrf',
+                                     description='Ingest RXNCONSO.RRF / RXNREL.RRF into a compact lexicon file')
+    parser.add_argument('--rrf-dir', required=True, help='Folder containing RXNCONSO.RRF and RXNREL.RRF')
+    parser.add_argument('--output', '-o', default='rxnorm.rxlex', help='Compact lexicon path')
+    parser.add_argument('--ttys', default=','.join(CompactLexicon.DEFAULT_TTYS),
+                        help='Comma-separated term types to keep (BN supplies brand names)')
+    args = parser.parse_args(argv)
+    start_time = time.perf_counter()
+    lexicon = CompactLexicon.from_rrf(args.rrf_dir, tuple(tty.strip() for tty in args.ttys.split(',') if tty.strip()))
+    lexicon.save(args.output)
+    print(f"✅ Ingested {len(lexicon)} concepts and {len(lexicon.brand_strings)} brand names "
+          f"into {args.output} in {time.perf_counter() - start_time:.1f}s")
+
 
 class RxNormMapper:
     """Map medication names to RxNorm CUI codes"""
 
     def __init__(self, csv_path: str):
-        self.rxnorm_db = self._load_rxnorm_csv(csv_path)
+        # csv_path may also be a lexicon artifact written by `main.py compile-lexicon`
+        self.artifact = None
+        if LexiconArtifact.is_artifact(csv_path):
+            self.artifact = LexiconArtifact.load(csv_path)
+        elif MappedLexiconFile.is_mapped(csv_path):
+            self.artifact = MappedLexiconFile(csv_path).as_artifact()
+        if self.artifact is not None:
+            self.rxnorm_db = self.artifact['rxnorm_db']
+            self.brand_to_generic = self.artifact['brand_to_generic']
+            self.entry_hashes = self.artifact['entry_hashes']
+            self.lexicon_version = self.artifact['lexicon_version']
+            self.combination_variants, self.combination_keys = self.artifact['combination_index']
+            return
+        if CompactLexicon.is_compact(csv_path):
+            self.rxnorm_db = CompactLexicon.load(csv_path)
+        else:
+            self.rxnorm_db = self._load_rxnorm_csv(csv_path)
         self.brand_to_generic = self._create_brand_mapping()
+        self._build_combination_index()
+        self.entry_hashes = {
+            generic: hashlib.sha256(json.dumps([generic, info], sort_keys=True).encode('utf-8')).hexdigest()[:16]
+            for generic, info in self.rxnorm_db.items()
+        }
+        # Order matters for combination lookups, so it is part of the version
+        self.lexicon_version = hashlib.sha256(
+            json.dumps(list(self.entry_hashes.items())).encode('utf-8')).hexdigest()[:16]
 
     # def _load_rxnorm_csv(self, csv_path: str) -> Dict[str, Dict]:
     #     """Load RxNorm data from CSV"""
@@ -835,6 +1899,36 @@ class RxNormMapper:
                 brand_mapping[brand] = generic
         return brand_mapping
 
+    # Separators between ingredients in a combination name: "a / b", "a + b", "a - b". A hyphen
+    # only counts with spaces around it, so hyphenated single ingredients stay whole
+    INGREDIENT_SEPARATOR_RE = re.compile(r'\s*[/+]\s*|\s+-\s+')
+
+    @classmethod
+    def ingredient_key(cls, name: str) -> Optional[str]:
+        """Order- and separator-independent key for a combination name (None for one ingredient)"""
+        parts = [' '.join(part.split()) for part in cls.INGREDIENT_SEPARATOR_RE.split(name.lower())]
+        parts = [part for part in parts if part]
+        if len(parts) < 2:
+            return None
+        return '/'.join(sorted(parts))
+
+    def _build_combination_index(self):
+        """Precompute variant -> canonical and ingredient key -> canonical for combination lookups.
+
+        Entries are visited in rxnorm_db order and the first canonical form
+        claims a key, matching the precedence of the old linear scan.
+        """
+        self.combination_variants = {}
+        self.combination_keys = {}
+        for canonical_generic in self.rxnorm_db:
+            if '/' not in canonical_generic:
+                continue
+            for variation in self._create_combination_variations_for_lookup(canonical_generic):
+                self.combination_variants.setdefault(variation.lower(), canonical_generic)
+            key = self.ingredient_key(canonical_generic)
+            if key is not None:
+                self.combination_keys.setdefault(key, canonical_generic)
+
     def map_to_cui(self, medications: List[Dict]) -> List[Dict]:
         """Map medication mentions to RxNorm CUI codes - maintains confidence filtering"""
         mapped_medications = []
@@ -845,6 +1939,8 @@ class RxNormMapper:
             mapped['active_status'] = med.get('active_status', 'unknown')
             mapped['start_offset'] = med.get('start_offset')
             mapped['end_offset'] = med.get('end_offset')
+            if 'section' in med:
+                mapped['section'] = med['section']
             mapped_medications.append(mapped)
         return mapped_medications
 
@@ -897,24 +1993,26 @@ class RxNormMapper:
         # Check if this looks like a combination drug
         if not any(sep in med_text for sep in ['/', '-', '+']):
             return None
-            
-        # For each known combination drug in our database, check if med_text is a variation
-        for canonical_generic, info in self.rxnorm_db.items():
-            if '/' in canonical_generic or ' / ' in canonical_generic:
-                # Generate all variations for this canonical form
-                variations = self._create_combination_variations_for_lookup(canonical_generic)
-                
-                if med_text in [var.lower() for var in variations]:
-                    return {
-                        'rx_cui': info['rx_cui'],
-                        'normalized_name': canonical_generic,
-                        'cui_type': info.get('cui_type'),
-                        'mapping_method': 'combination_variation',
-                        'mapping_confidence': 0.95,
-                        'flag': None
-                    }
-        
-        return None
+
+        # Known spelling of a combination in the database
+        canonical_generic = self.combination_variants.get(med_text)
+        method = 'combination_variation'
+        if canonical_generic is None:
+            # Same ingredient set in another order or with other separators
+            canonical_generic = self.combination_keys.get(self.ingredient_key(med_text))
+            method = 'combination_ingredients'
+        if canonical_generic is None:
+            return None
+
+        info = self.rxnorm_db[canonical_generic]
+        return {
+            'rx_cui': info['rx_cui'],
+            'normalized_name': canonical_generic,
+            'cui_type': info.get('cui_type'),
+            'mapping_method': method,
+            'mapping_confidence': 0.95,
+            'flag': None
+        }
     
     def _create_combination_variations_for_lookup(self, canonical_name: str) -> List[str]:
         """Create variations for combination drug lookup (similar to extraction but for mapping)"""
@@ -946,69 +2044,1178 @@ class RxNormMapper:
         return variations
 
 
+class LexiconArtifact:
+    """Versioned binary snapshot of a compiled lexicon, written by `main.py compile-lexicon`.
+
+    Layout: MAGIC, one JSON header line (format, engine and lexicon versions,
+    source CSV hash), then a pickle of the normalized lexicon, the brand and
+    combination variant tables and the compiled Aho-Corasick tables, all as
+    built-in containers. Loading is a single unpickle; nothing is parsed or
+    rebuilt. Regex rule banks are not stored (compiled patterns do not
+    serialize) and compile on first use. See MappedLexiconFile for the
+    memory-mapped variant.
+
+    Unpickling runs whatever the file says, so only load artifacts you built
+    yourself (or got from a source you trust), never user uploads.
+    """
+
+    MAGIC = b'MEDLEX\n'
+    FORMAT_VERSION = 2
+
+    @staticmethod
+    def default_path(csv_path: str) -> str:
+        return os.path.splitext(csv_path)[0] + '.lexicon'
+
+    @classmethod
+    def is_artifact(cls, path: str) -> bool:
+        try:
+            with open(path, 'rb') as f:
+                return f.read(len(cls.MAGIC)) == cls.MAGIC
+        except OSError:
+            return False
+
+    @staticmethod
+    def _file_hash(path: str) -> Optional[str]:
+        try:
+            with open(path, 'rb') as f:
+                return hashlib.sha256(f.read()).hexdigest()
+        except OSError:
+            return None
+
+    @classmethod
+    def compile(cls, csv_path: str, artifact_path: str) -> Dict:
+        """Build the lexicon from csv_path and write it to artifact_path; returns the header"""
+        mapper = RxNormMapper(csv_path)
+        extractor = LocalMedicationLLM(mapper.rxnorm_db, use_rule_bank=False)
+        payload = {
+            # Plain dicts only, so the pickle does not depend on where main.py was imported from
+            'rxnorm_db': dict(mapper.rxnorm_db.items()),
+            'brand_to_generic': mapper.brand_to_generic,
+            'entry_hashes': mapper.entry_hashes,
+            'lexicon_version': mapper.lexicon_version,
+            'brand_names': extractor.brand_names,
+            'combination_variants': extractor.combination_variants,
+            'combination_index': (mapper.combination_variants, mapper.combination_keys),
+            'matcher': extractor.matcher.to_state(),
+        }
+        header = {
+            'format': cls.FORMAT_VERSION,
+            'engine_version': ENGINE_VERSION,
+            'lexicon_version': mapper.lexicon_version,
+            'source': os.path.abspath(csv_path),
+            'source_sha256': cls._file_hash(csv_path),
+            'entries': len(mapper.rxnorm_db),
+            'created': datetime.now().isoformat(),
+        }
+        temp_path = artifact_path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(cls.MAGIC)
+            f.write(json.dumps(header).encode('utf-8') + b'\n')
+            pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, artifact_path)
+        return header
+
+    @classmethod
+    def _check_header(cls, artifact_path: str, header: Dict, format_version: Optional[int] = None,
+                      rebuild: str = 'python main.py compile-lexicon'):
+        """Raise ValueError unless the artifact matches the format (default: this class's) and
+        engine and its source is unchanged; MappedLexiconFile checks its headers here too"""
+        if format_version is None:
+            format_version = cls.FORMAT_VERSION
+        if header.get('format') != format_version or header.get('engine_version') != ENGINE_VERSION:
+            raise ValueError(
+                f"{artifact_path} was built for format {header.get('format')} / engine "
+                f"{header.get('engine_version')}; rebuild it with `{rebuild}`")
+        source = header.get('source')
+        if source and os.path.exists(source) and cls._file_hash(source) != header.get('source_sha256'):
+            raise ValueError(f"{source} changed since {artifact_path} was compiled; rebuild it with `{rebuild}`")
+
+    @classmethod
+    def _read_header(cls, f, artifact_path: str) -> Dict:
+        if f.read(len(cls.MAGIC)) != cls.MAGIC:
+            raise ValueError(f"{artifact_path} is not a lexicon artifact")
+        header = json.loads(f.readline())
+        cls._check_header(artifact_path, header)
+        return header
+
+    @classmethod
+    def is_current(cls, artifact_path: str) -> bool:
+        """True if artifact_path would load: right format and engine, source CSV unchanged"""
+        try:
+            with open(artifact_path, 'rb') as f:
+                cls._read_header(f, artifact_path)
+            return True
+        except (OSError, ValueError):
+            return False
+
+    @classmethod
+    def load(cls, artifact_path: str) -> Dict:
+        """Load a trusted artifact; raises ValueError if it was built by another format or engine
+        version, or if its source CSV changed since it was compiled"""
+        with open(artifact_path, 'rb') as f:
+            header = cls._read_header(f, artifact_path)
+            payload = pickle.load(f)
+        payload['matcher'] = AhoCorasickMatcher.from_state(payload['matcher'])
+        payload['header'] = header
+        return payload
+
+
+class MappedStringTable(Mapping):
+    """Read-only str -> list-of-str table inside a MappedLexiconFile.
+
+    Keys are found through an open-addressing hash table (CRC-32 of the UTF-8
+    key, linear probing) and compared against the mapped string bytes, so a
+    lookup decodes only the values it returns. Iteration follows the order
+    the keys were written in.
+    """
+
+    def __init__(self, lexicon_file: 'MappedLexiconFile', name: str, single: bool = False):
+        self.file = lexicon_file
+        self.single = single
+        self.keys_column = lexicon_file.section(name + '.keys')
+        self.offsets = lexicon_file.section(name + '.offsets')
+        self.values = lexicon_file.section(name + '.values')
+        self.slots = lexicon_file.section(name + '.slots')
+        self.mask = len(self.slots) - 1
+
+    def _find(self, key: str) -> int:
+        if not isinstance(key, str):
+            return -1
+        encoded = key.encode('utf-8')
+        position = zlib.crc32(encoded) & self.mask
+        while True:
+            slot = self.slots[position]
+            if slot == 0:
+                return -1
+            if self.file.string_bytes(self.keys_column[slot - 1]) == encoded:
+                return slot - 1
+            position = (position + 1) & self.mask
+
+    def _decode(self, values: List[Optional[str]]):
+        return values[0] if self.single else values
+
+    def __getitem__(self, key: str):
+        i = self._find(key)
+        if i < 0:
+            raise KeyError(key)
+        string = self.file.string
+        return self._decode([string(v) for v in self.values[self.offsets[i]:self.offsets[i + 1]]])
+
+    def __contains__(self, key) -> bool:
+        return self._find(key) >= 0
+
+    def __iter__(self):
+        string = self.file.string
+        return (string(key_id) for key_id in self.keys_column)
+
+    def __len__(self) -> int:
+        return len(self.keys_column)
+
+
+class MappedRxNormTable(MappedStringTable):
+    """rxnorm_db view: values are stored as [rx_cui, cui_type, *brand_names]"""
+
+    def _decode(self, values: List[Optional[str]]) -> Dict:
+        return {'rx_cui': values[0], 'brand_names': values[2:], 'cui_type': values[1]}
+
+
+class MappedLexiconFile:
+    """Compiled lexicon laid out as flat integer columns in one read-only memory-mapped file.
+
+    Every process that opens the file maps the same pages, so API workers
+    share one copy through the OS page cache and opening it costs a header
+    read. RxNormMapper and LocalMedicationLLM look up the lexicon, brand and
+    combination tables and scan with the Aho-Corasick tables in place; see
+    MappedStringTable and MappedAhoCorasickMatcher.
+
+    Layout: MAGIC, 8-byte header length, JSON header (versions, section
+    table, payload templates), then 8-byte aligned sections of unsigned
+    32-bit ints, except the UTF-8 string blob and its 64-bit offsets.
+
+    The mapping lives until close() (or the end of a `with` block), or until
+    the file object is garbage collected. Tables and matchers built on it stop
+    working once it is closed.
+    """
+
+    MAGIC = b'MEDMAP1\n'
+    FORMAT_VERSION = 1
+    NONE = 0xFFFFFFFF
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        buffer = memoryview(self._mmap)
+        if bytes(buffer[:len(self.MAGIC)]) != self.MAGIC:
+            raise ValueError(f"{path} is not a mapped lexicon")
+        header_start = len(self.MAGIC) + 8
+        header_length, = struct.unpack('<Q', buffer[len(self.MAGIC):header_start])
+        self.header = json.loads(bytes(buffer[header_start:header_start + header_length]))
+        self._buffer = buffer
+        self._sections = {}
+        try:
+            LexiconArtifact._check_header(path, self.header, self.FORMAT_VERSION,
+                                          'python main.py compile-lexicon --format mmap')
+        except ValueError:
+            self.close()
+            raise
+        self._strings = self.section('strings')
+        self._string_offsets = self.section('string_offsets')
+
+    def close(self):
+        """Unmap the file; raises BufferError while a slice of it is still referenced elsewhere"""
+        if self._mmap is None:
+            return
+        for view in self._sections.values():
+            view.release()
+        self._sections.clear()
+        self._buffer.release()
+        self._mmap.close()
+        self._mmap = None
+
+    def __enter__(self) -> 'MappedLexiconFile':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @classmethod
+    def is_mapped(cls, path: str) -> bool:
+        try:
+            with open(path, 'rb') as f:
+                return f.read(len(cls.MAGIC)) == cls.MAGIC
+        except OSError:
+            return False
+
+    def section(self, name: str) -> memoryview:
+        view = self._sections.get(name)
+        if view is None:
+            offset, length, typecode = self.header['sections'][name]
+            view = self._sections[name] = self._buffer[offset:offset + length].cast(typecode)
+        return view
+
+    def string_bytes(self, string_id: int) -> memoryview:
+        return self._strings[self._string_offsets[string_id]:self._string_offsets[string_id + 1]]
+
+    def string(self, string_id: int) -> Optional[str]:
+        if string_id == self.NONE:
+            return None
+        return str(self.string_bytes(string_id), 'utf-8')
+
+    def as_artifact(self) -> Dict:
+        """The tables in the shape RxNormMapper / LocalMedicationLLM take from LexiconArtifact.load"""
+        rxnorm_db = MappedRxNormTable(self, 'lexicon')
+        brands = MappedStringTable(self, 'brands', single=True)
+        return {
+            'header': self.header,
+            'rxnorm_db': rxnorm_db,
+            'generic_names': rxnorm_db,
+            'brand_to_generic': brands,
+            'brand_names': brands,
+            'entry_hashes': MappedStringTable(self, 'entry_hashes', single=True),
+            'lexicon_version': self.header['lexicon_version'],
+            'combination_variants': MappedStringTable(self, 'extraction_variants'),
+            'combination_index': (MappedStringTable(self, 'lookup_variants', single=True),
+                                  MappedStringTable(self, 'ingredient_keys', single=True)),
+            'matcher': MappedAhoCorasickMatcher(self),
+        }
+
+    @classmethod
+    def compile(cls, csv_path: str, path: str) -> Dict:
+        """Build the lexicon from csv_path and write the mapped file; returns the header"""
+        mapper = RxNormMapper(csv_path)
+        extractor = LocalMedicationLLM(mapper.rxnorm_db, use_rule_bank=False)
+        strings, string_ids = [], {}
+
+        def string_id(value: Optional[str]) -> int:
+            if value is None:
+                return cls.NONE
+            if value not in string_ids:
+                string_ids[value] = len(strings)
+                strings.append(value)
+            return string_ids[value]
+
+        sections = {}
+
+        def add_table(name: str, rows):
+            keys, offsets, values = array('I'), array('I', [0]), array('I')
+            for key, row_values in rows:
+                keys.append(string_id(key))
+                values.extend(string_id(value) for value in row_values)
+                offsets.append(len(values))
+            size = 1
+            while size < 2 * max(len(keys), 1):
+                size *= 2
+            slots = array('I', [0]) * size
+            for i, key_id in enumerate(keys):
+                position = zlib.crc32(strings[key_id].encode('utf-8')) & (size - 1)
+                while slots[position]:
+                    position = (position + 1) & (size - 1)
+                slots[position] = i + 1
+            sections.update({name + '.keys': keys, name + '.offsets': offsets,
+                             name + '.values': values, name + '.slots': slots})
+
+        rxnorm_db = mapper.rxnorm_db
+        add_table('lexicon', ((generic, [info.get('rx_cui'), info.get('cui_type')] + list(info.get('brand_names', [])))
+                              for generic, info in rxnorm_db.items()))
+        add_table('brands', ((brand, [generic]) for brand, generic in extractor.brand_names.items()))
+        add_table('entry_hashes', ((generic, [entry_hash]) for generic, entry_hash in mapper.entry_hashes.items()))
+        add_table('extraction_variants', extractor.combination_variants.items())
+        add_table('lookup_variants', ((variant, [canonical])
+                                      for variant, canonical in mapper.combination_variants.items()))
+        add_table('ingredient_keys', ((key, [canonical]) for key, canonical in mapper.combination_keys.items()))
+
+        matcher = extractor.matcher
+        goto, fail, output, patterns = matcher.to_state()
+        out_offsets, out_ids = array('I', [0]), array('I')
+        trans_offsets, trans_chars, trans_next = array('I', [0]), array('I'), array('I')
+        for state in range(len(goto)):
+            out_ids.extend(output[state])
+            out_offsets.append(len(out_ids))
+            for ch in sorted(goto[state]):
+                trans_chars.append(ord(ch))
+                trans_next.append(goto[state][ch])
+            trans_offsets.append(len(trans_chars))
+        templates, template_ids = [], {}
+        pattern_strings, pattern_payloads, pattern_generics = array('I'), array('I'), array('I')
+        for pattern, payload in patterns:
+            template = {key: value for key, value in payload.items() if key != 'generic_name'}
+            template_key = json.dumps(template, sort_keys=True)
+            if template_key not in template_ids:
+                template_ids[template_key] = len(templates)
+                templates.append(template)
+            pattern_strings.append(string_id(pattern))
+            pattern_payloads.append(template_ids[template_key])
+            pattern_generics.append(string_id(payload.get('generic_name')))
+        sections.update({
+            'ac.fail': array('I', fail), 'ac.out_offsets': out_offsets, 'ac.out_ids': out_ids,
+            'ac.trans_offsets': trans_offsets, 'ac.trans_chars': trans_chars, 'ac.trans_next': trans_next,
+            'ac.patterns': pattern_strings, 'ac.pattern_payloads': pattern_payloads,
+            'ac.pattern_generics': pattern_generics,
+        })
+        encoded = [value.encode('utf-8') for value in strings]
+        string_offsets = array('Q', [0])
+        for value in encoded:
+            string_offsets.append(string_offsets[-1] + len(value))
+        sections['string_offsets'] = string_offsets
+        sections['strings'] = b''.join(encoded)
+
+        header = {
+            'format': cls.FORMAT_VERSION,
+            'engine_version': ENGINE_VERSION,
+            'lexicon_version': mapper.lexicon_version,
+            'source': os.path.abspath(csv_path),
+            'source_sha256': LexiconArtifact._file_hash(csv_path),
+            'entries': len(rxnorm_db),
+            'created': datetime.now().isoformat(),
+            'payload_templates': templates,
+            'sections': {},
+        }
+        # Section offsets depend on the header length, which depends on the offsets; iterate to a fixed point
+        header_length = 0
+        while True:
+            offset = len(cls.MAGIC) + 8 + header_length
+            for name, data in sections.items():
+                offset += -offset % 8
+                typecode = 'B' if isinstance(data, bytes) else data.typecode
+                size = len(data) if isinstance(data, bytes) else len(data) * data.itemsize
+                header['sections'][name] = [offset, size, typecode]
+                offset += size
+            encoded_header = json.dumps(header).encode('utf-8')
+            if len(encoded_header) == header_length:
+                break
+            header_length = len(encoded_header)
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(cls.MAGIC)
+            f.write(struct.pack('<Q', header_length))
+            f.write(encoded_header)
+            for name, data in sections.items():
+                f.write(b'\0' * (header['sections'][name][0] - f.tell()))
+                f.write(data if isinstance(data, bytes) else data.tobytes())
+        os.replace(temp_path, path)
+        return header
+
+
+def compile_lexicon_main(argv: List[str]):
+    """`python main.py compile-lexicon`: write a precompiled lexicon artifact"""
+    parser = argparse.ArgumentParser(prog='main.py compile-lexicon',
+                                     description='Compile the RxNorm CSV into a binary lexicon artifact')
+    parser.add_argument('--rxnorm-csv', default='Medication-label-set.csv', help='Path to RxNorm CSV file')
+    parser.add_argument('--output', '-o', help='Artifact path (default: CSV path with a .lexicon extension)')
+    parser.add_argument('--format', choices=['pickle', 'mmap'], default='pickle',
+                        help='pickle: single-unpickle load; mmap: read in place and shared between processes')
+    args = parser.parse_args(argv)
+    artifact_path = args.output or LexiconArtifact.default_path(args.rxnorm_csv)
+    if args.format == 'mmap':
+        header = MappedLexiconFile.compile(args.rxnorm_csv, artifact_path)
+    else:
+        header = LexiconArtifact.compile(args.rxnorm_csv, artifact_path)
+    print(f"✅ Compiled {header['entries']} lexicon entries to {artifact_path} "
+          f"(lexicon {header['lexicon_version']}, engine {header['engine_version']})")
+
+
+class BatchManifest:
+    """Record, kept in a batch output folder, of what every input was last extracted with.
+
+    Each file entry, keyed on the input's absolute path, holds the content
+    hash of the input, the lexicon version and the engine version its output
+    was produced with. The term lists of
+    every lexicon version still referenced are kept too, so after a lexicon
+    change a document only needs re-extraction if it contains a term of an
+    entry that was added, changed or removed. Entry order decides the order
+    mentions are reported in and which entry wins a term several entries
+    share, so if the order changed every term counts as changed.
+    """
+
+    FILENAME = 'extraction_manifest.json'
+    SAVE_EVERY = 25
+
+    def __init__(self, output_folder: str, engine_version: str, lexicon_version: str,
+                 lexicon_entries: Dict[str, list], output_format: str = 'json',
+                 flush_outputs: Optional[Callable[[], None]] = None):
+        self.output_folder = output_folder
+        self.output_format = output_format
+        # Called before every save so no entry is written ahead of its output
+        self.flush_outputs = flush_outputs
+        self.path = os.path.join(output_folder, self.FILENAME)
+        self.engine_version = engine_version
+        self.lexicon_version = lexicon_version
+        self.lock = threading.Lock()
+        data = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"⚠️ Ignoring unreadable manifest {self.path}: {e}")
+        self.files = data.get('files', {})
+        # lexicon version -> {generic: [entry hash, terms]}
+        self.lexicons = data.get('lexicons', {})
+        self.lexicons[lexicon_version] = lexicon_entries
+        self._changed_terms = {}
+        self._unsaved = 0
+        self._snapshots = 0  # taken so far; the file holds snapshot number self._written
+        self._written = 0
+        self._write_lock = threading.Lock()
+
+    @staticmethod
+    def content_hash(text: str) -> str:
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def is_current(self, file_name: str, content_hash: str, text: str) -> bool:
+        """True if the stored output for this input is still what a fresh run would produce"""
+        entry = self.files.get(file_name)
+        if (not entry or entry['content_hash'] != content_hash
+                or entry['engine_version'] != self.engine_version
+                or entry.get('format', 'json') != self.output_format
+                or not os.path.exists(os.path.join(self.output_folder, entry['output']))):
+            return False
+        if entry['lexicon_version'] == self.lexicon_version:
+            return True
+        changed_terms = self._changed_terms_since(entry['lexicon_version'])
+        if changed_terms is None:
+            return False
+        lowered = text.lower()
+        if any(term in lowered for term in changed_terms):
+            return False
+        # None of the changed entries can match this document: output is still valid
+        self.record(file_name, content_hash, entry['output'])
+        return True
+
+    def _changed_terms_since(self, lexicon_version: str) -> Optional[List[str]]:
+        """Terms of entries added, changed or removed since lexicon_version (None if unknown)"""
+        with self.lock:
+            if lexicon_version not in self._changed_terms:
+                old = self.lexicons.get(lexicon_version)
+                new = self.lexicons[self.lexicon_version]
+                terms = None
+                if old is not None:
+                    terms = set()
+                    for generic in set(old) | set(new):
+                        old_entry, new_entry = old.get(generic), new.get(generic)
+                        if old_entry is None or new_entry is None or old_entry[0] != new_entry[0]:
+                            terms.update(old_entry[1] if old_entry else ())
+                            terms.update(new_entry[1] if new_entry else ())
+                    if [generic for generic in old if generic in new] != [generic for generic in new if generic in old]:
+                        for entry in list(old.values()) + list(new.values()):
+                            terms.update(entry[1])
+                    terms = sorted(terms)
+                self._changed_terms[lexicon_version] = terms
+            return self._changed_terms[lexicon_version]
+
+    def record(self, file_name: str, content_hash: str, output_name: str):
+        snapshot = None
+        with self.lock:
+            self.files[file_name] = {
+                'content_hash': content_hash,
+                'lexicon_version': self.lexicon_version,
+                'engine_version': self.engine_version,
+                'format': self.output_format,
+                'output': output_name
+            }
+            self._unsaved += 1
+            if self._unsaved >= self.SAVE_EVERY:
+                snapshot = self._snapshot()
+        if snapshot is not None:
+            self._write(snapshot)
+
+    def save(self):
+        """Write the manifest atomically so a crash never leaves it half-written"""
+        with self.lock:
+            snapshot = self._snapshot()
+        self._write(snapshot)
+
+    def _snapshot(self):
+        """(sequence number, manifest data) of the entries so far; call with self.lock held"""
+        referenced = {entry['lexicon_version'] for entry in self.files.values()}
+        referenced.add(self.lexicon_version)
+        data = {
+            'engine_version': self.engine_version,
+            'lexicon_version': self.lexicon_version,
+            'files': dict(self.files),
+            'lexicons': {version: entries for version, entries in self.lexicons.items()
+                         if version in referenced}
+        }
+        self._unsaved = 0
+        self._snapshots += 1
+        return self._snapshots, data
+
+    def _write(self, snapshot):
+        sequence, data = snapshot
+        # Outputs of every snapshotted entry were handed to the writer before record()
+        if self.flush_outputs is not None:
+            self.flush_outputs()
+        with self._write_lock:
+            if sequence < self._written:
+                return  # a newer snapshot is already on disk
+            temp_path = self.path + '.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(temp_path, self.path)
+            self._written = sequence
+
+
+class NDJSONResultWriter:
+    """Streams batch results as compact one-line JSON documents.
+
+    Results go to a single medications-<run>.ndjson file, or to numbered parts
+    of rotate_every documents each, optionally gzip-compressed. The run stamp
+    in the name keeps earlier runs' files (still referenced by the manifest
+    for skipped inputs) from being overwritten.
+    """
+
+    def __init__(self, output_folder: str, rotate_every: int = 0, compress: bool = False):
+        self.output_folder = output_folder
+        self.rotate_every = rotate_every
+        self.compress = compress
+        self.run_stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+        self.part = 0
+        self.part_count = 0
+        self.current_name = None
+        self._file = None
+        self._lock = threading.Lock()
+
+    def _part_name(self) -> str:
+        name = f"medications-{self.run_stamp}"
+        if self.rotate_every:
+            name += f"-{self.part:05d}"
+        return name + ('.ndjson.gz' if self.compress else '.ndjson')
+
+    def _open_next_part(self):
+        self._close_part()
+        self.current_name = self._part_name()
+        path = os.path.join(self.output_folder, self.current_name)
+        if self.compress:
+            self._file = gzip.open(path, 'wt', encoding='utf-8')
+        else:
+            self._file = open(path, 'w', encoding='utf-8')
+        self.part += 1
+        self.part_count = 0
+
+    def write(self, result: Dict) -> str:
+        """Append one result and return the name of the file it went to"""
+        line = json.dumps(result, separators=(',', ':')) + '\n'
+        with self._lock:
+            if self._file is None or (self.rotate_every and self.part_count >= self.rotate_every):
+                self._open_next_part()
+            self._file.write(line)
+            self.part_count += 1
+            return self.current_name
+
+    def flush(self):
+        """Hand every result written so far to the OS, so the manifest can safely record them"""
+        with self._lock:
+            if self._file is not None:
+                # For gzip this flushes the GzipFile with zlib.Z_SYNC_FLUSH: the part is readable up to here
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._close_part()
+
+    def _close_part(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
 class MedicationExtractionPipeline:
     """Complete pipeline with confidence-based filtering"""
 
-    def __init__(self, rxnorm_csv_path: str = "Medication-label-set.csv"):
+    # Per-medication output fields, in output order. Classification and RxNorm
+    # mapping only run when one of the fields they produce is requested.
+    SPAN_FIELDS = ('text', 'confidence', 'start_offset', 'end_offset')
+    CLASSIFICATION_FIELDS = ('active_status', 'section')
+    MAPPING_FIELDS = ('rx_cui', 'normalized_name', 'cui_type', 'mapping_method', 'mapping_confidence', 'flag')
+    OUTPUT_FIELDS = MAPPING_FIELDS + SPAN_FIELDS + CLASSIFICATION_FIELDS
+    # Seconds one document may take in a process_batch worker before the worker is killed
+    DOCUMENT_TIMEOUT = 300
+
+    def __init__(self, rxnorm_csv_path: str = "Medication-label-set.csv", text_mode: bool = False,
+                 fields: Optional[List[str]] = None, instrumentation: Optional[PipelineInstrumentation] = None,
+                 engine: str = 'default'):
         # self.deidentifier = HIPAADeidentifier()
+        self.rxnorm_csv_path = rxnorm_csv_path
         self.rxnorm_mapper = RxNormMapper(rxnorm_csv_path)
-        self.medication_extractor = LocalMedicationLLM(self.rxnorm_mapper.rxnorm_db)
+        if engine not in ENGINE_PRESETS:
+            raise ValueError(f"Unknown engine {engine!r}; choose from {', '.join(ENGINE_PRESETS)}")
+        self.engine = engine
+        self.medication_extractor = LocalMedicationLLM(self.rxnorm_mapper.rxnorm_db,
+                                                       artifact=self.rxnorm_mapper.artifact,
+                                                       **ENGINE_PRESETS[engine])
+        # Extract from the visible text instead of raw HTML; offsets still point into the HTML.
+        # Spans and concepts match HTML mode, but active_status can differ: the table
+        # markup (<td>/<tr>) the classifier reads as a cue is not in the visible text
+        self.text_mode = text_mode
+        # Default output fields for process_document (None = all)
+        self.fields = self.validate_fields(fields) if fields is not None else None
+        # Per-stage timing hooks; None disables them
+        self.instrumentation = instrumentation
+
+    @classmethod
+    def validate_fields(cls, fields) -> List[str]:
+        """Requested output fields as a list; accepts a comma-separated string"""
+        if isinstance(fields, str):
+            fields = [field.strip() for field in fields.split(',') if field.strip()]
+        unknown = [field for field in fields if field not in cls.OUTPUT_FIELDS]
+        if unknown or not fields:
+            raise ValueError(f"Unknown output fields {unknown}; choose from {', '.join(cls.OUTPUT_FIELDS)}")
+        return list(fields)
+
+    @property
+    def engine_version(self) -> str:
+        """Engine version plus every option that changes results"""
+        version = ENGINE_VERSION + ('+text' if self.text_mode else '')
+        if self.engine != 'default':
+            version += '+engine=' + self.engine
+        if self.fields is not None:
+            version += '+fields=' + ','.join(sorted(self.fields))
+        return version
+
+    def lexicon_entries(self) -> Dict[str, list]:
+        """{generic: [entry hash, every lowercased term that can match or map to it]}"""
+        entries = {}
+        for generic, info in self.rxnorm_mapper.rxnorm_db.items():
+            terms = {generic}
+            if '/' in generic:
+                terms.update(v.lower() for v in self.medication_extractor.combination_variants.get(generic, ()))
+                terms.update(v.lower() for v in self.rxnorm_mapper._create_combination_variations_for_lookup(generic))
+            terms.update(info.get('brand_names', []))
+            entries[generic] = [self.rxnorm_mapper.entry_hashes[generic], sorted(terms)]
+        return entries
 
     def process_single_file(self, file_path: str) -> Dict:
         """Process a single HTML medical record file"""
+        timings = self.instrumentation.begin_document(file_path) if self.instrumentation is not None else None
+        start = time.perf_counter()
         try:
             with open(file_path, 'r', encoding='utf-8') as f:
                 html_text = f.read()
+        except Exception as e:
+            return self._error_result(file_path, str(e))
+        if timings is not None:
+            timings.lap('read', start)
+        return self.process_document(file_path, html_text, timings=timings)
+
+    def process_document(self, file_path: str, html_text: str, fields: Optional[List[str]] = None,
+                         timings: Optional[StageTimings] = None) -> Dict:
+        """Extract and map medications from an already-read HTML document
+
+        fields limits each medication to those output fields (default: the
+        pipeline's fields, else all) and skips the stages none of them need.
+        With instrumentation, or when the caller passes its own timings, the
+        result carries the document's stage timings under 'instrumentation'
+        (timings, if given, may already hold earlier stages such as the read).
+        """
+        try:
+            if timings is None and self.instrumentation is not None:
+                timings = self.instrumentation.begin_document(file_path)
+            fields = self.validate_fields(fields) if fields is not None else self.fields
+            classify = fields is None or any(field in self.CLASSIFICATION_FIELDS for field in fields)
             # clean_text = self.deidentifier.deidentify_text(html_text)
             clean_text = html_text  # If no deidentifier
-            medications = self.medication_extractor.extract_medications(clean_text)
-            mapped = self.rxnorm_mapper.map_to_cui(medications)
-            return {
+            if self.text_mode:
+                start = time.perf_counter() if timings is not None else 0.0
+                text_layer = HTMLTextLayer(clean_text)
+                if timings is not None:
+                    timings.lap('text_layer', start)
+                medications = self.medication_extractor.extract_medications(text_layer.text, text_layer, classify,
+                                                                            timings)
+                for med in medications:
+                    med['start_offset'], med['end_offset'] = text_layer.to_html_span(med['start_offset'], med['end_offset'])
+            else:
+                medications = self.medication_extractor.extract_medications(clean_text, classify=classify,
+                                                                            timings=timings)
+            start = time.perf_counter() if timings is not None else 0.0
+            if fields is None or any(field in self.MAPPING_FIELDS for field in fields):
+                mapped = self.rxnorm_mapper.map_to_cui(medications)
+                if timings is not None:
+                    for med in mapped:
+                        timings.count('map.' + med['mapping_method'])
+            else:
+                mapped = medications
+            if self.text_mode:
+                # Mapping used the visible text; the output text is the HTML the offsets point at,
+                # so html[start_offset:end_offset] == text even across tags and entities
+                for med in mapped:
+                    med['text'] = clean_text[med['start_offset']:med['end_offset']]
+            if fields is not None:
+                mapped = [{field: med.get(field) for field in fields} for med in mapped]
+            result = {
                 'file': os.path.basename(file_path),
+                'lexicon_version': self.rxnorm_mapper.lexicon_version,
                 'medications': mapped
             }
+            if timings is not None:
+                timings.lap('map', start)
+                result['instrumentation'] = (self.instrumentation.end_document(timings)
+                                             if self.instrumentation is not None else timings.as_dict())
+            return result
         except Exception as e:
-            print(f"Error processing {file_path}: {e}")
-            return {'file': os.path.basename(file_path), 'medications': [], 'error': str(e)}
+            return self._error_result(file_path, str(e))
+
+    @staticmethod
+    def _error_result(file_path: str, error: str) -> Dict:
+        print(f"Error processing {file_path}: {error}")
+        return {'file': os.path.basename(file_path), 'medications': [], 'error': error}
+
+    @staticmethod
+    def output_filename(file_path: str) -> str:
+        """Name of an input's JSON output: its base name with the extension replaced"""
+        return os.path.splitext(os.path.basename(file_path))[0] + '_medications.json'
+
+    @classmethod
+    def _output_filenames(cls, file_paths: List[str]) -> Dict[str, str]:
+        """{input path: output name}, adding a hash of the full path where two inputs would collide"""
+        names = {file_path: cls.output_filename(file_path) for file_path in file_paths}
+        counts = Counter(names.values())
+        for file_path, name in names.items():
+            if counts[name] > 1:
+                digest = hashlib.sha256(os.path.abspath(file_path).encode('utf-8')).hexdigest()[:8]
+                names[file_path] = name[:-len('_medications.json')] + f'-{digest}_medications.json'
+        return names
+
+    def process_batch(self, input_folder: Optional[str], output_folder: str, jobs: int = 1, prefetch: int = 8,
+                      resume: bool = True, output_format: str = 'json', rotate_every: int = 0,
+                      compress: bool = False, input_files: Optional[List[str]] = None,
+                      instrumentation_path: Optional[str] = None):
+        """Process all HTML files in input folder as a read -> extract -> write stage pipeline.
 
-    def process_batch(self, input_folder: str, output_folder: str):
-        """Process all HTML files in input folder"""
+        A reader thread prefetches documents and a writer thread serializes and
+        writes results while extraction runs here (jobs == 1) or in `jobs` worker
+        processes. Queues between the stages are bounded, so a slow stage holds
+        back the ones before it instead of buffering the corpus in memory.
+
+        With resume, inputs whose output in the folder's BatchManifest is still
+        current are skipped by the reader. Each input gets output_filename(),
+        disambiguated when two inputs share a name. output_format 'ndjson' streams all
+        results through an NDJSONResultWriter instead of one JSON file per input.
+        input_files, when given, replaces the folder listing and keeps its order.
+        With instrumentation, per-document stage timings are written as NDJSON
+        to instrumentation_path (if given) and the totals are printed.
+        """
         os.makedirs(output_folder, exist_ok=True)
-        html_files = glob.glob(os.path.join(input_folder, "*.html"))
+        if input_files is not None:
+            html_files = list(input_files)
+        else:
+            html_files = sorted(glob.glob(os.path.join(input_folder, "*.html")))
         if not html_files:
             print("No HTML files found in input folder.")
             return
         print(f"Processing {len(html_files)} files with confidence threshold ≥ 0.95...")
-        for html_file in html_files:
-            result = self.process_single_file(html_file)
-            output_filename = os.path.basename(html_file).replace('.html', '_medications.json')
-            output_path = os.path.join(output_folder, output_filename)
-            with open(output_path, 'w', encoding='utf-8') as f:
-                json.dump(result, f, indent=2)
-            print(f"✅ Processed: {output_path}")
-        print(f"\n🎉 Batch processing complete! High-confidence results saved to {output_folder}")
+        if jobs > 1:
+            chunks = self._size_balanced_chunks(html_files, max(jobs * 4, len(html_files) // 16))
+        else:
+            chunks = [[file_path] for file_path in html_files]
+        busy = {'read': 0.0, 'extract': 0.0, 'write': 0.0}
+        output_filenames = self._output_filenames(html_files)
+        ndjson_writer = NDJSONResultWriter(output_folder, rotate_every, compress) if output_format == 'ndjson' else None
+        manifest = None
+        if resume:
+            manifest = BatchManifest(output_folder, self.engine_version, self.rxnorm_mapper.lexicon_version,
+                                     self.lexicon_entries(), output_format,
+                                     flush_outputs=ndjson_writer.flush if ndjson_writer is not None else None)
+        content_hashes = {}
+        skipped = [0]
+        read_queue = queue.Queue(maxsize=max(prefetch, jobs * 2))
+        write_queue = queue.Queue(maxsize=prefetch * 4)
+        instrumentation = self.instrumentation
+        instrumentation_file = open(instrumentation_path, 'w', encoding='utf-8') if instrumentation_path else None
+        stop_reading = threading.Event()
+        start_time = time.perf_counter()
+
+        def hand_off(documents) -> bool:
+            # Wait for room in read_queue, but give up once the run is stopping
+            while not stop_reading.is_set():
+                try:
+                    read_queue.put(documents, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def read_stage():
+            try:
+                read_chunks()
+            finally:
+                hand_off(None)
+
+        def read_chunks():
+            for chunk in chunks:
+                if stop_reading.is_set():
+                    return
+                documents = []
+                for file_path in chunk:
+                    stage_start = time.perf_counter()
+                    timings = instrumentation.begin_document(file_path) if instrumentation is not None else None
+                    try:
+                        with open(file_path, 'r', encoding='utf-8') as f:
+                            html_text = f.read()
+                    except Exception as e:
+                        documents.append((file_path, None, str(e)))
+                        busy['read'] += time.perf_counter() - stage_start
+                        continue
+                    if manifest is not None:
+                        content_hash = BatchManifest.content_hash(html_text)
+                        if manifest.is_current(os.path.abspath(file_path), content_hash, html_text):
+                            skipped[0] += 1
+                            busy['read'] += time.perf_counter() - stage_start
+                            continue
+                        content_hashes[file_path] = content_hash
+                    if timings is not None:
+                        timings.lap('read', stage_start)
+                    documents.append((file_path, html_text, None, timings))
+                    busy['read'] += time.perf_counter() - stage_start
+                if documents and not hand_off(documents):
+                    return
+
+        def write_stage():
+            while True:
+                item = write_queue.get()
+                if item is None:
+                    return
+                file_path, result = item
+                stage_start = time.perf_counter()
+                record = result.pop('instrumentation', None)
+                if record is not None:
+                    if jobs > 1:
+                        # Worker processes have their own hooks; run ours here
+                        instrumentation.on_document(record)
+                    if instrumentation_file is not None:
+                        instrumentation_file.write(json.dumps(record) + '\n')
+                output_filename = output_filenames[file_path]
+                output_path = os.path.join(output_folder, output_filename)
+                try:
+                    if ndjson_writer is not None:
+                        output_filename = ndjson_writer.write(result)
+                        output_path = os.path.join(output_folder, output_filename)
+                        print(f"✅ Processed: {file_path} -> {output_path}")
+                    else:
+                        with open(output_path, 'w', encoding='utf-8') as f:
+                            json.dump(result, f, indent=2)
+                        print(f"✅ Processed: {output_path}")
+                    if file_path in content_hashes and 'error' not in result:
+                        manifest.record(os.path.abspath(file_path), content_hashes.pop(file_path), output_filename)
+                except Exception as e:
+                    print(f"Error writing {output_path}: {e}")
+                busy['write'] += time.perf_counter() - stage_start
+
+        reader = threading.Thread(target=read_stage, name='batch-reader', daemon=True)
+        writer = threading.Thread(target=write_stage, name='batch-writer', daemon=True)
+        reader.start()
+        writer.start()
+        try:
+            documents = iter(read_queue.get, None)
+            if jobs > 1:
+                results = self._extract_in_pool(documents, jobs, busy)
+            else:
+                results = self._extract_in_process(documents, busy)
+            for file_path, result in results:
+                write_queue.put((file_path, result))
+        finally:
+            # If extraction failed the reader may be waiting on a full read_queue
+            stop_reading.set()
+            reader.join()
+            write_queue.put(None)
+            writer.join()
+            if ndjson_writer is not None:
+                ndjson_writer.close()
+            if manifest is not None:
+                manifest.save()
+            if instrumentation_file is not None:
+                instrumentation_file.close()
+        if skipped[0]:
+            print(f"\n⏭️ Skipped {skipped[0]} files already up to date in {BatchManifest.FILENAME}")
+
+        wall = time.perf_counter() - start_time
+        workers = max(jobs, 1)
+        print(f"\n📊 Stage utilization over {wall:.1f}s: "
+              f"read {100 * busy['read'] / wall:.0f}% | "
+              f"extract {100 * busy['extract'] / (wall * workers):.0f}% of {workers} worker(s) | "
+              f"write {100 * busy['write'] / wall:.0f}%")
+        if instrumentation is not None:
+            print(instrumentation.report())
+        print(f"🎉 Batch processing complete! High-confidence results saved to {output_folder}")
+
+    def _run_document(self, file_path: str, html_text: Optional[str], read_error: Optional[str],
+                      timings: Optional[StageTimings] = None) -> Dict:
+        if read_error is not None:
+            return self._error_result(file_path, read_error)
+        return self.process_document(file_path, html_text, timings=timings)
+
+    def _extract_in_process(self, document_chunks, busy: Dict):
+        """CPU stage without workers: yield (file_path, result) in input order"""
+        for documents in document_chunks:
+            for document in documents:
+                file_path = document[0]
+                stage_start = time.perf_counter()
+                result = self._run_document(*document)
+                busy['extract'] += time.perf_counter() - stage_start
+                yield file_path, result
+
+    def _extract_in_pool(self, document_chunks, jobs: int, busy: Dict):
+        """CPU stage on `jobs` worker processes: yield (file_path, result) in input order.
+
+        Each worker builds its own pipeline once. At most 2 * jobs chunks are in
+        flight. If a chunk fails, or is not done DOCUMENT_TIMEOUT seconds per
+        document after it was submitted, its documents are retried one at a time in a separate
+        single-worker pool, each with DOCUMENT_TIMEOUT seconds; a document that
+        kills or hangs that worker again gets an error result. If the main pool
+        broke (or was stopped because of a stuck chunk), the other chunks in
+        flight are resubmitted to a fresh one. Documents never run in this process, so
+        one bad document cannot take the run down with it. Workers are started from a
+        forkserver (spawn where that is unavailable), never forked while the reader and
+        writer threads hold locks.
+        """
+        start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        context = multiprocessing.get_context(start_method)
+        manager = context.Manager()
+        worker_pids = {}  # executor -> manager list its workers append their PIDs to
+
+        def new_executor(workers=jobs):
+            pids = manager.list()
+            pool = ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                       initializer=_init_tracked_batch_worker,
+                                       initargs=(pids, self.rxnorm_csv_path, self.text_mode, self.fields,
+                                                 self.instrumentation is not None, self.engine))
+            worker_pids[pool] = pids
+            return _start_batch_workers(pool, workers, manager)
+
+        executor = new_executor()
+        isolation = None  # single-worker pool for retrying a failed chunk document by document
+        in_flight = deque()  # (documents, future, deadline)
+
+        def stop(pool):
+            # shutdown() cannot stop a running task; end the workers themselves
+            for pid in list(worker_pids.pop(pool, ())):
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+            pool.shutdown(wait=False)
+
+        def run_isolated(document):
+            nonlocal isolation
+            if isolation is None:
+                isolation = new_executor(1)
+            future = isolation.submit(_process_batch_chunk, [document])
+            try:
+                results, seconds = future.result(timeout=self.DOCUMENT_TIMEOUT)
+                busy['extract'] += seconds
+                return results[0]
+            except Exception as e:
+                stop(isolation)
+                isolation = None
+                print(f"❌ {document[0]} failed in an isolated worker ({e!r}); recording an error")
+                return self._error_result(document[0], f"Worker failed on this document: {e!r}")
+
+        def submit(documents):
+            nonlocal executor
+            deadline = time.monotonic() + self.DOCUMENT_TIMEOUT * len(documents)
+            try:
+                return documents, executor.submit(_process_batch_chunk, documents), deadline
+            except BrokenProcessPool:
+                stop(executor)
+                executor = new_executor()
+                return documents, executor.submit(_process_batch_chunk, documents), deadline
+
+        def drain_oldest():
+            nonlocal executor
+            documents, future, deadline = in_flight.popleft()
+            try:
+                results, seconds = future.result(timeout=max(0.0, deadline - time.monotonic()))
+                busy['extract'] += seconds
+            except Exception as e:
+                print(f"⚠️ Worker failed on a chunk of {len(documents)} files ({e!r}); retrying them one at a time")
+                if isinstance(e, (BrokenProcessPool, FutureTimeoutError)):
+                    stop(executor)
+                    executor = new_executor()
+                    for i, (queued, _, _) in enumerate(in_flight):
+                        in_flight[i] = submit(queued)
+                results = [run_isolated(document) for document in documents]
+            return zip([document[0] for document in documents], results)
+
+        try:
+            for documents in document_chunks:
+                in_flight.append(submit(documents))
+                if len(in_flight) >= jobs * 2:
+                    yield from drain_oldest()
+            while in_flight:
+                yield from drain_oldest()
+        finally:
+            executor.shutdown()
+            if isolation is not None:
+                isolation.shutdown()
+            manager.shutdown()
+
+    @staticmethod
+    def _size_balanced_chunks(file_paths: List[str], n_chunks: int) -> List[List[str]]:
+        """Split files, in order, into consecutive chunks of roughly equal total bytes"""
+        sizes = [os.path.getsize(path) if os.path.exists(path) else 0 for path in file_paths]
+        target = max(sum(sizes) / max(n_chunks, 1), 1)
+        chunks = [[]]
+        chunk_bytes = 0
+        for path, size in zip(file_paths, sizes):
+            if chunks[-1] and chunk_bytes + size / 2 > target:
+                chunks.append([])
+                chunk_bytes = 0
+            chunks[-1].append(path)
+            chunk_bytes += size
+        return chunks
+
+
+# Pipeline owned by each process_batch worker process
+_batch_worker_pipeline = None
+
+
+def _init_batch_worker(rxnorm_csv_path: str, text_mode: bool, fields: Optional[List[str]], instrumented: bool,
+                       engine: str):
+    """Load the lexicon and build the matchers once per worker process"""
+    global _batch_worker_pipeline
+    _batch_worker_pipeline = MedicationExtractionPipeline(
+        rxnorm_csv_path, text_mode=text_mode, fields=fields,
+        instrumentation=PipelineInstrumentation() if instrumented else None, engine=engine)
+
+
+def _init_tracked_batch_worker(worker_pids, *initargs):
+    """_init_batch_worker that first reports the worker's PID, so a stuck pool can be stopped"""
+    worker_pids.append(os.getpid())
+    _init_batch_worker(*initargs)
+
+
+def _start_batch_workers(pool: ProcessPoolExecutor, workers: int, manager) -> ProcessPoolExecutor:
+    """Start all `workers` of a forkserver or spawn pool now instead of on later submits.
+
+    Such a pool starts a worker whenever a submit finds none idle. One started
+    while the pool is being torn down after a worker died escapes the teardown
+    and keeps the pool's call queue open, so the interpreter hangs at exit.
+    Tasks that wait for each other keep every worker busy until all have started.
+    """
+    barrier = manager.Barrier(workers)
+    for _ in range(workers):
+        pool.submit(_wait_for_batch_workers, barrier)
+    return pool
+
+
+def _wait_for_batch_workers(barrier):
+    barrier.wait()
+
+
+def _process_batch_chunk(documents: List[tuple]) -> tuple:
+    """Worker side of the CPU stage: results for a chunk plus the seconds spent on it"""
+    chunk_start = time.perf_counter()
+    results = [_batch_worker_pipeline._run_document(*document) for document in documents]
+    return results, time.perf_counter() - chunk_start
+
 
+def _process_document_in_worker(file_path: str, html_text: str, fields: Optional[List[str]],
+                                timings: Optional[StageTimings] = None) -> Dict:
+    """Worker side of one document of an api_server /process-batch or large /process-document request"""
+    return _batch_worker_pipeline.process_document(file_path, html_text, fields, timings)
 
 def main():
     """Main function to run the medication extraction pipeline"""
+    if len(sys.argv) > 1 and sys.argv[1] == 'compile-lexicon':
+        return compile_lexicon_main(sys.argv[2:])
+    if len(sys.argv) > 1 and sys.argv[1] == 'ingest-rrf':
+        return ingest_rrf_main(sys.argv[2:])
     parser = argparse.ArgumentParser(description='Turmerik Medication Extraction Pipeline (Confidence ≥ 0.95)')
-    parser.add_argument('--input', '-i', required=True, help='Input file or folder')
+    parser.add_argument('--input', '-i', required=True,
+                       help="Input file or folder, or '-' to read a list of input files from stdin")
     parser.add_argument('--output', '-o', required=True, help='Output folder')  # Changed back to --output
     parser.add_argument('--rxnorm-csv', default='Medication-label-set.csv',
-                       help='Path to RxNorm CSV file')
+                       help='Path to RxNorm CSV file, a compiled lexicon artifact or an ingest-rrf lexicon')
+    parser.add_argument('--text-mode', action='store_true',
+                       help='Extract from visible text instead of raw HTML (offsets still refer to the HTML; '
+                            'active_status can differ where table markup was the cue)')
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                       help='Worker processes for folder input (0 = one per CPU)')
+    parser.add_argument('--force', action='store_true',
+                       help='Re-process every file in the folder, ignoring the output manifest')
+    parser.add_argument('--format', choices=['json', 'ndjson'], default='json',
+                       help='Batch output: one JSON file per input, or compact lines streamed into NDJSON files')
+    parser.add_argument('--rotate-every', type=int, default=0,
+                       help='With --format ndjson, start a new part file every N documents (0 = single file)')
+    parser.add_argument('--gzip', action='store_true', help='With --format ndjson, gzip the output files')
+    parser.add_argument('--fields',
+                       help='Comma-separated medication fields to output; stages no field needs are skipped '
+                            f"(default: all of {','.join(MedicationExtractionPipeline.OUTPUT_FIELDS)})")
+    parser.add_argument('--engine', choices=list(ENGINE_PRESETS), default='default',
+                       help="Engine preset: 'legacy' (original matchers and classifier), 'exact' (optimized, "
+                            "same output as legacy) or 'default' (also resolves overlapping mentions)")
+    parser.add_argument('--instrument', metavar='PATH',
+                       help='Time every stage and write per-document timings and counts to PATH as NDJSON')
     args = parser.parse_args()
-    pipeline = MedicationExtractionPipeline(args.rxnorm_csv)
-    if os.path.isfile(args.input):
+    jobs = args.jobs if args.jobs > 0 else (os.cpu_count() or 1)
+    try:
+        fields = MedicationExtractionPipeline.validate_fields(args.fields) if args.fields else None
+    except ValueError as e:
+        parser.error(str(e))
+    instrumentation = PipelineInstrumentation() if args.instrument else None
+    pipeline = MedicationExtractionPipeline(args.rxnorm_csv, text_mode=args.text_mode, fields=fields,
+                                            instrumentation=instrumentation, engine=args.engine)
+    batch_options = dict(jobs=jobs, resume=not args.force, output_format=args.format,
+                         rotate_every=args.rotate_every, compress=args.gzip, instrumentation_path=args.instrument)
+    if args.input == '-':
+        input_files = [line.strip() for line in sys.stdin if line.strip()]
+        pipeline.process_batch(None, args.output, input_files=input_files, **batch_options)
+    elif os.path.isfile(args.input):
         result = pipeline.process_single_file(args.input)
+        record = result.pop('instrumentation', None)
+        if record is not None:
+            with open(args.instrument, 'w', encoding='utf-8') as f:
+                f.write(json.dumps(record) + '\n')
+            print(instrumentation.report())
         os.makedirs(args.output, exist_ok=True)  # Fixed: use args.output
-        output_filename = os.path.basename(args.input).replace('.html', '_medications.json')
+        output_filename = MedicationExtractionPipeline.output_filename(args.input)
         output_path = os.path.join(args.output, output_filename)  # Fixed: use args.output
         with open(output_path, 'w', encoding='utf-8') as f:
             json.dump(result, f, indent=2)
         print(f"✅ Processed single file: {output_path}")
         print(f"Found {len(result['medications'])} high-confidence medications")
     elif os.path.isdir(args.input):
-        pipeline.process_batch(args.input, args.output)  # Fixed: use args.output
+        pipeline.process_batch(args.input, args.output, **batch_options)  # Fixed: use args.output
     else:
         print(f"Error: {args.input} is not a valid file or directory")
 
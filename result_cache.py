@@ -0,0 +1,177 @@
+"""Content-addressed cache of extraction results.
+
+A result is keyed on the SHA-256 of the document bytes, the lexicon version,
+the engine version and the requested output fields, so identical documents
+are extracted once per lexicon and engine and a lexicon reload or engine
+upgrade simply stops matching the old entries. Two tiers:
+
+- memory: an LRU of serialized results in this process, evicted by total
+  size (max_memory_bytes);
+- disk: a SQLite table shared by every worker process on the host (WAL
+  mode, so readers do not block the writer), trimmed to max_disk_bytes by
+  least recent use. A disk hit is promoted into memory. Extraction results
+  describe patient records, so the file is created owner-only (0600, in a
+  0700 directory if it has to create one); SQLite gives its -wal/-shm
+  files the same mode.
+
+Values are the JSON-encoded pipeline result, so a hit costs a dictionary
+lookup (memory) or an indexed read (disk) plus json.loads. The disk tier is
+best effort: a SQLite error is printed and treated as a miss, so the
+cache can never fail an extraction.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple, Union
+
+MEMORY, DISK = 'memory', 'disk'
+
+
+class ResultCache:
+    """Two-tier (in-memory LRU, shared SQLite) cache of extraction results by content key"""
+
+    # Trim the disk tier after this many writes
+    TRIM_EVERY = 64
+
+    def __init__(self, max_memory_bytes: int = 64 * 1024 * 1024, disk_path: Optional[str] = None,
+                 max_disk_bytes: int = 1024 * 1024 * 1024):
+        self.max_memory_bytes = max_memory_bytes
+        self.disk_path = disk_path
+        self.max_disk_bytes = max_disk_bytes
+        self.memory = OrderedDict()  # key -> serialized result, least recently used first
+        self.memory_bytes = 0
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'stores': 0}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._writes = 0
+        if disk_path:
+            try:
+                self._disk()
+            except (sqlite3.Error, OSError) as e:
+                print(f"⚠️ Result cache disk tier disabled ({disk_path}): {e}")
+                self.disk_path = None
+
+    @staticmethod
+    def key(content: Union[bytes, str], lexicon_version: str, engine_version: str,
+            fields: Optional[List[str]] = None) -> str:
+        """Cache key for a document's results under one lexicon and engine"""
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        content_sha256 = hashlib.sha256(content).hexdigest()
+        parts = [content_sha256, lexicon_version or '', engine_version, ','.join(sorted(fields)) if fields else '']
+        return hashlib.sha256('\0'.join(parts).encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Tuple[Optional[Dict], Optional[str]]:
+        """(result, tier) for a cached key, (None, None) on a miss"""
+        with self._lock:
+            value = self.memory.get(key)
+            if value is not None:
+                self.memory.move_to_end(key)
+                self.stats['memory_hits'] += 1
+                return json.loads(value), MEMORY
+        value = self._disk_get(key) if self.disk_path else None
+        with self._lock:
+            if value is None:
+                self.stats['misses'] += 1
+                return None, None
+            self.stats['disk_hits'] += 1
+            self._memory_put(key, value)
+        return json.loads(value), DISK
+
+    def put(self, key: str, result: Dict):
+        """Store a pipeline result (without per-request data such as instrumentation)"""
+        value = json.dumps(result, separators=(',', ':')).encode('utf-8')
+        with self._lock:
+            self.stats['stores'] += 1
+            self._memory_put(key, value)
+            self._writes += 1
+            trim = self._writes % self.TRIM_EVERY == 0
+        if self.disk_path:
+            self._disk_put(key, value, trim)
+
+    def status(self) -> Dict:
+        with self._lock:
+            lookups = self.stats['memory_hits'] + self.stats['disk_hits'] + self.stats['misses']
+            hits = lookups - self.stats['misses']
+            return dict(self.stats, memory_entries=len(self.memory), memory_bytes=self.memory_bytes,
+                        hit_rate=hits / lookups if lookups else 0.0, disk_path=self.disk_path)
+
+    def _memory_put(self, key: str, value: bytes):
+        """Insert and evict least recently used entries down to max_memory_bytes (caller holds the lock)"""
+        if len(value) > self.max_memory_bytes:
+            return
+        previous = self.memory.pop(key, None)
+        if previous is not None:
+            self.memory_bytes -= len(previous)
+        self.memory[key] = value
+        self.memory_bytes += len(value)
+        while self.memory_bytes > self.max_memory_bytes:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_bytes -= len(evicted)
+
+    def _disk(self) -> sqlite3.Connection:
+        """This thread's connection to the disk tier"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            directory = os.path.dirname(self.disk_path)
+            if directory:
+                os.makedirs(directory, mode=0o700, exist_ok=True)
+            os.close(os.open(self.disk_path, os.O_RDWR | os.O_CREAT, 0o600))
+            connection = sqlite3.connect(self.disk_path, timeout=5)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('''
+                CREATE TABLE IF NOT EXISTS results (
+                    key TEXT PRIMARY KEY,
+                    value BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_used REAL NOT NULL
+                )
+            ''')
+            connection.execute('CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)')
+            connection.commit()
+            self._local.connection = connection
+        return connection
+
+    def _disk_get(self, key: str) -> Optional[bytes]:
+        try:
+            connection = self._disk()
+            row = connection.execute('SELECT value FROM results WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            connection.execute('UPDATE results SET last_used = ? WHERE key = ?', (time.time(), key))
+            connection.commit()
+            return bytes(row[0])
+        except sqlite3.Error as e:
+            print(f"⚠️ Result cache read failed: {e}")
+            return None
+
+    def _disk_put(self, key: str, value: bytes, trim: bool):
+        try:
+            connection = self._disk()
+            connection.execute('INSERT OR REPLACE INTO results (key, value, size, last_used) VALUES (?, ?, ?, ?)',
+                               (key, value, len(value), time.time()))
+            if trim:
+                self._disk_trim(connection)
+            connection.commit()
+        except sqlite3.Error as e:
+            print(f"⚠️ Result cache write failed: {e}")
+
+    def _disk_trim(self, connection: sqlite3.Connection):
+        """Delete least recently used rows until the table fits in max_disk_bytes"""
+        total = connection.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+        if total <= self.max_disk_bytes:
+            return
+        excess = total - self.max_disk_bytes
+        freed = 0
+        stale = []
+        for key, size in connection.execute('SELECT key, size FROM results ORDER BY last_used'):
+            stale.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        connection.executemany('DELETE FROM results WHERE key = ?', stale)
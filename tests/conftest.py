@@ -0,0 +1,54 @@
+import glob
+import os
+import sys
+
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+LEXICON_CSV = os.path.join(REPO_ROOT, 'Medication-label-set.csv')
+
+
+@pytest.fixture(scope='session')
+def pipeline():
+    from main import MedicationExtractionPipeline
+    return MedicationExtractionPipeline(LEXICON_CSV)
+
+
+@pytest.fixture(scope='session')
+def corpus_sample():
+    """A few hundred KB of the bundled records: (file name, html text)"""
+    paths = sorted(glob.glob(os.path.join(REPO_ROOT, 'data_900', '*', '*.html')))[::40]
+    documents = []
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            documents.append((os.path.basename(path), f.read()))
+    return documents
+
+
+@pytest.fixture
+def lexicon_manager(tmp_path, monkeypatch):
+    """A loaded api_server.LexiconManager over a copy of the lexicon CSV, installed as the server's"""
+    pytest.importorskip('flask')
+    pytest.importorskip('flask_cors')
+    import shutil
+    import api_server
+    source = str(tmp_path / 'lexicon.csv')
+    shutil.copyfile(LEXICON_CSV, source)
+    manager = api_server.LexiconManager(source, str(tmp_path / 'lexicons'), str(tmp_path / 'missing.lexicon'))
+    manager.reload(wait=True)
+    assert manager.ready.is_set(), manager.last_error
+    monkeypatch.setattr(api_server, 'lexicon_manager', manager)
+    return manager
+
+
+@pytest.fixture
+def batch_pool(lexicon_manager, monkeypatch):
+    """A two-worker api_server.BatchWorkerPool installed as the server's; its workers are killed afterwards"""
+    import api_server
+    pool = api_server.BatchWorkerPool(2)
+    monkeypatch.setattr(api_server, 'batch_pool', pool)
+    yield pool
+    if pool._executor is not None:
+        pool.discard(pool._executor, kill=True)
@@ -0,0 +1,102 @@
+import os
+import threading
+
+from main import BatchManifest
+
+LEXICON_V1 = {
+    'amiodarone': ['h-amiodarone', ['amiodarone', 'cordarone', 'pacerone']],
+    'atenolol': ['h-atenolol', ['atenolol', 'tenormin']],
+}
+DOCUMENT = '<p>Atenolol 25 mg daily</p>'
+
+
+def recorded_manifest(folder, lexicon=LEXICON_V1, engine_version='2.1.1'):
+    """A saved manifest with one input, 'in.html', recorded against lexicon"""
+    with open(os.path.join(folder, 'in_medications.json'), 'w') as f:
+        f.write('{}')
+    manifest = BatchManifest(folder, engine_version, 'v1', lexicon)
+    manifest.record('/data/in.html', BatchManifest.content_hash(DOCUMENT), 'in_medications.json')
+    manifest.save()
+    return manifest
+
+
+def reopened(folder, lexicon_version='v1', lexicon=LEXICON_V1, engine_version='2.1.1'):
+    return BatchManifest(folder, engine_version, lexicon_version, lexicon)
+
+
+def test_unchanged_input_is_current(tmp_path):
+    recorded_manifest(str(tmp_path))
+    manifest = reopened(str(tmp_path))
+    assert manifest.is_current('/data/in.html', BatchManifest.content_hash(DOCUMENT), DOCUMENT)
+
+
+def test_changed_content_engine_or_missing_output_is_stale(tmp_path):
+    folder = str(tmp_path)
+    recorded_manifest(folder)
+    edited = DOCUMENT + '<p>Amiodarone</p>'
+    assert not reopened(folder).is_current('/data/in.html', BatchManifest.content_hash(edited), edited)
+    assert not reopened(folder, engine_version='9.9.9').is_current(
+        '/data/in.html', BatchManifest.content_hash(DOCUMENT), DOCUMENT)
+    os.remove(os.path.join(folder, 'in_medications.json'))
+    assert not reopened(folder).is_current('/data/in.html', BatchManifest.content_hash(DOCUMENT), DOCUMENT)
+
+
+def test_lexicon_change_only_invalidates_documents_with_changed_terms(tmp_path):
+    folder = str(tmp_path)
+    recorded_manifest(folder)
+    content_hash = BatchManifest.content_hash(DOCUMENT)
+    # amiodarone's entry changed: the document never mentions it, so its output still holds
+    unrelated = dict(LEXICON_V1, amiodarone=['h-amiodarone-2', ['amiodarone', 'cordarone', 'nexterone']])
+    assert reopened(folder, 'v2', unrelated).is_current('/data/in.html', content_hash, DOCUMENT)
+    # atenolol's entry changed and the document mentions atenolol
+    related = dict(LEXICON_V1, atenolol=['h-atenolol-2', ['atenolol', 'tenormin']])
+    assert not reopened(folder, 'v3', related).is_current('/data/in.html', content_hash, DOCUMENT)
+
+
+def test_reordered_lexicon_invalidates_everything(tmp_path):
+    folder = str(tmp_path)
+    recorded_manifest(folder)
+    reordered = {'atenolol': LEXICON_V1['atenolol'], 'amiodarone': LEXICON_V1['amiodarone']}
+    assert not reopened(folder, 'v2', reordered).is_current(
+        '/data/in.html', BatchManifest.content_hash(DOCUMENT), DOCUMENT)
+
+
+def test_resumed_batch_skips_finished_inputs(pipeline, corpus_sample, tmp_path, capsys):
+    input_folder, output_folder = tmp_path / 'in', tmp_path / 'out'
+    input_folder.mkdir()
+    for file_name, html_text in corpus_sample[:4]:
+        (input_folder / file_name).write_text(html_text, encoding='utf-8')
+    pipeline.process_batch(str(input_folder), str(output_folder))
+    outputs = sorted(p for p in os.listdir(output_folder) if p != BatchManifest.FILENAME)
+    assert len(outputs) == 4
+    modified = {name: os.path.getmtime(output_folder / name) for name in outputs}
+    capsys.readouterr()
+
+    pipeline.process_batch(str(input_folder), str(output_folder))
+    assert 'Skipped 4 files' in capsys.readouterr().out
+    assert {name: os.path.getmtime(output_folder / name) for name in outputs} == modified
+
+    # Only the edited input is extracted again
+    edited = corpus_sample[0][0]
+    (input_folder / edited).write_text(corpus_sample[0][1] + '<p>atenolol</p>', encoding='utf-8')
+    pipeline.process_batch(str(input_folder), str(output_folder))
+    assert 'Skipped 3 files' in capsys.readouterr().out
+
+
+def test_concurrent_records_save_once_per_batch(tmp_path):
+    manifest = BatchManifest(str(tmp_path), '2.1.1', 'v1', LEXICON_V1)
+    writes = []
+    write = manifest._write
+    manifest._write = lambda snapshot: (writes.append(len(snapshot[1]['files'])), write(snapshot))
+
+    def record(worker):
+        for i in range(50):
+            manifest.record(f'/data/{worker}-{i}.html', str(i), 'in_medications.json')
+
+    threads = [threading.Thread(target=record, args=(worker,)) for worker in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(writes) == [n * BatchManifest.SAVE_EVERY for n in range(1, 17)]
+    assert len(reopened(str(tmp_path)).files) == 400
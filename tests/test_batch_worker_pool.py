@@ -0,0 +1,69 @@
+import io
+import json
+import os
+import signal
+import time
+
+import pytest
+
+pytest.importorskip('flask')
+pytest.importorskip('flask_cors')
+
+import api_server
+from result_cache import ResultCache
+
+
+@pytest.fixture
+def client(batch_pool):
+    return api_server.app.test_client()
+
+
+def post_batch(client, monkeypatch, documents, workers):
+    monkeypatch.setattr(api_server, 'BATCH_WORKERS', workers)
+    monkeypatch.setattr(api_server, 'result_cache', ResultCache(1 << 20))
+    files = [(io.BytesIO(html_text.encode('utf-8')), name) for name, html_text in documents]
+    response = client.post('/process-batch', data={'file': files})
+    assert response.status_code == 200
+    lines = sorted((json.loads(line) for line in response.get_data(as_text=True).splitlines()),
+                   key=lambda line: line['index'])
+    return [(line['success'], line['filename'], line.get('annotations')) for line in lines]
+
+
+def test_batch_on_workers_matches_the_in_process_batch(client, monkeypatch, corpus_sample):
+    documents = corpus_sample[:8]
+    assert post_batch(client, monkeypatch, documents, 2) == post_batch(client, monkeypatch, documents, 1)
+
+
+def test_pool_is_rebuilt_after_its_workers_die(client, monkeypatch, corpus_sample):
+    documents = corpus_sample[:8]
+    expected = post_batch(client, monkeypatch, documents, 1)
+    assert post_batch(client, monkeypatch, documents, 2) == expected
+    pool = api_server.batch_pool
+    executor = pool._executor
+    for pid in list(pool._worker_pids[executor]):
+        os.kill(pid, signal.SIGKILL)
+    time.sleep(0.5)
+    # The dead pool fails the next submit or its futures; either way the batch goes to a fresh pool
+    assert post_batch(client, monkeypatch, documents, 2) == expected
+    assert pool._executor is not executor
+
+
+def test_documents_in_flight_are_retried_when_a_worker_dies(client, monkeypatch, corpus_sample):
+    documents = corpus_sample[:8]
+    expected = post_batch(client, monkeypatch, documents, 1)
+    pool = api_server.batch_pool
+    submit = pool.submit
+    killed = []
+
+    def submit_then_kill(*args):
+        executor, future = submit(*args)
+        if not killed:
+            future.result()  # workers are up and have reported their PIDs
+            for pid in list(pool._worker_pids[executor]):
+                os.kill(pid, signal.SIGKILL)
+            killed.append(executor)
+        return executor, future
+
+    monkeypatch.setattr(pool, 'submit', submit_then_kill)
+    assert post_batch(client, monkeypatch, documents, 2) == expected
+    assert killed and pool._executor is not killed[0]
@@ -0,0 +1,61 @@
+import os
+
+from main import CompactLexicon, MedicationExtractionPipeline, RxNormMapper
+from conftest import LEXICON_CSV
+
+
+def conso(rx_cui, tty, name, sab='RXNORM', lat='ENG', suppress='N'):
+    # RXCUI|LAT|TS|LUI|STT|SUI|ISPREF|RXAUI|SAUI|SCUI|SDUI|SAB|TTY|CODE|STR|SRL|SUPPRESS|CVF|
+    return f"{rx_cui}|{lat}||||||||||{sab}|{tty}||{name}||{suppress}||\n"
+
+
+def rel(cui1, rela, cui2):
+    # RXCUI1|RXAUI1|STYPE1|REL|RXCUI2|RXAUI2|STYPE2|RELA|RUI|SRUI|SAB|SL|DIR|RG|SUPPRESS|CVF|
+    return f"{cui1}|||RN|{cui2}|||{rela}|||RXNORM||||||\n"
+
+
+def write_rrf(rrf_dir, lexicon):
+    """RRF files holding the CSV lexicon, plus atoms and relations ingestion must skip"""
+    conso_lines, rel_lines, brand_cuis = [], [], {}
+    for i, (name, info) in enumerate(lexicon.items()):
+        conso_lines.append(conso(info['rx_cui'], info['cui_type'], name.title()))
+        for brand in info['brand_names']:
+            if brand not in brand_cuis:
+                brand_cuis[brand] = 9000000 + len(brand_cuis)
+                conso_lines.append(conso(brand_cuis[brand], 'BN', brand.upper()))
+            # Releases differ in which side of the tradename relation is the brand
+            if i % 2:
+                rel_lines.append(rel(info['rx_cui'], 'has_tradename', brand_cuis[brand]))
+            else:
+                rel_lines.append(rel(brand_cuis[brand], 'tradename_of', info['rx_cui']))
+        conso_lines += [conso(8000000 + i, 'IN', name + ' old', suppress='O'),
+                        conso(8100000 + i, 'IN', name + ' es', lat='SPA'),
+                        conso(8200000 + i, 'SCD', name + ' 10 mg oral tablet'),
+                        conso(8300000 + i, 'IN', name, sab='MTHSPL')]
+    conso_lines.append(conso(1, 'IN', next(iter(lexicon)).upper()))  # later duplicate atom: first wins
+    with open(os.path.join(rrf_dir, 'RXNCONSO.RRF'), 'w', encoding='utf-8') as f:
+        f.writelines(conso_lines)
+    with open(os.path.join(rrf_dir, 'RXNREL.RRF'), 'w', encoding='utf-8') as f:
+        f.writelines(rel_lines)
+
+
+def test_rrf_lexicon_round_trips_to_the_csv_lexicon(tmp_path):
+    csv_mapper = RxNormMapper(LEXICON_CSV)
+    write_rrf(tmp_path, csv_mapper.rxnorm_db)
+    path = str(tmp_path / 'rxnorm.rxlex')
+    CompactLexicon.from_rrf(str(tmp_path)).save(path)
+    assert CompactLexicon.is_compact(path) and not CompactLexicon.is_compact(LEXICON_CSV)
+    compact = CompactLexicon.load(path)
+    assert list(compact.items()) == list(csv_mapper.rxnorm_db.items())
+    compact_mapper = RxNormMapper(path)
+    assert compact_mapper.lexicon_version == csv_mapper.lexicon_version
+    assert compact_mapper.brand_to_generic == csv_mapper.brand_to_generic
+
+
+def test_pipeline_on_compact_lexicon_matches_csv_pipeline(tmp_path, pipeline, corpus_sample):
+    write_rrf(tmp_path, pipeline.rxnorm_mapper.rxnorm_db)
+    path = str(tmp_path / 'rxnorm.rxlex')
+    CompactLexicon.from_rrf(str(tmp_path)).save(path)
+    compact_pipeline = MedicationExtractionPipeline(path)
+    for name, html_text in corpus_sample:
+        assert compact_pipeline.process_document(name, html_text) == pipeline.process_document(name, html_text)
@@ -0,0 +1,42 @@
+import random
+
+from main import DocumentCueIndex, DocumentWindowView, LocalMedicationLLM, NonActiveRuleBank
+
+CUE_GROUPS = (LocalMedicationLLM.NON_ACTIVE_WORDS, LocalMedicationLLM.TABLE_INDICATORS,
+              LocalMedicationLLM.STOP_KEYWORDS, LocalMedicationLLM.MAINTAIN_CUE)
+
+
+def test_index_answers_like_window_slicing():
+    rng = random.Random(3)
+    words = ['Stopped', 'metoprolol', 'MAINTAIN', 'no longer', 'taking', '<td>', 'before', 'old', 'x', 'dc']
+    text = ' '.join(rng.choice(words) for _ in range(2000))
+    spans = []
+    for _ in range(30):
+        start = rng.randrange(len(text) - 20)
+        spans.append((start, start + rng.randint(3, 12)))
+    reach = 60
+    index = DocumentCueIndex.build(text, spans, reach)
+    legacy = DocumentWindowView(text)
+    rules = NonActiveRuleBank('metoprolol')
+    for start, end in spans:
+        for window in ((max(0, start - reach), min(len(text), end + reach)), (max(0, start - 25), start),
+                       (start, end)):
+            assert index.lowered_slice(*window) == legacy.lowered_slice(*window)
+            for cues in CUE_GROUPS:
+                assert index.has_cue(cues, *window) == legacy.has_cue(cues, *window), (cues, window)
+            for group in rules.patterns:
+                assert index.rule_matches(rules, group, *window) == legacy.rule_matches(rules, group, *window)
+
+
+def test_unsafe_lowering_falls_back():
+    # 'İ'.lower() is two characters, so offsets in a lowered region would shift
+    assert DocumentCueIndex.build('İ stopped aspirin', [(10, 17)], 50) is None
+
+
+def test_extractor_cue_index_matches_window_slicing(pipeline, corpus_sample):
+    """The per-document index labels every mention of real records as slicing each window did"""
+    lexicon = pipeline.rxnorm_mapper.rxnorm_db
+    indexed = LocalMedicationLLM(lexicon, use_cue_index=True)
+    legacy = LocalMedicationLLM(lexicon, use_cue_index=False)
+    for _, html_text in corpus_sample:
+        assert indexed.extract_medications(html_text) == legacy.extract_medications(html_text)
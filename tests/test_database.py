@@ -0,0 +1,222 @@
+"""PostgresPool, PooledSession and execute_pooled against a stub ThreadedConnectionPool: no server (or flask) needed"""
+import threading
+
+import pytest
+
+psycopg2 = pytest.importorskip('psycopg2')
+import psycopg2.extensions
+import psycopg2.pool
+
+from database import DatabaseUnavailable, PooledSession, PostgresPool, execute_pooled
+
+
+class StubCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, query, params=None):
+        self.conn.in_transaction = True
+        self.conn.statements.append((query, params))
+        if 'missing_table' in query:
+            raise psycopg2.ProgrammingError('relation "missing_table" does not exist')
+
+    def fetchone(self):
+        return self.conn.rows[0] if self.conn.rows else None
+
+    def fetchall(self):
+        return self.conn.rows
+
+    def close(self):
+        pass
+
+
+class StubConnection:
+    def __init__(self, rows):
+        self.rows = rows
+        self.closed = 0
+        self.in_transaction = False
+        self.statements = []
+        self.commits = self.rollbacks = 0
+        self.broken = False
+
+    def cursor(self):
+        return StubCursor(self)
+
+    def get_transaction_status(self):
+        return psycopg2.extensions.TRANSACTION_STATUS_INTRANS if self.in_transaction else \
+            psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def commit(self):
+        self.in_transaction = False
+        self.commits += 1
+
+    def rollback(self):
+        if self.broken:
+            raise psycopg2.InterfaceError('connection already closed')
+        self.in_transaction = False
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = 1
+
+
+class StubThreadedConnectionPool:
+    """Raises PoolError when maxconn connections are out, like psycopg2's"""
+
+    def __init__(self, minconn, maxconn, dsn, **connect_kwargs):
+        self.maxconn = maxconn
+        self.idle = []
+        self.out = []
+        self.lock = threading.Lock()
+        self.most_out = 0
+        self.checkouts = 0
+        self.rows = [('row',)]  # what every query on a new connection returns
+
+    def getconn(self):
+        with self.lock:
+            if len(self.out) >= self.maxconn:
+                raise psycopg2.pool.PoolError('connection pool exhausted')
+            conn = self.idle.pop() if self.idle else StubConnection(self.rows)
+            self.checkouts += 1
+            self.out.append(conn)
+            self.most_out = max(self.most_out, len(self.out))
+            return conn
+
+    def putconn(self, conn, close=False):
+        with self.lock:
+            self.out.remove(conn)
+            if close:
+                conn.close()
+            else:
+                self.idle.append(conn)
+
+    def closeall(self):
+        pass
+
+
+@pytest.fixture
+def make_pool(monkeypatch):
+    monkeypatch.setattr(psycopg2.pool, 'ThreadedConnectionPool', StubThreadedConnectionPool)
+
+    def make(maxconn=2, timeout=0.5):
+        return PostgresPool(1, maxconn, timeout, 30.0, 'postgresql://stub')
+    return make
+
+
+def test_each_query_returns_its_connection(make_pool):
+    pool = make_pool()
+    assert execute_pooled(pool, 'SELECT name FROM users WHERE username = ?', ('ann',), fetch_one=True,
+                          statement_timeout_ms=5000) == ('row',)
+    assert execute_pooled(pool, 'SELECT name FROM users', fetch_all=True) == [('row',)]
+    assert pool.pool.out == [] and len(pool.pool.idle) == 1
+    conn = pool.pool.idle[0]
+    # The first checkout pinged the new connection
+    assert conn.statements == [('SELECT 1', None), ('SET LOCAL statement_timeout = %s', (5000,)),
+                               ('SELECT name FROM users WHERE username = %s', ('ann',)),
+                               ('SELECT name FROM users', None)]
+    assert conn.commits == 2 and not conn.in_transaction
+
+
+def test_failed_query_is_rolled_back_and_returned(make_pool):
+    pool = make_pool()
+    assert execute_pooled(pool, 'SELECT * FROM missing_table', fetch_one=True) is None
+    conn, = pool.pool.idle
+    assert conn.rollbacks == 2 and not conn.closed and pool.pool.out == []  # the ping's and the query's
+
+
+def test_connection_that_cannot_roll_back_is_discarded(make_pool):
+    pool = make_pool()
+    conn = pool.getconn()
+    pool.putconn(conn)
+    conn.broken = True
+    assert execute_pooled(pool, 'SELECT * FROM missing_table') is None
+    assert conn.closed and pool.pool.out == [] and pool.pool.idle == []
+
+
+def test_exhausted_pool_raises_database_unavailable(make_pool):
+    pool = make_pool(maxconn=1, timeout=0.1)
+    held = pool.getconn()
+    with pytest.raises(DatabaseUnavailable):
+        execute_pooled(pool, 'SELECT 1', fetch_one=True)
+    pool.putconn(held)
+    assert execute_pooled(pool, 'SELECT 1', fetch_one=True) == ('row',)
+
+
+def test_session_reuses_one_connection_until_released(make_pool):
+    pool = make_pool()
+    session = PooledSession(pool, statement_timeout_ms=5000)
+    assert session.execute('SELECT 1', fetch_one=True) == ('row',)
+    assert session.execute('SELECT * FROM missing_table') is None
+    assert session.execute('SELECT 2', fetch_all=True) == [('row',)]
+    assert pool.pool.checkouts == 1 and len(pool.pool.out) == 1
+    conn = session.conn
+    assert conn.commits == 2 and conn.rollbacks == 2 and not conn.in_transaction
+    session.release()
+    session.release()
+    assert pool.pool.out == [] and pool.pool.idle == [conn]
+
+
+def test_concurrent_queries_share_a_small_pool(make_pool):
+    pool = make_pool(maxconn=2, timeout=5)
+    results = []
+
+    def run():
+        for _ in range(50):
+            results.append(execute_pooled(pool, 'SELECT 1', fetch_one=True))
+
+    threads = [threading.Thread(target=run) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [('row',)] * 400
+    assert pool.pool.most_out <= 2 and pool.pool.out == []
+
+
+def test_unavailable_database_answers_503_not_401(make_pool, monkeypatch):
+    pytest.importorskip('flask')
+    pytest.importorskip('flask_cors')
+    import api_server
+    pool = make_pool(maxconn=1, timeout=0.1)
+    pool.pool.rows = []  # no accounts
+    monkeypatch.setattr(api_server, 'DATABASE_URL', 'postgresql://stub')
+    monkeypatch.setattr(api_server, 'db_pool', pool)
+    monkeypatch.setattr(api_server, 'EXTRACTION_MODE', 'inprocess')
+    client = api_server.app.test_client()
+    held = pool.getconn()
+    assert client.post('/jobs', auth=('ann', 'secret')).status_code == 503
+    pool.putconn(held)
+    # With the database back, unknown credentials are a 401
+    assert client.post('/jobs', auth=('ann', 'secret')).status_code == 401
+    assert pool.pool.out == []
+
+
+def test_request_queries_share_one_connection(make_pool, monkeypatch):
+    pytest.importorskip('flask')
+    pytest.importorskip('flask_cors')
+    import api_server
+    pool = make_pool()
+    pool.pool.rows = []  # no accounts yet
+    monkeypatch.setattr(api_server, 'DATABASE_URL', 'postgresql://stub')
+    monkeypatch.setattr(api_server, 'db_pool', pool)
+    client = api_server.app.test_client()
+    account = {'username': 'ann', 'email': 'ann@example.org', 'password': 'secret', 'name': 'Ann'}
+    assert client.post('/users/register', json=account).status_code == 200
+    # Three account lookups and the insert on one checkout, returned when the request ended
+    assert pool.pool.checkouts == 1 and pool.pool.out == []
+    assert len(pool.pool.idle[0].statements) == 1 + 4 * 2  # ping, then SET LOCAL + statement each
+
+
+@pytest.mark.parametrize('path', ['/users/register', '/users/login'])
+def test_account_endpoints_answer_503_without_a_database(make_pool, monkeypatch, path):
+    pytest.importorskip('flask')
+    pytest.importorskip('flask_cors')
+    import api_server
+    pool = make_pool(maxconn=1, timeout=0.1)
+    monkeypatch.setattr(api_server, 'DATABASE_URL', 'postgresql://stub')
+    monkeypatch.setattr(api_server, 'db_pool', pool)
+    client = api_server.app.test_client()
+    held = pool.getconn()
+    account = {'username': 'ann', 'email': 'ann@example.org', 'password': 'secret', 'name': 'Ann'}
+    assert client.post(path, json=account).status_code == 503
+    pool.putconn(held)
@@ -0,0 +1,110 @@
+import json
+import threading
+import time
+
+import pytest
+
+from extraction_jobs import DONE, JobQueue, QueueFull
+
+
+class Recorder:
+    """JobQueue handler that records the order documents run in and can hold them"""
+
+    def __init__(self):
+        self.order = []
+        self.release = threading.Event()
+        self.started = threading.Semaphore(0)
+        self._lock = threading.Lock()
+
+    def __call__(self, job, filename, html_text):
+        with self._lock:
+            self.order.append(filename)
+        self.started.release()
+        assert self.release.wait(10)
+        return {'filename': filename}
+
+
+def wait_done(queue, jobs):
+    for job in jobs:
+        for _ in range(1000):
+            if queue.get(job.id).status == DONE:
+                break
+            time.sleep(0.01)
+        assert queue.get(job.id).status == DONE
+
+
+def test_pending_jobs_run_in_priority_order():
+    handler = Recorder()
+    queue = JobQueue(handler, workers=1, per_user_limit=5)
+    queue.start()
+    first = queue.submit([('first', '')], 'u1')
+    assert handler.started.acquire(timeout=5)  # the only worker is now busy
+    jobs = [queue.submit([('bulk', '')], 'u1', 'bulk'),
+            queue.submit([('normal-1', '')], 'u1', 'normal'),
+            queue.submit([('interactive', '')], 'u1', 'interactive'),
+            queue.submit([('normal-2', '')], 'u1', 'normal')]
+    handler.release.set()
+    wait_done(queue, [first] + jobs)
+    assert handler.order == ['first', 'interactive', 'normal-1', 'normal-2', 'bulk']
+
+
+def test_running_jobs_are_capped_per_user():
+    handler = Recorder()
+    queue = JobQueue(handler, workers=2, per_user_limit=1)
+    queue.start()
+    jobs = [queue.submit([('alice-1', '')], 'alice', 'interactive'),
+            queue.submit([('alice-2', '')], 'alice', 'interactive'),
+            queue.submit([('bob-1', '')], 'bob', 'bulk')]
+    assert handler.started.acquire(timeout=5) and handler.started.acquire(timeout=5)
+    # alice's second job waits for her first even though a worker is free for a lower priority
+    assert sorted(handler.order) == ['alice-1', 'bob-1']
+    assert queue.stats()['queued'] == 1
+    handler.release.set()
+    wait_done(queue, jobs)
+    assert handler.order[-1] == 'alice-2'
+
+
+def test_submit_rejects_bad_input_and_full_queues():
+    queue = JobQueue(Recorder(), workers=1, max_pending=2, max_bytes=1 << 20)  # not started
+    with pytest.raises(ValueError):
+        queue.submit([('a', '')], 'u1', 'urgent')
+    with pytest.raises(ValueError):
+        queue.submit([], 'u1')
+    with pytest.raises(ValueError):
+        queue.submit([('huge', 'x' * ((1 << 20) + 1))], 'u1')
+    queue.submit([('a', '')], 'u1')
+    queue.submit([('b', '')], 'u2')
+    with pytest.raises(QueueFull):
+        queue.submit([('c', '')], 'u3')
+
+
+def test_queued_bytes_are_bounded_and_finished_jobs_make_room():
+    queue = JobQueue(lambda job, filename, html_text: {'text': html_text}, workers=1, max_bytes=30000)
+    queue.start()
+    first = queue.submit([('a', 'x' * 9000)], 'u1')
+    wait_done(queue, [first])
+    second = queue.submit([('b', 'x' * 9000)], 'u1')
+    wait_done(queue, [second])
+    # Both finished jobs' results are held; the oldest is forgotten to fit the next job
+    queue.submit([('c', 'x' * 12000)], 'u1')
+    assert queue.get(first.id) is None
+    assert queue.get(second.id) is not None
+    assert queue.stats()['held_bytes'] <= 30000
+
+
+def test_queued_bytes_full_when_nothing_can_be_forgotten():
+    queue = JobQueue(Recorder(), workers=1, max_bytes=30000)  # not started: jobs stay queued
+    queue.submit([('a', 'x' * 20000)], 'u1')
+    with pytest.raises(QueueFull):
+        queue.submit([('b', 'x' * 20000)], 'u2')
+
+
+def test_job_size_counts_utf8_bytes_before_and_after():
+    queue = JobQueue(lambda job, filename, html_text: {'text': html_text}, workers=1)
+    document = 'Lévothyroxine 50 µg'
+    job = queue.submit([('a', document)], 'u1')
+    assert job.size == len(document.encode('utf-8')) == queue.stats()['held_bytes']
+    queue.start()
+    wait_done(queue, [job])
+    assert job.size == len(json.dumps({'text': document}, separators=(',', ':')).encode('utf-8'))
+    assert queue.stats()['held_bytes'] == job.size
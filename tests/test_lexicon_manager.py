@@ -0,0 +1,76 @@
+import io
+import os
+from concurrent.futures import Future
+
+import pytest
+
+pytest.importorskip('flask')
+pytest.importorskip('flask_cors')
+
+import api_server
+from main import MappedLexiconFile, MedicationExtractionPipeline
+from result_cache import ResultCache
+
+DOCUMENT = '<p>Currently taking apixaban 5 mg twice a day and aspirin 81 mg daily.</p>'
+
+
+def drop_entry(source, generic):
+    with open(source, 'r', encoding='utf-8') as f:
+        lines = f.readlines()
+    with open(source, 'w', encoding='utf-8') as f:
+        f.writelines(line for line in lines if not line.lower().startswith(generic + ','))
+
+
+def generics(pipeline):
+    return {med['normalized_name'] for med in pipeline.process_document('doc.html', DOCUMENT)['medications']}
+
+
+def test_loaded_lexicon_matches_csv_pipeline(lexicon_manager, pipeline, corpus_sample):
+    active = lexicon_manager.current()
+    assert active['version'] == pipeline.rxnorm_mapper.lexicon_version
+    for name, html_text in corpus_sample:
+        assert active['pipeline'].process_document(name, html_text) == pipeline.process_document(name, html_text)
+
+
+def test_reload_swaps_versions_without_touching_snapshots(lexicon_manager):
+    before = lexicon_manager.current()
+    assert lexicon_manager.reload(wait=True)
+    assert lexicon_manager.current() is before  # unchanged source: nothing rebuilt
+
+    drop_entry(lexicon_manager.source_path, 'apixaban')
+    lexicon_manager.reload(wait=True)
+    after = lexicon_manager.current()
+    assert lexicon_manager.last_error is None
+    assert after['version'] != before['version'] and after['path'] != before['path']
+    # A request that took its snapshot before the reload keeps the old lexicon
+    assert 'apixaban' in generics(before['pipeline'])
+    assert 'apixaban' not in generics(after['pipeline'])
+    # and the old file still opens (for new batch workers) although the source changed
+    MappedLexiconFile(before['path']).close()
+    assert generics(MedicationExtractionPipeline(before['path'])) == generics(before['pipeline'])
+
+
+def test_large_uploads_run_on_a_batch_worker(batch_pool, monkeypatch):
+    client = api_server.app.test_client()
+
+    def post(max_bytes, timeout=60):
+        monkeypatch.setattr(api_server, 'INPROCESS_MAX_BYTES', max_bytes)
+        monkeypatch.setattr(api_server, 'DOCUMENT_TIMEOUT', timeout)
+        monkeypatch.setattr(api_server, 'result_cache', ResultCache(1 << 20))
+        return client.post('/process-document', data={'file': (io.BytesIO(DOCUMENT.encode('utf-8')), 'doc.html')})
+
+    in_process, in_worker = post(1 << 20), post(0)
+    assert in_process.status_code == in_worker.status_code == 200
+    assert in_worker.headers['X-Cache'] == 'MISS'
+    assert in_worker.get_json()['annotations'] == in_process.get_json()['annotations']
+    worker_pids = list(batch_pool._worker_pids[batch_pool._executor])
+    assert worker_pids and os.getpid() not in worker_pids
+
+    # A document that never finishes: the request gives up and the batch_pool is killed
+    stuck = batch_pool._executor
+    with monkeypatch.context() as m:
+        m.setattr(batch_pool, 'submit', lambda *args: (stuck, Future()))
+        timed_out = post(0, timeout=0.05)
+    assert timed_out.status_code == 504
+    assert batch_pool._executor is None and stuck not in batch_pool._worker_pids
+    assert post(0).get_json()['annotations'] == in_process.get_json()['annotations']
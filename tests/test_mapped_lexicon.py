@@ -0,0 +1,55 @@
+import shutil
+
+import pytest
+
+from main import LexiconArtifact, MappedAhoCorasickMatcher, MappedLexiconFile, MedicationExtractionPipeline
+from conftest import LEXICON_CSV
+
+
+@pytest.fixture(scope='module')
+def mapped_path(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('lexicon') / 'lexicon.lexmap')
+    MappedLexiconFile.compile(LEXICON_CSV, path)
+    return path
+
+
+def test_mapped_tables_match_the_csv_lexicon(mapped_path, pipeline):
+    mapper = pipeline.rxnorm_mapper
+    with MappedLexiconFile(mapped_path) as lexicon_file:
+        artifact = lexicon_file.as_artifact()
+        assert list(artifact['rxnorm_db'].items()) == list(mapper.rxnorm_db.items())
+        assert dict(artifact['brand_to_generic'].items()) == mapper.brand_to_generic
+        assert dict(artifact['entry_hashes'].items()) == mapper.entry_hashes
+        assert artifact['lexicon_version'] == mapper.lexicon_version
+
+
+def test_mapped_matcher_finds_what_the_built_matcher_finds(mapped_path, pipeline, corpus_sample):
+    built = pipeline.medication_extractor.matcher
+    with MappedLexiconFile(mapped_path) as lexicon_file:
+        mapped = MappedAhoCorasickMatcher(lexicon_file)
+        for _, html_text in corpus_sample:
+            lowered = html_text.lower()
+            matches = mapped.find_all(lowered)
+            assert matches == built.find_all(lowered)
+            for pattern_id in {pattern_id for pattern_id, _ in matches}:
+                assert mapped.patterns[pattern_id] == built.patterns[pattern_id]
+
+
+def test_pipeline_on_mapped_lexicon_matches_csv_pipeline(mapped_path, pipeline, corpus_sample):
+    mapped_pipeline = MedicationExtractionPipeline(mapped_path)
+    for name, html_text in corpus_sample:
+        assert mapped_pipeline.process_document(name, html_text) == pipeline.process_document(name, html_text)
+
+
+def test_changed_source_is_rejected(tmp_path):
+    csv_path, mapped, pickled = (str(tmp_path / name) for name in ('lexicon.csv', 'lexicon.lexmap', 'lexicon.lexicon'))
+    shutil.copyfile(LEXICON_CSV, csv_path)
+    MappedLexiconFile.compile(csv_path, mapped)
+    LexiconArtifact.compile(csv_path, pickled)
+    MappedLexiconFile(mapped).close()
+    with open(csv_path, 'a', encoding='utf-8') as f:
+        f.write('\n')
+    with pytest.raises(ValueError, match='changed since'):
+        MappedLexiconFile(mapped)
+    with pytest.raises(ValueError, match='changed since'):
+        LexiconArtifact.load(pickled)
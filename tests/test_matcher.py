@@ -0,0 +1,58 @@
+import random
+
+import pytest
+
+from main import AhoCorasickMatcher, LocalMedicationLLM
+
+
+def find_all_by_find(patterns, text):
+    """Reference: repeated str.find() per pattern, resuming after each match"""
+    matches = []
+    for pattern_id, pattern in enumerate(patterns):
+        idx = text.find(pattern)
+        while idx != -1:
+            matches.append((pattern_id, idx))
+            idx = text.find(pattern, idx + len(pattern))
+    return sorted(matches)
+
+
+def test_overlapping_and_nested_patterns():
+    patterns = ['aa', 'aaa', 'a', 'ab', 'bab', 'metoprolol', 'olol']
+    matcher = AhoCorasickMatcher()
+    for pattern in patterns:
+        matcher.add_pattern(pattern, {})
+    text = 'aaaabababx metoprolol succinate, propranolol'
+    assert matcher.find_all(text) == find_all_by_find(patterns, text)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_random_patterns_match_find(seed):
+    rng = random.Random(seed)
+    patterns = sorted({''.join(rng.choice('abc ') for _ in range(rng.randint(1, 5))) for _ in range(30)})
+    text = ''.join(rng.choice('abcd ') for _ in range(500))
+    matcher = AhoCorasickMatcher()
+    for pattern in patterns:
+        matcher.add_pattern(pattern, {'pattern': pattern})
+    assert matcher.find_all(text) == find_all_by_find(patterns, text)
+
+
+def test_state_round_trip():
+    matcher = AhoCorasickMatcher()
+    for pattern in ('lisinopril', 'pril', 'sin'):
+        matcher.add_pattern(pattern, {})
+    restored = AhoCorasickMatcher.from_state(matcher.to_state())
+    text = 'lisinopril and enalapril'
+    assert restored.find_all(text) == matcher.find_all(text)
+
+
+def test_extractor_automaton_matches_find_loops(pipeline, corpus_sample):
+    """The single automaton pass finds exactly the mentions of the find() loops on real records"""
+    lexicon = pipeline.rxnorm_mapper.rxnorm_db
+    automaton = LocalMedicationLLM(lexicon, use_automaton=True)
+    find_loops = LocalMedicationLLM(lexicon, use_automaton=False)
+    mentions = 0
+    for _, html_text in corpus_sample:
+        expected = find_loops.extract_medications(html_text, classify=False)
+        assert automaton.extract_medications(html_text, classify=False) == expected
+        mentions += len(expected)
+    assert mentions > 0
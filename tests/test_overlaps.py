@@ -0,0 +1,47 @@
+import random
+
+import pytest
+
+from main import LocalMedicationLLM
+
+
+def resolve_overlaps_by_scan(medications):
+    """Reference: compare every candidate with every span kept so far"""
+    order = sorted(
+        (i for i, med in enumerate(medications) if len(med['text']) > 2),
+        key=lambda i: (medications[i]['start_offset'] - medications[i]['end_offset'],
+                       -medications[i].get('confidence', 0), medications[i]['start_offset'], i))
+    kept = []
+    for i in order:
+        start, end = medications[i]['start_offset'], medications[i]['end_offset']
+        if all(end <= medications[k]['start_offset'] or medications[k]['end_offset'] <= start for k in kept):
+            kept.append(i)
+    return [medications[i] for i in sorted(kept)]
+
+
+def mention(start, end, confidence=0.98):
+    return {'text': 'x' * (end - start), 'start_offset': start, 'end_offset': end, 'confidence': confidence}
+
+
+def test_longest_then_most_confident_wins():
+    medications = [
+        mention(0, 9, 0.98),     # 'metformin'
+        mention(0, 25, 0.97),    # 'metformin / sitagliptin'
+        mention(12, 25, 0.98),   # 'sitagliptin'
+        mention(30, 38, 0.96),
+        mention(30, 38, 0.98),
+        mention(40, 42),         # too short
+        mention(38, 45),         # touches, does not overlap
+    ]
+    resolved = LocalMedicationLLM._resolve_overlaps(medications)
+    assert resolved == [medications[1], medications[4], medications[6]]
+
+
+@pytest.mark.parametrize('seed', range(50))
+def test_random_spans_match_reference(seed):
+    rng = random.Random(seed)
+    medications = []
+    for _ in range(rng.randint(0, 60)):
+        start = rng.randint(0, 200)
+        medications.append(mention(start, start + rng.randint(1, 30), rng.choice((0.95, 0.96, 0.97, 0.98))))
+    assert LocalMedicationLLM._resolve_overlaps(medications) == resolve_overlaps_by_scan(medications)
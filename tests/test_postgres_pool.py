@@ -0,0 +1,88 @@
+"""PostgresPool against a real server: set TEST_DATABASE_URL to run these (they are skipped otherwise)"""
+import os
+import threading
+import time
+
+import pytest
+
+psycopg2 = pytest.importorskip('psycopg2')
+TEST_DATABASE_URL = os.environ.get('TEST_DATABASE_URL')
+pytestmark = pytest.mark.skipif(not TEST_DATABASE_URL, reason='TEST_DATABASE_URL not set')
+
+
+@pytest.fixture
+def make_pool():
+    from database import PostgresPool
+    pools = []
+
+    def make(maxconn=2, timeout=0.5, check_idle=30.0):
+        pool = PostgresPool(1, maxconn, timeout, check_idle, TEST_DATABASE_URL)
+        pools.append(pool)
+        return pool
+
+    yield make
+    for pool in pools:
+        pool.pool.closeall()
+
+
+def backend_pid(conn):
+    cursor = conn.cursor()
+    cursor.execute('SELECT pg_backend_pid()')
+    pid = cursor.fetchone()[0]
+    conn.rollback()
+    return pid
+
+
+def test_checkout_waits_for_a_returned_connection(make_pool):
+    pool = make_pool(maxconn=1, timeout=5)
+    conn = pool.getconn()
+    threading.Timer(0.2, pool.putconn, (conn,)).start()
+    assert pool.getconn() is conn
+
+
+def test_checkout_times_out_when_exhausted(make_pool):
+    pool = make_pool(maxconn=1, timeout=0.2)
+    pool.getconn()
+    with pytest.raises(psycopg2.pool.PoolError):
+        pool.getconn()
+
+
+def test_discarded_connection_is_closed_and_replaced(make_pool):
+    pool = make_pool(maxconn=1)
+    conn = pool.getconn()
+    pid = backend_pid(conn)
+    pool.putconn(conn, discard=True)
+    assert conn.closed
+    replacement = pool.getconn()
+    assert backend_pid(replacement) != pid
+
+
+def test_dead_idle_connection_is_discarded_on_checkout(make_pool):
+    pool = make_pool(maxconn=1, check_idle=0)
+    conn = pool.getconn()
+    pid = backend_pid(conn)
+    pool.putconn(conn)
+    killer = psycopg2.connect(TEST_DATABASE_URL)
+    killer.autocommit = True
+    try:
+        cursor = killer.cursor()
+        cursor.execute('SELECT pg_terminate_backend(%s)', (pid,))
+        for _ in range(100):  # wait for the backend to exit
+            cursor.execute('SELECT count(*) FROM pg_stat_activity WHERE pid = %s', (pid,))
+            if not cursor.fetchone()[0]:
+                break
+            time.sleep(0.05)
+    finally:
+        killer.close()
+    replacement = pool.getconn()
+    assert not replacement.closed
+    assert backend_pid(replacement) != pid
+
+
+def test_returned_connection_is_rolled_back(make_pool):
+    pool = make_pool(maxconn=1)
+    conn = pool.getconn()
+    conn.cursor().execute('SELECT 1')
+    assert conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE
+    pool.putconn(conn)
+    assert conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_IDLE
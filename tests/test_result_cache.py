@@ -0,0 +1,78 @@
+import os
+import stat
+import time
+
+from result_cache import DISK, MEMORY, ResultCache
+
+
+def result(n, size=100):
+    return {'medications': [{'text': 'x' * size, 'n': n}]}
+
+
+def entry_size(value):
+    cache = ResultCache(max_memory_bytes=1 << 20)
+    cache.put('k', value)
+    return cache.memory_bytes
+
+
+def test_key_covers_lexicon_engine_and_fields():
+    key = ResultCache.key('<p>aspirin</p>', 'lex1', '2.1.1', ['text', 'rx_cui'])
+    assert key == ResultCache.key(b'<p>aspirin</p>', 'lex1', '2.1.1', ['rx_cui', 'text'])
+    assert key != ResultCache.key('<p>aspirin</p>', 'lex2', '2.1.1', ['text', 'rx_cui'])
+    assert key != ResultCache.key('<p>aspirin</p>', 'lex1', '2.1.2', ['text', 'rx_cui'])
+    assert key != ResultCache.key('<p>aspirin</p>', 'lex1', '2.1.1', None)
+
+
+def test_memory_tier_evicts_least_recently_used_by_size():
+    size = entry_size(result(0))
+    cache = ResultCache(max_memory_bytes=3 * size)
+    for n in range(3):
+        cache.put(f'k{n}', result(n))
+    assert cache.get('k0') == (result(0), MEMORY)  # k1 is now the least recently used
+    cache.put('k3', result(3))
+    assert cache.get('k1') == (None, None)
+    assert [cache.get(f'k{n}')[0] for n in (0, 2, 3)] == [result(0), result(2), result(3)]
+    assert cache.memory_bytes == 3 * size
+
+
+def test_oversized_result_is_not_kept_in_memory():
+    cache = ResultCache(max_memory_bytes=50)
+    cache.put('big', result(0))
+    assert cache.memory_bytes == 0
+    assert cache.get('big') == (None, None)
+
+
+def test_disk_tier_is_shared_and_promotes_hits(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    ResultCache(disk_path=path).put('k', result(1))
+    other_process = ResultCache(disk_path=path)
+    assert other_process.get('k') == (result(1), DISK)
+    assert other_process.get('k') == (result(1), MEMORY)
+    assert other_process.status()['disk_hits'] == 1
+
+
+def test_disk_tier_trims_least_recently_used(tmp_path):
+    size = entry_size(result(0))
+    cache = ResultCache(max_memory_bytes=0, disk_path=str(tmp_path / 'cache.db'), max_disk_bytes=3 * size)
+    cache.TRIM_EVERY = 1
+    for n in range(3):
+        cache.put(f'k{n}', result(n))
+        time.sleep(0.01)  # distinct last_used times
+    cache.get('k0')
+    time.sleep(0.01)
+    cache.put('k3', result(3))
+    assert cache.get('k1') == (None, None)
+    assert [cache.get(f'k{n}')[1] for n in (0, 2, 3)] == [DISK, DISK, DISK]
+
+
+def test_disk_tier_is_owner_only(tmp_path):
+    previous = os.umask(0)
+    try:
+        path = tmp_path / 'data' / 'cache.db'
+        cache = ResultCache(disk_path=str(path))
+        cache.put('k', result(1))
+    finally:
+        os.umask(previous)
+    assert stat.S_IMODE(os.stat(path.parent).st_mode) == 0o700
+    for name in os.listdir(path.parent):
+        assert stat.S_IMODE(os.stat(path.parent / name).st_mode) == 0o600, name
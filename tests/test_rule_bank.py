@@ -0,0 +1,37 @@
+from main import LocalMedicationLLM, NonActiveRuleBank
+
+PHRASES = [
+    'patient failed metoprolol last year',
+    'continue her metoprolol 25 mg',
+    'was on metoprolol for 3 months',
+    'metoprolol was switched to carvedilol',
+    'allergic to metoprolol (hives)',
+    'currently taking metoprolol and lisinopril',
+    'increase metoprolol to 50 mg',
+    'no mention of the drug here',
+]
+
+
+def test_compiled_bank_matches_per_pattern_search():
+    compiled, legacy = NonActiveRuleBank('metoprolol'), NonActiveRuleBank('metoprolol', compiled=False)
+    for phrase in PHRASES:
+        haystack = 'Assessment: ' + phrase.upper() + ' -- plan reviewed.'
+        for group in legacy.patterns:
+            for pos, endpos in ((0, None), (5, len(haystack) - 3), (12, 12 + len(phrase))):
+                assert compiled.matches(group, haystack, pos, endpos) == \
+                    legacy.matches(group, haystack, pos, endpos), (phrase, group, pos, endpos)
+
+
+def test_term_is_escaped():
+    bank = NonActiveRuleBank('amlodipine/benazepril')
+    assert bank.matches('non_active', 'stopped amlodipine/benazepril')
+    assert not bank.matches('non_active', 'stopped amlodipineXbenazepril')
+
+
+def test_extractor_rule_bank_matches_legacy_rules(pipeline, corpus_sample):
+    """Precompiled banks label every mention of real records as the per-call regexes did"""
+    lexicon = pipeline.rxnorm_mapper.rxnorm_db
+    banked = LocalMedicationLLM(lexicon, use_rule_bank=True)
+    legacy = LocalMedicationLLM(lexicon, use_rule_bank=False)
+    for _, html_text in corpus_sample:
+        assert banked.extract_medications(html_text) == legacy.extract_medications(html_text)
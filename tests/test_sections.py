@@ -0,0 +1,71 @@
+import random
+
+from main import ENGINE_PRESETS, DocumentSectionMap, DocumentWindowView, LocalMedicationLLM
+
+FILLER = '<p>' + 'Patient seen in clinic for follow up of chronic conditions. ' * 8 + '</p>'
+# CDA-style export: <h3> anchors titled by the Table of Contents; every mention
+# sits more than 300 characters below its heading, past the header-proximity checks
+DOCUMENT = ('<html><body>'
+            '<h2><a name="toc">Table of Contents</a></h2><ul><li><a href="#s1">Discontinued Medications</a></li>'
+            '<li><a href="#s2">Past Medications</a></li><li><a href="#s3">Plan</a></li></ul>'
+            '<h3><a name="s1">Section 1</a></h3>' + FILLER + '<p>Atenolol 25 mg daily.</p>'
+            '<h3><a name="s2">Section 2</a></h3>' + FILLER + '<p>Anastrozole 1 mg daily.</p>'
+            '<h3><a name="s3">Section 3</a></h3>' + FILLER + '<p>Apixaban 5 mg twice a day.</p>'
+            '</body></html>')
+
+
+def labels(pipeline, engine):
+    extractor = LocalMedicationLLM(pipeline.rxnorm_mapper.rxnorm_db, **ENGINE_PRESETS[engine])
+    return {med['text']: (med['active_status'], med.get('section')) for med in extractor.extract_medications(DOCUMENT)}
+
+
+def test_sections_are_titled_from_the_table_of_contents():
+    sections = DocumentSectionMap(DOCUMENT, LocalMedicationLLM.SECTION_HEADER_KINDS)
+    found = [(section.title, section.kind, section.level) for section in sections.sections]
+    assert found == [('Table of Contents', None, 2), ('Discontinued Medications', 'discontinued', 3),
+                     ('Past Medications', 'past', 3), ('Plan', None, 3)]
+    assert sections.kind_at(DOCUMENT.index('Atenolol')) == 'discontinued'
+    assert sections.kind_at(DOCUMENT.index('Anastrozole')) == 'past'
+    assert sections.kind_at(0) is None
+
+
+def test_default_engine_marks_past_and_discontinued_sections_non_active(pipeline):
+    assert labels(pipeline, 'default') == {
+        'Atenolol': ('non-active', 'Discontinued Medications'),
+        'Anastrozole': ('non-active', 'Past Medications'),
+        'Apixaban': ('active', 'Plan'),
+    }
+
+
+def test_exact_and_legacy_engines_keep_the_legacy_labels(pipeline):
+    assert labels(pipeline, 'legacy') == {'Atenolol': ('active', None), 'Anastrozole': ('active', None),
+                                          'Apixaban': ('active', None)}
+    assert labels(pipeline, 'exact') == {'Atenolol': ('active', 'Discontinued Medications'),
+                                         'Anastrozole': ('active', 'Past Medications'),
+                                         'Apixaban': ('active', 'Plan')}
+
+
+def test_header_index_answers_like_window_scan(corpus_sample):
+    rng = random.Random(4)
+    inline = {'discontinued': LocalMedicationLLM.DISCONTINUATION_HEADERS,
+              'past': LocalMedicationLLM.PAST_SECTION_HEADERS}
+    for _, html_text in corpus_sample:
+        sections = DocumentSectionMap(html_text, LocalMedicationLLM.SECTION_HEADER_KINDS, None, inline)
+        legacy = DocumentWindowView(html_text)
+        for offset in rng.sample(range(len(html_text)), 200):
+            for kind, cues in inline.items():
+                for distance in (200, 300):
+                    assert sections.header_before(kind, offset, distance) == \
+                        legacy.has_cue(cues, max(0, offset - distance), offset)
+
+
+def test_section_map_without_reclassification_matches_legacy_labels(pipeline, corpus_sample):
+    """With classify_by_section off, the section map changes no label on real records"""
+    lexicon = pipeline.rxnorm_mapper.rxnorm_db
+    mapped = LocalMedicationLLM(lexicon, use_sections=True, classify_by_section=False)
+    scanned = LocalMedicationLLM(lexicon, use_sections=False)
+    for _, html_text in corpus_sample:
+        with_sections = mapped.extract_medications(html_text)
+        for med in with_sections:
+            del med['section']
+        assert with_sections == scanned.extract_medications(html_text)
@@ -0,0 +1,48 @@
+import random
+
+from main import HTMLTextLayer, MedicationExtractionPipeline
+from conftest import LEXICON_CSV
+
+HTML = ('<html><head><title>Aspirin</title><style>p {color: red}</style></head><body>'
+        '<!-- metoprolol --><h3>Medications</h3><p>Aspirin&nbsp;81 mg</p>'
+        '<td>Met<b>o</b>prolol &amp; lisinopril</td><script>var x = "<p>";</script></body></html>')
+
+
+def test_text_layer_drops_markup():
+    layer = HTMLTextLayer(HTML)
+    assert layer.text == '\nMedications\nAspirin\xa081 mg\nMetoprolol & lisinopril\n'
+
+
+def test_spans_map_back_to_the_html_they_were_read_from():
+    layer = HTMLTextLayer(HTML)
+    for word, html_word in (('Medications', 'Medications'), ('81 mg', '81 mg'),
+                            ('Metoprolol', 'Met<b>o</b>prolol'), ('& lisinopril', '&amp; lisinopril')):
+        start = layer.text.index(word)
+        html_start, html_end = layer.to_html_span(start, start + len(word))
+        assert HTML[html_start:html_end] == html_word
+        assert layer.to_text_offset(html_start) == start
+
+
+def test_offsets_round_trip_on_records(corpus_sample):
+    rng = random.Random(5)
+    for _, html_text in corpus_sample:
+        layer = HTMLTextLayer(html_text)
+        for start in rng.sample(range(len(layer.text)), 200):
+            html_start, _ = layer.to_html_span(start, start + 1)
+            assert layer.to_text_offset(html_start) == start
+
+
+def test_text_mode_finds_the_html_mode_mentions(pipeline, corpus_sample):
+    """Text mode reports the same spans and concepts as the HTML path, with HTML offsets.
+
+    active_status is not compared: text mode drops the table markup the
+    classifier reads as a cue, so labels can differ (documented on the pipeline).
+    """
+    text_pipeline = MedicationExtractionPipeline(LEXICON_CSV, text_mode=True)
+    for name, html_text in corpus_sample:
+        in_text = text_pipeline.process_document(name, html_text)['medications']
+        in_html = pipeline.process_document(name, html_text)['medications']
+        for med in in_text:
+            assert html_text[med['start_offset']:med['end_offset']] == med['text']
+        assert [(med['start_offset'], med['end_offset'], med['rx_cui']) for med in in_text] == \
+            [(med['start_offset'], med['end_offset'], med['rx_cui']) for med in in_html]